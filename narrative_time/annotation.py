@@ -0,0 +1,116 @@
+"""NTAnnotation: a document with its events, timexes and relation matrix.
+
+Does not depend on torch, see modeling_utils.preprocess_document for the model inputs.
+"""
+
+from narrative_time import event_relations, conversion_cache
+
+
+class NTAnnotation:
+    """A class representing a Narrative Time annotation.
+
+    An `NTAnnotation` object contains information about the words in a document, the events and timexes mentioned in the
+    document, and the relations between these events. It is typically created from a JSON dictionary returned by the
+    Narrative Time annotation tool.
+
+    Attributes:
+        text (str): The text of the document.
+        events_and_timexes (List[Dict]): (output of conversion_utils.get_events_and_timexes) A list of dictionaries representing events and timexes in the document.
+            Each dictionary has the following keys:
+                - span (List[int]): A list of two integers representing the start and end indices (inclusive) of the event
+                  or timex span in the document text.
+                - is_timex (bool): A boolean indicating whether the span corresponds to a timex (True) or an event (False).
+                - eid (str): The event or timex identifier.
+                - event_type (str): The event or timex type.
+                - time (str): The time expression associated with the event or timex, if any.
+                - relto (str): The event or timex to which this event or timex is related, if any.
+                - factuality (str): The factuality of the event or timex.
+                - id (str): The unique identifier for the event or timex.
+        event_indices (List[str]): A list of event identifiers, in the same order as in `event_relation_matrix`.
+        event_relation_matrix (np.ndarray): An array of shape (num_events, num_events) representing the relations between
+            the events in the document. The i-th row and j-th column of the matrix contains the index of the relation
+            between the i-th and j-th events in `event_indices`. The relation index is mapped from the `event_relations`
+            module's `REL_TO_ID` dictionary.
+
+    Example:
+        >>> nt_annotation = NTAnnotation.from_json(json_dict)
+        >>> print(nt_annotation)
+        NTAnnotation(text='The cat sat on the mat.',
+                     events_and_timexes=[{'span': [0, 3],
+                                         'is_timex': False,
+                                         'eid': '0',
+                                         'event_type': '[B]',
+                                         'time': '',
+                                         'relto': '',
+                                         'factuality': '',
+                                         'id': 'ei0'},
+                                        {'span': [12, 15],
+                                         'is_timex': False,
+                                         'eid': '1',
+                                         'event_type': '[B]',
+                                         'time': '',
+                                         'relto': '',
+                                         'factuality': '',
+                                         'id': 'ei1'}],
+                     event_relation_matrix=[[-1, 1],
+                                            [2, -1]])
+    """
+    def __init__(self, doc_id, text, events_and_timexes, event_indices, event_relation_matrix):
+        self.doc_id = doc_id
+        self.text = text
+        self.events_and_timexes = events_and_timexes
+        self._event_indices = event_indices
+        self.event_id_to_numeric_id = {event_id: i for i, event_id in enumerate(self._event_indices)}
+        self.event_relation_matrix = event_relation_matrix
+
+    @classmethod
+    def from_json(cls, json_dict):
+        text = json_dict["text"]
+        doc_id = json_dict["id"]
+        # note that branches are ignored here: all pairs are compared with get_event_relation
+        # events and relations are loaded from the conversion cache if it is enabled (see conversion_cache)
+        events_and_timexes, event_relation_matrix = conversion_cache.convert_document(json_dict, use_branches=False)
+        events_and_timexes = [event | {"id": event_id} for event_id, event in events_and_timexes.items()]  # same as return_list=True
+        event_ids = [event["id"] for event in events_and_timexes]
+
+        return cls(doc_id, text, events_and_timexes, event_ids, event_relation_matrix)
+
+    @classmethod
+    def from_compiled(cls, corpus, doc_id):
+        """Same as from_json, but reads the document from a compiled corpus (compiled_corpus.CompiledCorpus)
+
+        Compile the corpus without use_global_eiid to get the same event ids as from_json.
+        """
+        events_and_timexes = corpus.events_and_timexes(doc_id)
+        event_ids = [event["id"] for event in events_and_timexes]
+
+        # note that branches are ignored here, same as in from_json
+        event_arrays = corpus.event_arrays(doc_id)
+        event_relation_matrix = event_relations.get_relation_matrix(event_arrays.starts, event_arrays.ends, event_arrays.types)
+
+        return cls(doc_id, corpus.text_of(doc_id), events_and_timexes, event_ids, event_relation_matrix)
+
+    @classmethod
+    def from_relation_bundle(cls, bundle):
+        """Reads the document from a relation bundle written by nt2tml --output_format npz
+        (timeml_corpus.load_relation_bundle or TimeMLCorpus.relation_bundle), no xml is parsed.
+
+        Unlike from_json, the relation matrix uses branches and event ids are the eiids of the TimeML files.
+        """
+        events_and_timexes = [event | {"id": event_id} for event_id, event in bundle["events_and_timexes"].items()]
+        event_ids = bundle["event_ids"].tolist()
+
+        return cls(bundle["doc_id"], bundle["text"], events_and_timexes, event_ids, bundle["relation_matrix"])
+
+    def __repr__(self):
+        event_repr = (str(e) for e in self.events_and_timexes[:3])
+        event_repr = "\n".join(event_repr)
+        event_repr = "\n" + event_repr + "\n  ..."
+        text_repr = self.text[:100].replace("\n", " ") + "..."
+        return f"NTAnnotation(text={text_repr}\nevents_and_timexes={event_repr}\nevent_relation_matrix:\n{self.event_relation_matrix})"
+
+    def __str__(self):
+        return self.__repr__()
+
+    def __len__(self):
+        return len(self.events_and_timexes)
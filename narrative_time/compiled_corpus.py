@@ -0,0 +1,280 @@
+"""Compiled columnar format for NarrativeTime corpora.
+
+Converting a corpus (json parsing, get_events_and_timexes, parsing of times like "-0.1" and "1:6")
+is done once and saved as a directory of .npy files, one array per column.
+Arrays are loaded with numpy memory mapping, so opening a compiled corpus does not read the data
+and arrays for a single document are views into the files.
+
+Usage example:
+    python narrative_time/compiled_corpus.py \
+        --input_file corpus/timebank/nt_format/tbd_a1.jsonl \
+        --output_dir corpus/compiled/tbd_a1
+"""
+
+import os
+import json
+import argparse
+
+import numpy as np
+from loguru import logger
+
+from narrative_time import conversion_utils
+from narrative_time.event_relations import EventArrays, EventRecord, TYPE_TO_ID, encode_events, get_relation_matrix
+
+
+COMPILED_CORPUS_VERSION = 2
+METADATA_FILE = "metadata.json"
+
+# same order as FactBank codes in nt2tml: CT+, CT-, PS+, PS-
+FACTUALITY_TO_ID = {"": 0, "-": 1, "m": 2, "m-": 3}
+ID_TO_FACTUALITY = list(FACTUALITY_TO_ID.keys())
+ID_TO_TYPE = {type_id: event_type for event_type, type_id in TYPE_TO_ID.items()}
+
+# per-event columns
+#   event_ids, times, factuality (int8, FACTUALITY_TO_ID), is_timex, is_visible, spans (int32, [left, right])
+#   starts, ends, types, branches, is_point: EventArrays (see event_relations.encode_events), branches are per-document ids
+# per-branch columns
+#   branch_names, branch_intervals: branch strings and intervals of each document, row 0 is the main timeline
+# per-document columns
+#   doc_ids, event_offsets, branch_offsets, text_offsets (n_documents + 1, document i is [offsets[i], offsets[i + 1]))
+#   text: utf-8 bytes of all texts
+COLUMNS = [
+    "doc_ids", "event_offsets", "branch_offsets", "text_offsets", "text",
+    "event_ids", "times", "factuality", "is_timex", "is_visible", "spans",
+    "starts", "ends", "types", "branches", "is_point",
+    "branch_names", "branch_intervals",
+]
+
+
+def _source_stat(input_file):
+    stat = os.stat(input_file)
+    return {"source": os.path.abspath(input_file), "source_size": stat.st_size, "source_mtime_ns": stat.st_mtime_ns}
+
+
+def compile_corpus(input_file, output_dir, use_global_eiid=False):
+    """Converts NarrativeTime jsonl file into a compiled corpus.
+
+    Documents that can not be converted are skipped, their ids and errors are saved in the metadata.
+
+    Args:
+        input_file: jsonl file in NarrativeTime format
+        output_dir: directory for the .npy files
+        use_global_eiid: generate eiids with a running offset over the corpus (same as nt2tml),
+            by default every document starts from ei0 (same as NTAnnotation.from_json)
+
+    Returns:
+        CompiledCorpus
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    metadata_path = os.path.join(output_dir, METADATA_FILE)
+    if os.path.exists(metadata_path):
+        os.remove(metadata_path)  # metadata is written last, partially written corpus is never loaded
+
+    source_stat = _source_stat(input_file)
+    columns = {name: [] for name in COLUMNS}
+    event_offsets, branch_offsets, text_offsets = [0], [0], [0]
+    errors = {}
+    corpus_offset = 0
+
+    for annotation in conversion_utils.iter_annotations(input_file):
+        try:
+            events_and_timexes = conversion_utils.get_events_and_timexes(annotation, corpus_offset=corpus_offset)
+            records = [EventRecord.from_dict(event, id=eeid) for eeid, event in events_and_timexes.items()]
+            event_arrays = encode_events(records)
+            factuality = [FACTUALITY_TO_ID[event["factuality"]] for event in events_and_timexes.values()]
+        except Exception as e:
+            logger.error(f"Error converting {annotation['id']}: {e}")
+            errors[annotation["id"]] = str(e)
+            continue
+
+        if use_global_eiid:
+            corpus_offset += len(annotation["events"])  # same as nt2tml, failed documents do not move the offset
+
+        # encode_events assigns branch ids in order of appearance
+        branch_names = [""] + list(dict.fromkeys(r.branch for r in records if r.branch != ""))
+
+        columns["doc_ids"].append(annotation["id"])
+        text = annotation["text"].encode("utf-8")
+        columns["text"].append(np.frombuffer(text, dtype=np.uint8))
+        text_offsets.append(text_offsets[-1] + len(text))
+
+        columns["event_ids"].extend(events_and_timexes.keys())
+        columns["times"].extend(event["time"] for event in events_and_timexes.values())
+        columns["factuality"].extend(factuality)
+        columns["is_timex"].extend(event["is_timex"] for event in events_and_timexes.values())
+        columns["is_visible"].extend(event["is_visible_during_annotation"] for event in events_and_timexes.values())
+        columns["spans"].extend(event["span"] for event in events_and_timexes.values())
+        for name in ["starts", "ends", "types", "branches", "is_point"]:
+            columns[name].append(getattr(event_arrays, name))
+        event_offsets.append(event_offsets[-1] + len(records))
+
+        columns["branch_names"].extend(branch_names)
+        columns["branch_intervals"].append(event_arrays.branch_intervals)
+        branch_offsets.append(branch_offsets[-1] + len(branch_names))
+
+    arrays = {
+        "doc_ids": np.array(columns["doc_ids"], dtype=str),
+        "event_offsets": np.array(event_offsets, dtype=np.int64),
+        "branch_offsets": np.array(branch_offsets, dtype=np.int64),
+        "text_offsets": np.array(text_offsets, dtype=np.int64),
+        "text": np.concatenate(columns["text"] or [np.empty(0, dtype=np.uint8)]),
+        "event_ids": np.array(columns["event_ids"], dtype=str),
+        "times": np.array(columns["times"], dtype=str),
+        "factuality": np.array(columns["factuality"], dtype=np.int8),
+        "is_timex": np.array(columns["is_timex"], dtype=bool),
+        "is_visible": np.array(columns["is_visible"], dtype=bool),
+        "spans": np.array(columns["spans"], dtype=np.int32).reshape(-1, 2),
+        "starts": np.concatenate(columns["starts"] or [np.empty(0, dtype=np.float64)]),
+        "ends": np.concatenate(columns["ends"] or [np.empty(0, dtype=np.float64)]),
+        "types": np.concatenate(columns["types"] or [np.empty(0, dtype=np.int8)]),
+        "branches": np.concatenate(columns["branches"] or [np.empty(0, dtype=np.int32)]),
+        "is_point": np.concatenate(columns["is_point"] or [np.empty(0, dtype=bool)]),
+        "branch_names": np.array(columns["branch_names"], dtype=str),
+        "branch_intervals": np.concatenate(columns["branch_intervals"] or [np.empty((0, 2), dtype=np.float64)]),
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(output_dir, f"{name}.npy"), array)
+
+    metadata = {
+        "version": COMPILED_CORPUS_VERSION,
+        **source_stat,
+        "use_global_eiid": use_global_eiid,
+        "n_documents": len(columns["doc_ids"]),
+        "n_events": event_offsets[-1],
+        "errors": errors,
+    }
+    with open(metadata_path, "w") as f:
+        json.dump(metadata, f, indent=2)
+
+    return CompiledCorpus(output_dir)
+
+
+def get_compiled_corpus(input_file, output_dir, use_global_eiid=False):
+    """Loads the compiled corpus from output_dir, compiling it if it is missing or input_file changed"""
+    metadata_path = os.path.join(output_dir, METADATA_FILE)
+    if os.path.exists(metadata_path):
+        with open(metadata_path) as f:
+            metadata = json.load(f)
+
+        is_up_to_date = (
+            metadata["version"] == COMPILED_CORPUS_VERSION
+            and metadata["use_global_eiid"] == use_global_eiid
+            and all(metadata[k] == v for k, v in _source_stat(input_file).items())
+        )
+        if is_up_to_date:
+            return CompiledCorpus(output_dir)
+
+    logger.info(f"Compiling {input_file} into {output_dir}")
+    return compile_corpus(input_file, output_dir, use_global_eiid=use_global_eiid)
+
+
+class CompiledCorpus:
+    """Read-only memory-mapped view of a compiled corpus (see compile_corpus).
+
+    Documents can be addressed by id or by position. All per-document arrays are views into the memory-mapped files.
+
+    Example:
+        >>> corpus = CompiledCorpus("corpus/compiled/tbd_a1")
+        >>> relations = get_relation_matrix(*corpus.event_arrays("ABC19980108.1830.0711"))
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, METADATA_FILE)) as f:
+            self.metadata = json.load(f)
+
+        if self.metadata["version"] != COMPILED_CORPUS_VERSION:
+            raise RuntimeError(f"Compiled corpus version {self.metadata['version']} is not supported, "
+                               f"recompile it with compile_corpus (version {COMPILED_CORPUS_VERSION})")
+
+        for name in COLUMNS:
+            setattr(self, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r"))
+
+        self._doc_id_to_idx = {doc_id: i for i, doc_id in enumerate(self.doc_ids.tolist())}
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._doc_id_to_idx
+
+    def __iter__(self):
+        return iter(self._doc_id_to_idx)
+
+    def _idx(self, doc):
+        return self._doc_id_to_idx[doc] if isinstance(doc, str) else doc
+
+    def events(self, doc):
+        """slice of the per-event columns for the document (id or position)"""
+        idx = self._idx(doc)
+        return slice(int(self.event_offsets[idx]), int(self.event_offsets[idx + 1]))
+
+    def _branches(self, doc):
+        idx = self._idx(doc)
+        return slice(int(self.branch_offsets[idx]), int(self.branch_offsets[idx + 1]))
+
+    def n_events(self, doc):
+        idx = self._idx(doc)
+        return int(self.event_offsets[idx + 1] - self.event_offsets[idx])
+
+    def text_of(self, doc):
+        idx = self._idx(doc)
+        return self.text[self.text_offsets[idx]:self.text_offsets[idx + 1]].tobytes().decode("utf-8")
+
+    def event_ids_of(self, doc):
+        return self.event_ids[self.events(doc)].tolist()
+
+    def event_arrays(self, doc):
+        """EventArrays of the document, same as encode_events on the output of get_events_and_timexes"""
+        events = self.events(doc)
+        return EventArrays(
+            self.starts[events],
+            self.ends[events],
+            self.types[events],
+            self.branches[events],
+            self.branch_intervals[self._branches(doc)],
+            self.is_point[events],
+        )
+
+    def relation_matrix(self, doc):
+        return get_relation_matrix(*self.event_arrays(doc))
+
+    def events_and_timexes(self, doc):
+        """List of event dictionaries (same format as get_events_and_timexes(return_list=True)),
+        with NarrativeTime fields only (no TimeML metadata)
+        """
+        events = self.events(doc)
+        branch_names = self.branch_names[self._branches(doc)].tolist()
+        return [
+            {
+                "span": span,
+                "is_timex": is_timex,
+                "is_visible_during_annotation": is_visible,
+                "event_type": ID_TO_TYPE[type_id],
+                "time": time,
+                "branch": branch_names[branch],
+                "factuality": ID_TO_FACTUALITY[factuality],
+                "id": event_id,
+            }
+            for span, is_timex, is_visible, type_id, time, branch, factuality, event_id in zip(
+                self.spans[events].tolist(),
+                self.is_timex[events].tolist(),
+                self.is_visible[events].tolist(),
+                self.types[events].tolist(),
+                self.times[events].tolist(),
+                self.branches[events].tolist(),
+                self.factuality[events].tolist(),
+                self.event_ids[events].tolist(),
+            )
+        ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input_file", required=True, help="jsonl data file in NarrativeTime format, can be compressed (.gz, .xz, .zst)")
+    parser.add_argument("--output_dir", required=True, help="folder for saving the compiled corpus")
+    parser.add_argument("--use_global_eiid", default=False, action="store_true", help="Generate eiids with a running offset over the corpus, same as nt2tml.")
+    args = parser.parse_args()
+
+    corpus = compile_corpus(args.input_file, args.output_dir, use_global_eiid=args.use_global_eiid)
+    logger.info(f"Compiled {len(corpus)} documents ({corpus.metadata['n_events']} events), "
+                f"{len(corpus.metadata['errors'])} errors")
@@ -0,0 +1,255 @@
+"""Temporal consistency checks for relation matrices
+
+Relation matrices (output of event_relations.get_relation_matrix, NTAnnotation.event_relation_matrix,
+model predictions) use REL_TO_ID coding. Relations are represented as bitsets of possible relations:
+bit r is set if relation with id r is possible. VAGUE (and -1, missing) means any relation is possible.
+
+Composition of relations is derived from the relations between bounded events
+(CONVERION_TABLE[("[B]", "[B]")]), so it follows exactly the same conventions as the converter,
+e.g. point events that touch are BEFORE/AFTER and both kinds of overlap are OVERLAP.
+"""
+
+import itertools
+
+import numpy as np
+
+from narrative_time.event_relations import REL_TO_ID, INVERSE_REL_ID, CONVERION_TABLE, Interval, get_interval_relation
+
+
+BASE_RELATIONS = [r for r in REL_TO_ID if r != "VAGUE"]
+ALL_RELATIONS = sum(1 << REL_TO_ID[r] for r in BASE_RELATIONS)  # bitset for VAGUE
+
+
+def _compile_composition_table(max_time=6):
+    """Relations possible between A and C given relations between A and B and between B and C.
+
+    Enumerates all triples of bounded intervals with integer ends in [0, max_time).
+    Three intervals have at most 6 different ends, so max_time=6 covers all configurations.
+
+    Returns:
+        np.ndarray: uint8 array of shape (n_relations, n_relations) with bitsets, indexed by REL_TO_ID values
+    """
+    conversion = CONVERION_TABLE[("[B]", "[B]")]
+    intervals = [Interval(start, end) for start in range(max_time) for end in range(start, max_time)]
+
+    n_relations = len(REL_TO_ID)
+    table = np.zeros((n_relations, n_relations), dtype=np.uint8)
+    for a, b, c in itertools.product(intervals, repeat=3):
+        ab = REL_TO_ID[conversion[get_interval_relation(a, b)]]
+        bc = REL_TO_ID[conversion[get_interval_relation(b, c)]]
+        ac = REL_TO_ID[conversion[get_interval_relation(a, c)]]
+        table[ab, bc] |= 1 << ac
+
+    table[REL_TO_ID["VAGUE"], :] = ALL_RELATIONS
+    table[:, REL_TO_ID["VAGUE"]] = ALL_RELATIONS
+    return table
+
+
+COMPOSITION_TABLE = _compile_composition_table()
+
+
+def _compile_set_composition_table():
+    """Same as COMPOSITION_TABLE, but indexed by bitsets instead of relation ids"""
+    n_sets = ALL_RELATIONS + 1
+    table = np.zeros((n_sets, n_sets), dtype=np.uint8)
+    for set1, set2 in itertools.product(range(n_sets), repeat=2):
+        for r1, r2 in itertools.product(range(len(BASE_RELATIONS)), repeat=2):
+            if set1 & (1 << r1) and set2 & (1 << r2):
+                table[set1, set2] |= COMPOSITION_TABLE[r1, r2]
+    return table
+
+
+SET_COMPOSITION_TABLE = _compile_set_composition_table()
+
+
+def to_bitsets(relation_matrix):
+    """Convert relation matrix with REL_TO_ID values into a matrix of bitsets.
+
+    VAGUE and missing (-1) relations become "any relation", the diagonal is SIMULTANEOUS.
+    """
+    relation_matrix = np.asarray(relation_matrix)
+    known = (relation_matrix >= 0) & (relation_matrix != REL_TO_ID["VAGUE"])
+
+    bitsets = np.full(relation_matrix.shape, ALL_RELATIONS, dtype=np.uint8)
+    bitsets[known] = np.left_shift(1, relation_matrix[known]).astype(np.uint8)
+    np.fill_diagonal(bitsets, 1 << REL_TO_ID["SIMULTANEOUS"])
+    return bitsets
+
+
+def find_inconsistent_triples(relation_matrix, max_triples=None):
+    """Find triples of events whose relations can not all be true at the same time.
+
+    A triple (i, k, j) is inconsistent if relation[i, j] is not one of the relations
+    that can follow from relation[i, k] and relation[k, j] (see COMPOSITION_TABLE).
+    Only non-VAGUE relations are checked. Candidate (i, j) pairs are found with boolean matrix products,
+    one per pair of relations, so the cost is a few BLAS calls on (n_events, n_events) matrices.
+
+    Args:
+        relation_matrix: int array of shape (n_events, n_events) with REL_TO_ID values (-1 on the diagonal)
+        max_triples: (optional) stop after finding this many triples
+
+    Returns:
+        np.ndarray: int array of shape (n_triples, 3) with (i, k, j) rows, sorted
+    """
+    relation_matrix = np.asarray(relation_matrix)
+    one_hot = {r: (relation_matrix == r).astype(np.float32) for r in range(len(BASE_RELATIONS))}
+    present = [r for r, m in one_hot.items() if m.any()]
+
+    triples = []
+    for r_ij in present:
+        target = relation_matrix == r_ij
+        for r_ik in present:
+            # relations of (k, j) that rule out r_ij
+            excluding = [r_kj for r_kj in present if not COMPOSITION_TABLE[r_ik, r_kj] & (1 << r_ij)]
+            if not excluding:
+                continue
+
+            excluding_kj = sum(one_hot[r] for r in excluding)
+            n_paths = one_hot[r_ik] @ excluding_kj
+            for i, j in zip(*np.nonzero(target & (n_paths > 0))):
+                for k in np.flatnonzero(one_hot[r_ik][i] * excluding_kj[:, j]):
+                    triples.append((i, k, j))
+
+            if max_triples is not None and len(triples) >= max_triples:
+                return np.array(sorted(triples)[:max_triples], dtype=np.int64).reshape(-1, 3)
+
+    return np.array(sorted(triples), dtype=np.int64).reshape(-1, 3)
+
+
+def propagate(relation_matrix, max_iterations=None):
+    """Path consistency: remove relations that are not supported by any path of length 2, until nothing changes.
+
+    relation[i, j] &= relation[i, k] o relation[k, j] for all k
+
+    Args:
+        relation_matrix: int array of shape (n_events, n_events) with REL_TO_ID values (-1 on the diagonal)
+        max_iterations: (optional) maximum number of passes over k
+
+    Returns:
+        (np.ndarray, bool): bitsets of possible relations (see to_bitsets) after propagation
+            and whether the matrix is consistent (no pair of events is left without a possible relation)
+    """
+    bitsets = to_bitsets(relation_matrix)
+    n_events = len(bitsets)
+
+    iteration = 0
+    changed = True
+    while changed and (max_iterations is None or iteration < max_iterations):
+        changed = False
+        iteration += 1
+        for k in range(n_events):
+            composed = SET_COMPOSITION_TABLE[bitsets[:, k, None], bitsets[None, k, :]]
+            updated = bitsets & composed
+            if not np.array_equal(updated, bitsets):
+                changed = True
+                bitsets = updated
+
+        if np.any(bitsets == 0):
+            return bitsets, False
+
+    return bitsets, True
+
+
+def _is_asymmetric(relation_matrix):
+    """Pairs where relation of (j, i) is not the inverse of relation of (i, j), both relations known"""
+    known = relation_matrix >= 0
+    return known & known.T & (relation_matrix != INVERSE_REL_ID[relation_matrix.T])
+
+
+def expand_relations(reduced_matrix):
+    """Restore the full relation matrix from the output of reduce_relations.
+
+    Missing (-1) pairs get the inverse of the other direction if it is known,
+    otherwise the relation that follows from the known pairs by path consistency (see propagate),
+    or VAGUE if the relation does not follow from them.
+    Pairs written in both directions where one is not the inverse of the other are not used for propagation.
+
+    Args:
+        reduced_matrix: int array of shape (n_events, n_events) with REL_TO_ID values, -1 for missing pairs
+
+    Returns:
+        np.ndarray: int8 array of shape (n_events, n_events) with REL_TO_ID values, -1 on the diagonal
+    """
+    matrix = np.array(reduced_matrix, dtype=np.int8)
+    np.fill_diagonal(matrix, -1)
+    missing = (matrix == -1) & (matrix.T != -1)
+    matrix[missing] = INVERSE_REL_ID[matrix.T[missing]]
+
+    constraints = matrix.copy()
+    constraints[_is_asymmetric(matrix)] = REL_TO_ID["VAGUE"]
+    bitsets, _ = propagate(constraints)
+
+    expanded = np.full(matrix.shape, REL_TO_ID["VAGUE"], dtype=np.int8)
+    single = (bitsets != 0) & ((bitsets & (bitsets - 1)) == 0)
+    expanded[single] = np.log2(bitsets[single]).astype(np.int8)
+
+    explicit = matrix != -1
+    expanded[explicit] = matrix[explicit]
+    np.fill_diagonal(expanded, -1)
+    return expanded
+
+
+def verify_reduction(reduced_matrix, relation_matrix):
+    """(i, j) pairs where expand_relations(reduced_matrix) differs from relation_matrix, empty if the reduction is exact
+
+    Returns:
+        np.ndarray: int array of shape (n_mismatches, 2)
+    """
+    expanded = expand_relations(reduced_matrix)
+    return np.argwhere(expanded != np.asarray(relation_matrix))
+
+
+def reduce_relations(relation_matrix):
+    """Minimal set of relations from which the relation matrix can be restored with expand_relations.
+
+    Similar to the transitive reduction: events are ranked by the number of events they are AFTER,
+    and pairs are visited by the distance between their ranks. A pair is dropped if its relation is the only
+    possible composition of the relations of two pairs through another event that are already known
+    (kept or dropped before), e.g. A BEFORE C follows from A BEFORE B and B BEFORE C.
+    VAGUE pairs are dropped too. Pairs that expand_relations does not restore exactly
+    (e.g. if the matrix is not consistent) are kept.
+
+    For a timeline of N ordered events, N - 1 relations are kept instead of N * (N - 1) / 2.
+
+    Args:
+        relation_matrix: int array of shape (n_events, n_events) with REL_TO_ID values (-1 on the diagonal)
+
+    Returns:
+        np.ndarray: int8 array of shape (n_events, n_events), relation_matrix with -1 for dropped pairs.
+            Only one direction of a pair is kept (the upper triangle), unless the other one is not its inverse.
+    """
+    relation_matrix = np.asarray(relation_matrix, dtype=np.int8)
+    n_events = len(relation_matrix)
+    vague = REL_TO_ID["VAGUE"]
+    asymmetric = _is_asymmetric(relation_matrix)
+
+    reduced = np.full((n_events, n_events), -1, dtype=np.int8)
+    reduced[asymmetric] = relation_matrix[asymmetric]
+
+    known = np.zeros((n_events, n_events), dtype=bool)  # pairs that expand_relations will restore
+    ranks = np.argsort((relation_matrix == REL_TO_ID["AFTER"]).sum(axis=1), kind="stable")
+    for distance in range(1, n_events):
+        rows, cols = ranks[:-distance], ranks[distance:]
+        relations = relation_matrix[rows, cols]
+
+        # composition of (i, k) and (k, j) for every k, only for known pairs
+        composed = COMPOSITION_TABLE[relation_matrix[rows], relation_matrix[:, cols].T]
+        through_known = known[rows] & known[:, cols].T
+        follows = (through_known & (composed == np.left_shift(1, relations.astype(np.int64))[:, None])).any(axis=1)
+
+        keep = ~follows & (relations != vague) & ~asymmetric[rows, cols]
+        kept_rows, kept_cols = np.minimum(rows[keep], cols[keep]), np.maximum(rows[keep], cols[keep])
+        reduced[kept_rows, kept_cols] = relation_matrix[kept_rows, kept_cols]
+
+        is_known = (relations != vague) & ~asymmetric[rows, cols]
+        known[rows[is_known], cols[is_known]] = True
+        known[cols[is_known], rows[is_known]] = True
+
+    # keep the pairs that are not restored, propagation can go further than a single composition
+    mismatches = verify_reduction(reduced, relation_matrix)
+    while len(mismatches) > 0:
+        rows, cols = np.minimum(mismatches[:, 0], mismatches[:, 1]), np.maximum(mismatches[:, 0], mismatches[:, 1])
+        reduced[rows, cols] = relation_matrix[rows, cols]
+        mismatches = verify_reduction(reduced, relation_matrix)
+
+    return reduced
@@ -0,0 +1,225 @@
+"""Persistent cache for converted documents.
+
+Stores the output of get_events_and_timexes and the relation matrix of a document on disk,
+keyed by a hash of the document json, conversion parameters and CONVERSION_VERSION.
+Unchanged documents are loaded from the cache instead of being converted again.
+
+The cache is opt-in: set NARRATIVE_TIME_CACHE_DIR environment variable
+(and optionally NARRATIVE_TIME_CACHE_SIZE, in bytes) or call set_default_cache.
+When the total size of the cache exceeds the limit, least recently used entries are deleted.
+"""
+
+import os
+import json
+import hashlib
+
+import numpy as np
+from loguru import logger
+
+from narrative_time import conversion_utils, event_relations
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# bump this when conversion_utils or event_relations change their outputs, old cache entries will not be used
+CONVERSION_VERSION = 2
+DEFAULT_CACHE_SIZE = 1 << 30  # 1 GiB
+
+_default_cache = None
+_default_cache_is_set = False
+
+
+def _loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _dumps(obj):
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+def _hash(params, annotation):
+    """sha256 of CONVERSION_VERSION, params and the document json
+
+    Always serialized with json (not orjson), so hashes do not depend on the installed packages.
+    """
+    key = hashlib.sha256()
+    for obj in [{"version": CONVERSION_VERSION, **params}, annotation]:
+        key.update(json.dumps(obj, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf-8"))
+    return key.hexdigest()
+
+
+def document_hash(annotation):
+    """sha256 of the document json and CONVERSION_VERSION, changes when the document or the conversion changes"""
+    return _hash({}, annotation)
+
+
+def convert_document(annotation, corpus_offset=0, use_branches=True, cache=None):
+    """get_events_and_timexes and relation matrix of a document, loaded from cache if possible.
+
+    Args:
+        annotation: normalized NarrativeTime annotation (see conversion_utils.get_annotations)
+        corpus_offset: see conversion_utils.get_events_and_timexes
+        use_branches: use branch information for relations (nt2tml) or ignore it (NTAnnotation)
+        cache: ConversionCache, by default get_default_cache() is used (no caching if it is not set)
+
+    Returns:
+        (dict, np.ndarray): events_and_timexes (same as get_events_and_timexes) and int8 relation matrix
+            in the order of events_and_timexes
+    """
+    if cache is None:
+        cache = get_default_cache()
+    if cache is not None:
+        return cache.convert(annotation, corpus_offset=corpus_offset, use_branches=use_branches)
+
+    return _convert_document(annotation, corpus_offset=corpus_offset, use_branches=use_branches)
+
+
+def _convert_document(annotation, corpus_offset, use_branches):
+    events_and_timexes = conversion_utils.get_events_and_timexes(annotation, corpus_offset=corpus_offset)
+    records = [event_relations.EventRecord.from_dict(event, id=eeid) for eeid, event in events_and_timexes.items()]
+    event_arrays = event_relations.encode_events(records)
+    if not use_branches:
+        event_arrays = event_arrays[:3]  # starts, ends, types
+
+    relation_matrix = event_relations.get_relation_matrix(*event_arrays)
+    return events_and_timexes, relation_matrix
+
+
+class NpzCache:
+    """Directory with one .npz file per key, least recently used files are deleted when it exceeds max_size.
+
+    Args:
+        cache_dir: directory for the cache files, created if it does not exist
+        max_size: maximum total size of the cache files in bytes
+    """
+    def __init__(self, cache_dir, max_size=DEFAULT_CACHE_SIZE):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(cache_dir, exist_ok=True)
+        self._size = sum(size for _, size, _ in self._entries())
+
+    def _entries(self):
+        """(path, size, last access time) of every cache entry"""
+        entries = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if not entry.name.endswith(".npz"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue  # deleted by another process
+                entries.append((entry.path, stat.st_size, stat.st_mtime_ns))
+        return entries
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npz")
+
+    def get_arrays(self, key):
+        """Returns a dictionary of arrays saved with put_arrays or None if the key is not in the cache"""
+        path = self._path(key)
+        try:
+            with np.load(path) as entry:
+                arrays = {name: entry[name] for name in entry.files}
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Removing broken cache entry {path}: {e}")
+            self._remove(path)
+            return None
+
+        try:
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:
+            pass
+        return arrays
+
+    def put_arrays(self, key, **arrays):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **arrays)
+        self._size += os.path.getsize(tmp_path)
+        os.replace(tmp_path, path)
+
+        if self._size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        """Deletes least recently used entries until the cache fits into max_size"""
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        self._size = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if self._size <= self.max_size:
+                break
+            self._remove(path)
+            self._size -= size
+
+    def clear(self):
+        for path, _, _ in self._entries():
+            self._remove(path)
+        self._size = 0
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def __len__(self):
+        return len(self._entries())
+
+
+class ConversionCache(NpzCache):
+    """Directory with one .npz file per converted document."""
+    @staticmethod
+    def make_key(annotation, **params):
+        """sha256 of the document json, conversion parameters and CONVERSION_VERSION"""
+        return _hash(params, annotation)
+
+    def get(self, key):
+        """Returns (events_and_timexes, relation_matrix) or None if the key is not in the cache"""
+        entry = self.get_arrays(key)
+        if entry is None:
+            return None
+        return _loads(entry["events_and_timexes"].tobytes()), entry["relation_matrix"]
+
+    def put(self, key, events_and_timexes, relation_matrix):
+        self.put_arrays(
+            key,
+            events_and_timexes=np.frombuffer(_dumps(events_and_timexes), dtype=np.uint8),
+            relation_matrix=np.asarray(relation_matrix, dtype=np.int8),
+        )
+
+    def convert(self, annotation, corpus_offset=0, use_branches=True):
+        """Same as convert_document, using this cache"""
+        key = self.make_key(annotation, corpus_offset=corpus_offset, use_branches=use_branches)
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+
+        events_and_timexes, relation_matrix = _convert_document(annotation, corpus_offset, use_branches)
+        self.put(key, events_and_timexes, relation_matrix)
+        return events_and_timexes, relation_matrix
+
+
+def set_default_cache(cache):
+    """Sets the cache used by convert_document by default (NTAnnotation.from_json, nt2tml). None disables caching."""
+    global _default_cache, _default_cache_is_set
+    _default_cache = cache
+    _default_cache_is_set = True
+
+
+def get_default_cache():
+    """Cache set with set_default_cache or created from NARRATIVE_TIME_CACHE_DIR environment variable"""
+    if not _default_cache_is_set and os.environ.get("NARRATIVE_TIME_CACHE_DIR"):
+        max_size = int(os.environ.get("NARRATIVE_TIME_CACHE_SIZE", DEFAULT_CACHE_SIZE))
+        set_default_cache(ConversionCache(os.environ["NARRATIVE_TIME_CACHE_DIR"], max_size=max_size))
+    return _default_cache
@@ -1,36 +1,331 @@
+import io
+import os
+import gzip
 import json
-from copy import deepcopy
+import lzma
+import zlib
+import bisect
+import hashlib
 from typing import List, Dict
 from loguru import logger
 
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
 
 TYPE_TO_NAME = ["[B]", "[C]", "{U}", "[U}", "{U]", "[R>", "<R]"]
 NAME_TO_TYPE = {name: idx for idx, name in enumerate(TYPE_TO_NAME)}
 ADD_DEBUG_INFO = False
 
 
-def get_annotations(path, as_dict=False):
-    data = []
-    data_dict = {}
+def normalize_annotation(document):
+    """Prepares a parsed NarrativeTime json document for conversion (modifies the document in place)"""
+    # we rename "type" to "event_type" to avoid collision
+    # with TIMEX3 "type" from the timebank metadata
+    event_order = {}
+    for idx, event in document["event_order"].items():
+        event["event_type"] = event.pop("type")
+        event_order[idx] = event
+
+    document["event_order"] = event_order
+    return document
+
+
+COMPRESSED_SUFFIXES = (".gz", ".xz", ".zst")
+_READ_BUFFER_SIZE = 1 << 20  # bytes of decompressed data buffered when reading compressed files
+
+
+def is_compressed(path):
+    return str(path).endswith(COMPRESSED_SUFFIXES)
+
+
+def open_annotation_file(path):
+    """Opens jsonl file for reading in binary mode.
+
+    .gz, .xz and .zst (requires zstandard package) files are decompressed as a stream
+    without writing the decompressed file to disk.
+    """
+    path = str(path)
+    if path.endswith(".gz"):
+        return io.BufferedReader(gzip.open(path, "rb"), buffer_size=_READ_BUFFER_SIZE)
+    if path.endswith(".xz"):
+        return io.BufferedReader(lzma.open(path, "rb"), buffer_size=_READ_BUFFER_SIZE)
+    if path.endswith(".zst"):
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError(f"zstandard package is required to read {path}: pip install zstandard")
+
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+        return io.BufferedReader(reader, buffer_size=_READ_BUFFER_SIZE)
+
+    return open(path, "rb")
+
+
+def parse_shard(shard):
+    """Parses shard specification "i/n" (shard i out of n, 0 <= i < n) into a tuple (i, n)"""
+    if isinstance(shard, tuple):
+        shard_idx, n_shards = shard
+    else:
+        try:
+            shard_idx, n_shards = (int(x) for x in shard.split("/"))
+        except ValueError:
+            raise ValueError(f"Shard should be specified as i/n, got {shard}")
+
+    if not 0 <= shard_idx < n_shards:
+        raise ValueError(f"Shard index should be in [0, {n_shards}), got {shard_idx}")
+    return shard_idx, n_shards
+
+
+SHARD_BY = ["index", "hash"]
 
-    with open(path) as f:
+
+def in_shard(doc_idx, doc_id, shard, shard_by="index"):
+    """Whether the document belongs to the shard.
+
+    Args:
+        doc_idx: position of the document in the file
+        doc_id: document id
+        shard: (i, n) tuple, see parse_shard
+        shard_by: "index" (round-robin over document positions) or "hash" (crc32 of the document id,
+            does not depend on the order of documents in the file)
+    """
+    shard_idx, n_shards = shard
+    if shard_by == "index":
+        return doc_idx % n_shards == shard_idx
+    if shard_by == "hash":
+        return zlib.crc32(doc_id.encode("utf-8")) % n_shards == shard_idx
+    raise ValueError(f"shard_by should be one of {SHARD_BY}, got {shard_by}")
+
+
+def iter_annotations(path, shard=None, shard_by="index"):
+    """Reads NarrativeTime jsonl file one document at a time.
+
+    Only one document is kept in memory, use this instead of get_annotations for large corpora.
+    Compressed files are supported, see open_annotation_file.
+    Uses orjson for parsing if it is installed.
+
+    Args:
+        path: path to the jsonl file
+        shard: (optional) only read documents of this shard, "i/n" or (i, n), see in_shard
+        shard_by: see in_shard
+
+    Yields:
+        dict: normalized annotation (see normalize_annotation)
+    """
+    if shard is not None:
+        shard = parse_shard(shard)
+
+    with open_annotation_file(path) as f:
+        doc_idx = 0
         for line in f:
-            document = json.loads(line)
+            if not line.strip():
+                continue
+            document = normalize_annotation(_json_loads(line))
+            if shard is None or in_shard(doc_idx, document["id"], shard, shard_by):
+                yield document
+            doc_idx += 1
 
-            # we rename "type" to "event_type" to avoid collision
-            # with TIMEX3 "type" from the timebank metadata
-            event_order = {}
-            for idx, event in document["event_order"].items():
-                event["event_type"] = event.pop("type")
-                event_order[idx] = event
 
-            document["event_order"] = event_order
-            data.append(document)
-            data_dict[document["id"]] = document
+def get_annotations(path, as_dict=False, ids=None, shard=None, shard_by="index"):
+    """Reads NarrativeTime jsonl file.
+
+    Args:
+        path: path to the jsonl file
+        as_dict: return dict mapping document id to the document instead of a list
+        ids: (optional) only read documents with these ids (in this order),
+            uses AnnotationIndex for uncompressed files
+        shard, shard_by: (optional) only read documents of this shard, see iter_annotations
+    """
+    if ids is not None and shard is not None:
+        raise ValueError("ids and shard can not be used together")
+
+    if ids is not None and is_compressed(path):
+        # compressed files can not be indexed, read the whole stream and keep only the requested documents
+        requested = {doc_id: None for doc_id in ids}
+        for document in iter_annotations(path):
+            if document["id"] in requested:
+                requested[document["id"]] = document
+
+        missing = [doc_id for doc_id, document in requested.items() if document is None]
+        if missing:
+            raise KeyError(f"Documents not found in {path}: {missing}")
+        documents = (requested[doc_id] for doc_id in ids)
+    elif ids is not None:
+        index = get_annotation_index(path)
+        documents = (normalize_annotation(document) for document in index.read_documents(ids))
+    else:
+        documents = iter_annotations(path, shard=shard, shard_by=shard_by)
 
     if as_dict:
-        return data_dict
-    return data
+        return {document["id"]: document for document in documents}
+    return list(documents)
+
+
+class AnnotationIndex:
+    """Sidecar index of a jsonl corpus: document id -> (byte offset, length in bytes, number of events).
+
+    Stored next to the corpus as <path>.idx (see get_annotation_index). When the corpus changes, update()
+    re-indexes it, documents appended to the end of the file are indexed without parsing the rest of it
+    (the indexed part is only checked against its sha256 checksum).
+    If a document id appears several times, the last document is used (same as get_annotations(as_dict=True)).
+    """
+    VERSION = 2
+    CHUNK_SIZE = 1 << 20
+
+    def __init__(self, path, documents=None, size=0, mtime_ns=None, checksum=None):
+        self.path = path
+        self.documents = documents if documents is not None else {}
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.checksum = checksum  # sha256 of the first size bytes of the file
+
+    @staticmethod
+    def index_path(path):
+        return os.fspath(path) + ".idx"
+
+    def __contains__(self, doc_id):
+        return doc_id in self.documents
+
+    def __getitem__(self, doc_id):
+        return self.documents[doc_id]
+
+    def __iter__(self):
+        return iter(self.documents)
+
+    def __len__(self):
+        return len(self.documents)
+
+    def n_events(self, doc_id):
+        return self.documents[doc_id][2]
+
+    def _appended_checksum(self, new_size):
+        """Checks that the indexed part of the file did not change (only new lines were added)
+
+        Returns:
+            sha256 object of the indexed part of the file to continue with the new lines, None if it changed
+        """
+        if self.size == 0 or new_size < self.size or self.checksum is None:
+            return None
+
+        checksum = hashlib.sha256()
+        last_chunk = b""
+        with open(self.path, "rb") as f:
+            while f.tell() < self.size:
+                last_chunk = f.read(min(self.CHUNK_SIZE, self.size - f.tell()))
+                if not last_chunk:
+                    return None
+                checksum.update(last_chunk)
+
+        if not last_chunk.endswith(b"\n") or checksum.hexdigest() != self.checksum:
+            return None
+        return checksum
+
+    def update(self):
+        """Indexes the corpus if it changed since the last update.
+
+        Returns:
+            bool: whether the index was changed
+        """
+        if is_compressed(self.path):
+            raise ValueError(f"Compressed files can not be indexed for random access: {self.path}")
+
+        stat = os.stat(self.path)
+        if stat.st_size == self.size and stat.st_mtime_ns == self.mtime_ns:
+            return False
+
+        checksum = self._appended_checksum(stat.st_size)
+        offset = self.size
+        if checksum is None:
+            checksum = hashlib.sha256()
+            offset = 0
+            self.documents = {}
+
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                if line.strip():
+                    document = _json_loads(line)
+                    self.documents[document["id"]] = (offset, len(line), len(document.get("events", ())))
+                checksum.update(line)
+                offset += len(line)
+
+        self.size = offset
+        self.mtime_ns = stat.st_mtime_ns
+        self.checksum = checksum.hexdigest()
+        return True
+
+    def read_document(self, doc_id):
+        """Reads a single raw (not normalized) json document"""
+        return next(self.read_documents([doc_id]))
+
+    def read_documents(self, ids):
+        """Yields raw (not normalized) json documents with the given ids, raises KeyError for unknown ids"""
+        with open(self.path, "rb") as f:
+            for doc_id in ids:
+                offset, length, _ = self.documents[doc_id]
+                f.seek(offset)
+                yield _json_loads(f.read(length))
+
+    def save(self):
+        index_path = self.index_path(self.path)
+        index = {
+            "version": self.VERSION,
+            "size": self.size,
+            "mtime_ns": self.mtime_ns,
+            "checksum": self.checksum,
+            "documents": self.documents,
+        }
+        with open(index_path + ".tmp", "w") as f:
+            json.dump(index, f)
+        os.replace(index_path + ".tmp", index_path)
+
+    @classmethod
+    def load(cls, path):
+        """Loads the index of the corpus at path, returns None if there is no valid index file"""
+        try:
+            with open(cls.index_path(path)) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if index.get("version") != cls.VERSION:
+            return None
+
+        documents = {doc_id: tuple(entry) for doc_id, entry in index["documents"].items()}
+        return cls(path, documents, size=index["size"], mtime_ns=index["mtime_ns"], checksum=index["checksum"])
+
+
+def get_annotation_index(path, save=True):
+    """Loads the sidecar index of a jsonl corpus, (re)building it if the corpus changed.
+
+    Args:
+        path: path to the jsonl file
+        save: write the updated index to <path>.idx
+    """
+    index = AnnotationIndex.load(path) or AnnotationIndex(path)
+    if index.update() and save:
+        try:
+            index.save()
+        except OSError as e:
+            logger.warning(f"Could not save annotation index for {path}: {e}")
+    return index
+
+
+def get_annotation(path, doc_id, index=None):
+    """Reads a single normalized document by id without reading the rest of the file.
+
+    Args:
+        path: path to the jsonl file
+        doc_id: document id
+        index: (optional) AnnotationIndex of the file, loaded with get_annotation_index by default
+    """
+    if index is None:
+        index = get_annotation_index(path)
+    return normalize_annotation(index.read_document(doc_id))
 
 
 def prettify_soup(soup):
@@ -46,7 +341,26 @@ def prettify_soup(soup):
     return txt
 
 
-def get_event_by_word_id(word_id, all_events):
+def make_word_index(all_events):
+    """Maps word id (left end of the span) to the event id, the first event wins (same as get_event_by_word_id)"""
+    word_index = {}
+    for event_id, event in all_events.items():
+        word_index.setdefault(event["span"][0], event_id)
+    return word_index
+
+
+def get_event_by_word_id(word_id, all_events, word_index=None):
+    """
+    Args:
+        word_id: int, left end of the event span
+        all_events: dict of events mapping event id to event dictionary
+        word_index: (optional) output of make_word_index(all_events), makes the lookup O(1)
+    """
+    if word_index is not None:
+        if word_id not in word_index:
+            raise ValueError(f"Event not found for word id {word_id}")
+        return word_index[word_id]
+
     for event_id, event in all_events.items():
         left, right = event["span"]
 
@@ -56,7 +370,125 @@ def get_event_by_word_id(word_id, all_events):
     raise ValueError(f"Event not found for word id {word_id}")
 
 
-def convert_span_to_events(span, all_events, debug_info=None) -> Dict[str, dict]:
+class CoreferenceClusters:
+    """Union-find over coreferent events.
+
+    Coreference chains that share an event end up in the same cluster.
+    Members of a cluster are kept in the order they were added.
+    Chains are kept as well: annotators sometimes link the same event to chains with different time annotations.
+    """
+    def __init__(self):
+        self._parent = {}
+        self._members = {}  # root -> list of members
+        self._cluster_ids = {}  # root -> cluster id
+        self._n_added = 0
+        self.chains = []
+        self._last_chain = {}  # event id -> index of the last chain that mentions the event
+
+    def add(self, event_id):
+        if event_id in self._parent:
+            return
+        self._parent[event_id] = event_id
+        self._members[event_id] = [event_id]
+        self._cluster_ids[event_id] = self._n_added
+        self._n_added += 1
+
+    def find(self, event_id):
+        parent = self._parent
+        while parent[event_id] != event_id:
+            parent[event_id] = parent[parent[event_id]]  # path halving
+            event_id = parent[event_id]
+        return event_id
+
+    def union(self, event1, event2):
+        self.add(event1)
+        self.add(event2)
+        root1, root2 = self.find(event1), self.find(event2)
+        if root1 == root2:
+            return root1
+
+        # the cluster created first keeps its id and its members go first
+        older, newer = sorted([root1, root2], key=self._cluster_ids.get)
+        older_members, newer_members = self._members.pop(older), self._members.pop(newer)
+        cluster_id = self._cluster_ids.pop(older)
+        del self._cluster_ids[newer]
+
+        # union by size: attach the smaller tree to the larger one
+        root, child = (older, newer) if len(older_members) >= len(newer_members) else (newer, older)
+        self._parent[child] = root
+        older_members.extend(newer_members)
+        self._members[root] = older_members
+        self._cluster_ids[root] = cluster_id
+        return root
+
+    def add_chain(self, event_ids):
+        """Add a coreference chain, all events of the chain are merged into one cluster"""
+        chain_idx = len(self.chains)
+        self.chains.append(list(event_ids))
+        for event_id in event_ids:
+            self.union(event_ids[0], event_id)
+            self._last_chain[event_id] = chain_idx
+
+    def last_chain(self, event_id):
+        """Index of the last chain that mentions the event"""
+        return self._last_chain[event_id]
+
+    def coreferent(self, event_id):
+        """Other events of the last chain that mentions the event, in the order of the chain"""
+        chain = list(self.chains[self._last_chain[event_id]])
+        chain.remove(event_id)
+        return chain
+
+    def __contains__(self, event_id):
+        return event_id in self._parent
+
+    def cluster_id(self, event_id):
+        return self._cluster_ids[self.find(event_id)]
+
+    def members(self, event_id):
+        return self._members[self.find(event_id)]
+
+    def clusters(self):
+        """List of clusters (lists of event ids) ordered by cluster id"""
+        roots = sorted(self._members, key=self._cluster_ids.get)
+        return [self._members[root] for root in roots]
+
+
+class SpanIndex:
+    """Index of event (or timex) spans for "which events are fully inside [left, right]" queries.
+
+    Built once per document in O(E log E), answers queries in O(log E + k),
+    where k is the number of spans that start inside [left, right].
+    """
+    def __init__(self, spans):
+        """
+        Args:
+            spans (dict): event ids as keys and (left, right) word indices as values
+        """
+        self._ids = list(spans.keys())
+        order = sorted(range(len(self._ids)), key=lambda i: spans[self._ids[i]][0])
+        self._order = order
+        self._starts = [spans[self._ids[i]][0] for i in order]
+        self._ends = [spans[self._ids[i]][1] for i in order]
+
+    @classmethod
+    def from_events(cls, all_events):
+        """
+        Args:
+            all_events (dict): events dict with event ids as keys and dicts with "span" key as values
+        """
+        return cls({event_id: event["span"] for event_id, event in all_events.items()})
+
+    def find_inside(self, left, right):
+        """Returns ids of the events fully inside [left, right] in the same order as in the original dict"""
+        lo = bisect.bisect_left(self._starts, left)
+        hi = bisect.bisect_right(self._starts, right)
+        found = [self._order[k] for k in range(lo, hi) if self._ends[k] <= right]
+        found.sort()
+        return [self._ids[i] for i in found]
+
+
+def convert_span_to_events(span, all_events, debug_info=None, span_index=None) -> Dict[str, dict]:
     """Returns events corresponding to the given span
 
     Args:
@@ -64,17 +496,21 @@ def convert_span_to_events(span, all_events, debug_info=None) -> Dict[str, dict]
             includes timexes (they just have a different prefix in the id)
         span (tuple): (start, end) span to convert to events, should include at least one event
         debug_info (str): optional debug info to be printed in case of error
+        span_index (SpanIndex): optional index of all_events, pass it when converting many spans of the same document.
+            Without it, all events are scanned, which is faster for a single span.
 
     Returns:
         dict: events dict with event ids as keys and event dicts as values
     """
     debug_info = debug_info or ""
-    return_events = {}
-
-    for event_id, event in all_events.items():
-        event_start, event_end = event["span"]  # 144, 144
-        if event_start >= span[0] and event_end <= span[1]:
-            return_events[event_id] = event
+    if span_index is not None:
+        return_events = {event_id: all_events[event_id] for event_id in span_index.find_inside(span[0], span[1])}
+    else:
+        return_events = {}
+        for event_id, event in all_events.items():
+            event_start, event_end = event["span"]
+            if event_start >= span[0] and event_end <= span[1]:
+                return_events[event_id] = event
 
     if len(return_events) == 0:
         raise RuntimeError(f"{debug_info} No events found for span {span}")
@@ -105,6 +541,8 @@ def replace_consecutive_with_bounded(annotation):
 
     invisible_event_spans = set((word_id, word_id) for word_id in annotation["invisible_events"])
     new_event_order = {}
+    timex_index = SpanIndex(timexes)
+    event_index = SpanIndex(events)
 
     for span_id, span_annotation in event_order.items():
         if span_annotation["event_type"] != NAME_TO_TYPE["[C]"]:
@@ -117,11 +555,11 @@ def replace_consecutive_with_bounded(annotation):
 
         left, right = span_annotation["span"]
 
-        included_timexes = [k for k, v in timexes.items() if v[0] >= left and v[1] <= right]
+        included_timexes = timex_index.find_inside(left, right)
         assert len(included_timexes) == 0, f"[C] spans should not include temporal expressions: {span_annotation}"
 
         original_annotation_id = int(span_id)
-        included_b_events = [k for k, v in events.items() if v[0] >= left and v[1] <= right]
+        included_b_events = event_index.find_inside(left, right)
 
         invluded_b_events_visible = []
         for event_id in included_b_events:
@@ -130,35 +568,33 @@ def replace_consecutive_with_bounded(annotation):
                 invluded_b_events_visible.append(event_id)
 
         for i, c_labelled_event in enumerate(invluded_b_events_visible, 1):
-            modified_span_annotation = deepcopy(span_annotation)
-            modified_span_annotation["span"] = events[c_labelled_event]
-            modified_span_annotation["event_type"] = NAME_TO_TYPE["[B]"]
-            modified_span_annotation["time"] = str(float(modified_span_annotation["time"]) + epsilon * i)
-            new_event_order[str(original_annotation_id + epsilon * i)] = modified_span_annotation
+            # span_annotation is not modified, all values of the new annotation are immutable or replaced
+            new_event_order[str(original_annotation_id + epsilon * i)] = span_annotation | {
+                "span": events[c_labelled_event],
+                "event_type": NAME_TO_TYPE["[B]"],
+                "time": str(float(span_annotation["time"]) + epsilon * i),
+            }
 
     return new_event_order
 
 
-def make_coreference_index(events, coreference):
+def make_coreference_index(events, coreference, word_index=None):
     """
     Args:
         events: dict of events mapping event id to event dictionary (both events and timexes)
         coreference: dict of coreference mapping word id to list of coreferent word ids
+        word_index: (optional) output of make_word_index(events)
     Returns:
-        dict of coreference mapping event id to list of coreferent event ids
+        CoreferenceClusters with all event ids mentioned in coreference
     """
-    event_coreference_expanded = {}
-    for k, coreferent_to_k in coreference.items():
-        k = int(k)
-        k_id = get_event_by_word_id(k, events)
-        c_ids = [get_event_by_word_id(c, events) for c in coreferent_to_k]
+    if word_index is None:
+        word_index = make_word_index(events)
 
-        event_coreference_expanded[k_id] = c_ids
-        for event in c_ids:
-            coreferring_to_event = [k_id] + c_ids
-            coreferring_to_event.remove(event)
-            event_coreference_expanded[event] = coreferring_to_event
-    return event_coreference_expanded
+    clusters = CoreferenceClusters()
+    for k, coreferent_to_k in coreference.items():
+        chain = [int(k)] + coreferent_to_k
+        clusters.add_chain([get_event_by_word_id(word_id, events, word_index=word_index) for word_id in chain])
+    return clusters
 
 
 def convert_event_order_from_spans_to_events(event_order_spans, events_and_timexes, invisible_events=None):
@@ -175,9 +611,11 @@ def convert_event_order_from_spans_to_events(event_order_spans, events_and_timex
     invisible_events = invisible_events or []
     invisible_events = set(invisible_events)
 
+    span_index = SpanIndex.from_events(events_and_timexes)
+
     event_order_events = {}
     for span_annotation in event_order_spans.values():
-        corresponding_events = convert_span_to_events(span_annotation["span"], events_and_timexes)  # this is where you can accidentally get invisible events
+        corresponding_events = convert_span_to_events(span_annotation["span"], events_and_timexes, span_index=span_index)  # this is where you can accidentally get invisible events
 
         # delete invisible events if they are in the span
         corresponding_events = {k: v for k, v in corresponding_events.items() if k not in invisible_events}
@@ -188,15 +626,15 @@ def convert_event_order_from_spans_to_events(event_order_spans, events_and_timex
             # differently in older version of the tool
             logger.warning(f"Span {span_annotation['span']} does not contain any visible events. Replacing with a hidden event under this span.")
             assert span_annotation["event_type"] != "[C]", "I hope this never happens, this would be a mess"
-            _hidden_event = convert_span_to_events(span_annotation["span"], events_and_timexes)
+            _hidden_event = convert_span_to_events(span_annotation["span"], events_and_timexes, span_index=span_index)
             assert len(_hidden_event) == 1, "fallback error, please **carefuly** study the code above to understand this issue. It is probably a messy one."
             corresponding_events = _hidden_event
 
+        # one span can include multiple events, they all share the span labels
+        span_labels = {k: v for k, v in span_annotation.items() if k != "span"}
+        span_labels["event_type"] = TYPE_TO_NAME[span_labels["event_type"]]
         for k, v in corresponding_events.items():
-            _event_without_span = {k: v for k, v in span_annotation.items() if k != "span"}  # one span can include multiple events
-            v_labelled = v | _event_without_span
-            v_labelled["event_type"] = TYPE_TO_NAME[v_labelled["event_type"]]
-            event_order_events[k] = v_labelled
+            event_order_events[k] = v | span_labels
 
     return event_order_events
 
@@ -208,36 +646,39 @@ def add_invisible_events_to_event_order(
         event_coreference,
         events_and_timexes,
         debug_info=None,
+        word_index=None,
     ):
     """
     Output example:
         {'t0': {'span': [5, 6], 'is_timex': True, 'type': '[B]', 'time': '1', 'relto': '', 'factuality': ''},
         'ei0': {'span': [94, 94], 'is_timex': False, 'eid': '0', 'type': '[U}', 'time': '-0.1', 'relto': '', 'factuality': ''},
     """
-    event_coreference_index = make_coreference_index(events_and_timexes, event_coreference)
-    event_order = deepcopy(event_order)
+    coreference_clusters = make_coreference_index(events_and_timexes, event_coreference, word_index=word_index)
+    event_order = dict(event_order)  # entries are not modified, only new ones are added
 
     for invisible_event_id in invisible_event_ids:
-        coreferent_events = event_coreference_index[invisible_event_id]
-
-        added_invisible_event = False
-        for c in coreferent_events:
-            if c not in event_order: continue
-            added_invisible_event = True
-
-            c_event_order_info = event_order[c]
-            _event = deepcopy(events_and_timexes[invisible_event_id])
-            _event["is_visible_during_annotation"] = False
-
-            for k in ["event_type", "time", "branch", "factuality"]:
-                assert k not in _event
-                _event[k] = c_event_order_info[k]
+        if invisible_event_id not in coreference_clusters:
+            raise RuntimeError(f"Invisible event {invisible_event_id} does not corefer with any event")
+
+        # An invisible event takes the time annotation of the last event of the last chain that mentions it
+        # that is already in event_order, this includes invisible events added before it.
+        c = None
+        for coreferent_event_id in coreference_clusters.coreferent(invisible_event_id):
+            if coreferent_event_id in event_order:
+                c = coreferent_event_id
+        if c is None:
+            raise RuntimeError(f"Could not find coreferent event for {invisible_event_id}")
 
-            assert _event.keys() == c_event_order_info.keys(), f"{_event.keys()} != {c_event_order_info.keys()}"
-            event_order[invisible_event_id] = _event
+        c_event_order_info = event_order[c]
+        _event = events_and_timexes[invisible_event_id]
+        _nt_labels = {"is_visible_during_annotation": False}
+        for k in ["event_type", "time", "branch", "factuality"]:
+            assert k not in _event
+            _nt_labels[k] = c_event_order_info[k]
 
-        if not added_invisible_event:
-            raise RuntimeError(f"Could not find coreferent event for {invisible_event_id}")
+        _event = _event | _nt_labels
+        assert _event.keys() == c_event_order_info.keys(), f"{_event.keys()} != {c_event_order_info.keys()}"
+        event_order[invisible_event_id] = _event
 
     if len(events_and_timexes) != len(event_order):
         raise RuntimeError(f"Number of events and timexes does not match number of "
@@ -363,26 +804,22 @@ def get_events_and_timexes(annotation, corpus_offset=0, return_list=False):
                 '2': [29, 29],
                 ...
     Returns:
-        events_and_timexes: dict of events and timexes mapping event/timex id to event/timex dictionary
+        events_and_timexes: dict of events and timexes mapping event/timex id to event/timex dictionary.
+            The annotation is not modified. Every event/timex gets one new dictionary,
+            but "span" lists are shared with the annotation and should not be modified.
 
     Output example:
         {'t0': {'span': [5, 6], 'is_timex': True, 'type': '[B]', 'time': '1', 'relto': '', 'factuality': ''},
         'ei0': {'span': [94, 94], 'is_timex': False, 'eid': '0', 'type': '[U}', 'time': '-0.1', 'relto': '', 'factuality': ''},
     """
     _events, _timexes = format_metadata(annotation, corpus_offset=corpus_offset)
-    events_and_timexes = {}
-    for k, v in _events.items():
-        v["is_timex"] = False
-        events_and_timexes[k] = v
-
-    for k, v in _timexes.items():
-        assert k not in events_and_timexes, "timexes should have different ids from events"
-        v["is_timex"] = True
-        events_and_timexes[k] = v
+    assert _events.keys().isdisjoint(_timexes.keys()), "timexes should have different ids from events"
+    events_and_timexes = _events | _timexes  # format_metadata already sets "is_timex"
 
     event_order = replace_consecutive_with_bounded(annotation)  # tricky part
 
-    invisible_events = [get_event_by_word_id(word_id, events_and_timexes) for word_id in annotation["invisible_events"]]
+    word_index = make_word_index(events_and_timexes)
+    invisible_events = [get_event_by_word_id(word_id, events_and_timexes, word_index=word_index) for word_id in annotation["invisible_events"]]
     event_order = convert_event_order_from_spans_to_events(event_order, events_and_timexes, invisible_events=invisible_events)
 
     for k, v in event_order.items():
@@ -394,6 +831,7 @@ def get_events_and_timexes(annotation, corpus_offset=0, return_list=False):
         event_coreference=annotation["event_coreference"],
         events_and_timexes=events_and_timexes,
         debug_info=annotation,
+        word_index=word_index,
     )
 
     if return_list:
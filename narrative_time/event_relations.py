@@ -3,10 +3,16 @@
 Handles conversion of interval types ([], [}, {], {}) and intervals into relations.
 """
 
+import heapq
+import itertools
 from collections import defaultdict
 from collections import namedtuple
 
+import numpy as np
+
 Interval = namedtuple("Interval", ["start", "end"])
+EventArrays = namedtuple("EventArrays", ["starts", "ends", "types", "branches", "branch_intervals", "is_point"])
+BranchGroup = namedtuple("BranchGroup", ["members", "classes", "class_members", "class_starts", "class_ends", "class_kinds"])
 
 REL_TO_ID = {
     "BEFORE": 0,
@@ -17,9 +23,38 @@ REL_TO_ID = {
     "OVERLAP": 5,
     "VAGUE": 6,
 }
+ID_TO_REL = list(REL_TO_ID.keys())
+
+# relation of (B, A) given relation of (A, B)
+INVERSE_REL = {
+    "BEFORE": "AFTER",
+    "AFTER": "BEFORE",
+    "INCLUDES": "IS_INCLUDED",
+    "IS_INCLUDED": "INCLUDES",
+    "SIMULTANEOUS": "SIMULTANEOUS",
+    "OVERLAP": "OVERLAP",
+    "VAGUE": "VAGUE",
+}
+INVERSE_REL_ID = np.array([REL_TO_ID[INVERSE_REL[r]] for r in ID_TO_REL], dtype=np.int8)
+
+# ids of the interval relations returned by get_interval_relation
+INTERVAL_REL_TO_ID = {
+    "BEFORE": 0,
+    "AFTER": 1,
+    "INCLUDES": 2,
+    "IS_INCLUDED": 3,
+    "SIMULTANEOUS": 4,
+    "OVERLAP_BEFORE": 5,
+    "OVERLAP_AFTER": 6,
+}
+ID_TO_INTERVAL_REL = list(INTERVAL_REL_TO_ID.keys())
 
 ALLOWED_TYPES = {"[B]", "{U}", "{U]", "[U}"}
+# same codes as conversion_utils.NAME_TO_TYPE ([C] is always converted to [B] before we get here)
+TYPE_TO_ID = {"[B]": 0, "{U}": 2, "[U}": 3, "{U]": 4}
+MAIN_BRANCH_ID = 0
 SPECIAL_SYMBOLS = "!@#$%^&*?"  # do not add < and > here, it will break the code
+_STRIP_SPECIAL_SYMBOLS = str.maketrans("", "", SPECIAL_SYMBOLS)
 CONVERION_TABLE = {
     ("[B]", "[B]"): {
         "BEFORE": "BEFORE",
@@ -106,29 +141,109 @@ CONVERION_TABLE = {
 }
 
 
+
+def _compile_relation_table():
+    """Compile CONVERION_TABLE into a dense array.
+
+    Returns:
+        np.ndarray: int8 array indexed by (type1 id, type2 id, interval relation id) with REL_TO_ID values.
+            Types that are not in ALLOWED_TYPES map to -1.
+    """
+    n_types = max(TYPE_TO_ID.values()) + 1
+    table = np.full((n_types, n_types, len(INTERVAL_REL_TO_ID)), -1, dtype=np.int8)
+    for (type1, type2), conversion in CONVERION_TABLE.items():
+        for interval_relation, interval_relation_id in INTERVAL_REL_TO_ID.items():
+            relation = conversion[interval_relation]
+            table[TYPE_TO_ID[type1], TYPE_TO_ID[type2], interval_relation_id] = REL_TO_ID[relation]
+    return table
+
+
+# CONVERION_TABLE is the human-readable definition, RELATION_TABLE is what the code actually uses
+RELATION_TABLE = _compile_relation_table()
+RELATION_TABLE.flags.writeable = False
+_RELATION_TABLE_LIST = RELATION_TABLE.tolist()  # indexing nested lists is faster than numpy for a single pair
+
+
+class EventRecord:
+    """Event with time, type and branch parsed into numbers.
+
+    Parsing happens once per event, so comparing records does not re-parse any strings.
+    All relation functions accept either EventRecord or event dict.
+
+    Attributes:
+        id: (optional) event/timex id, e.g. "ei0" or "t1"
+        type_id: TYPE_TO_ID value of the event type
+        interval: to_interval(time, type)
+        timeline_interval: position of the event on the main timeline,
+            to_interval(time, type, treat_unbounded_as_infitine=True) merged with the branch interval
+        branch: branch string, "" for the main timeline
+        is_unbounded: event type is {U}
+        is_permanent: event type is {U} and time is "" or ":"
+        is_point: time is a single number ("2", but not "2:2"), only points of [U} and {U] are extended
+            to infinity in timeline_interval
+    """
+    __slots__ = ("id", "type_id", "interval", "timeline_interval", "branch", "is_unbounded", "is_permanent", "is_point")
+
+    def __init__(self, time, event_type, branch="", id=None):
+        self.id = id
+        self.type_id = TYPE_TO_ID[event_type]
+        self.interval = to_interval(time, type_=event_type)
+        self.branch = branch
+        self.is_unbounded = event_type == "{U}"
+        self.is_permanent = self.is_unbounded and time in ["", ":"]
+        self.is_point = time not in ["", ":"] and ":" not in time
+
+        # note special flag treat_unbounded_as_infitine
+        # it is used specifically for between-interval relations
+        timeline_interval = to_interval(time, type_=event_type, treat_unbounded_as_infitine=True)
+        if branch != "":
+            timeline_interval = merge_event_and_branch_intervals(timeline_interval, branch_to_interval(branch))
+        self.timeline_interval = timeline_interval
+
+    @classmethod
+    def from_dict(cls, event, id=None):
+        """
+        Args:
+            event: dict with keys "time", "event_type" and (optionally) "branch" and "id"
+            id: (optional) overrides event["id"]
+        """
+        if id is None:
+            id = event.get("id")
+        return cls(event["time"], event["event_type"], branch=event.get("branch", ""), id=id)
+
+    def __repr__(self):
+        return (f"EventRecord(id={self.id!r}, type_id={self.type_id}, interval={tuple(self.interval)}, "
+                f"branch={self.branch!r}, timeline_interval={tuple(self.timeline_interval)})")
+
+
+def as_event_record(event):
+    """Returns event as EventRecord (parsing the dict if needed)"""
+    if isinstance(event, EventRecord):
+        return event
+    return EventRecord.from_dict(event)
+
+
+
 def get_event_relation(event1, event2):
     """Get relation between two events.
     
     Args:
-        event1: dict with keys "time" and "event_type"
-        event2: dict with keys "time" and "event_type"
+        event1: EventRecord or dict with keys "time" and "event_type"
+        event2: EventRecord or dict with keys "time" and "event_type"
     
     Returns:
         str: relation between events, one of "BEFORE", "AFTER", "INCLUDES", "IS_INCLUDED", "OVERLAP", "SIMULTANEOUS", "VAGUE"
     """
-    type1, type2 = event1["event_type"], event2["event_type"]
-
-    interval1 = to_interval(event1["time"], type_=event1["event_type"])
-    interval2 = to_interval(event2["time"], type_=event2["event_type"])
+    event1, event2 = as_event_record(event1), as_event_record(event2)
 
     # special case {:} vs {:} is OVERLAP
-    if type1 == "{U}" and type2 == "{U}" and interval1 == interval2 == Interval(float("-inf"), float("inf")):
+    if event1.is_permanent and event2.is_permanent:
         return "OVERLAP"
 
-    interval1, interval2 = interval1, interval2
-    interval_relation = get_interval_relation(interval1, interval2)
+    interval_relation_id = get_interval_relation_id(event1.interval, event2.interval)
+    relation_id = _RELATION_TABLE_LIST[event1.type_id][event2.type_id][interval_relation_id]
 
-    return CONVERION_TABLE[(type1, type2)][interval_relation]
+    return ID_TO_REL[relation_id]
 
 
 def get_event_relation_separate_branches(event1, event2):
@@ -161,51 +276,38 @@ def get_event_relation_separate_branches(event1, event2):
            If it is anything other than BEFORE or AFTER, return VAGUE.
            Else, return the relation.
 
+    Steps 1 and 2 are done once per event in EventRecord (see EventRecord.timeline_interval).
+
     Args:
-        event1: dict with keys "time", "event_type", "branch"
-        event2: dict with keys "time", "event_type", "branch"
+        event1: EventRecord or dict with keys "time", "event_type", "branch"
+        event2: EventRecord or dict with keys "time", "event_type", "branch"
     
     Returns:
         str: BEFORE, AFTER, VAGUE
     """
-    branch1 = event1["branch"]
-    branch2 = event2["branch"]
+    event1, event2 = as_event_record(event1), as_event_record(event2)
 
-    if branch1 == branch2:
+    if event1.branch == event2.branch:
         raise ValueError("use get_event_relation() for events in the same branch")
 
-    # note special flag treat_unbounded_as_infitine
-    # it is used specifically for between-interval relations
-    interval1 = to_interval(event1["time"], type_=event1["event_type"], treat_unbounded_as_infitine=True)
-    interval2 = to_interval(event2["time"], type_=event2["event_type"], treat_unbounded_as_infitine=True)
-
-    if event1["event_type"] == "{U}" and event1["time"] in ["", ":"]:
+    if event1.is_permanent:
         return "INCLUDES"
 
-    if event2["event_type"] == "{U}" and event2["time"] in ["", ":"]:
+    if event2.is_permanent:
         return "IS_INCLUDED"
 
-    if event1["event_type"] == "{U}" and is_finite(interval1):
+    if event1.is_unbounded or event2.is_unbounded:
         return "VAGUE"
 
-    if event2["event_type"] == "{U}" and is_finite(interval2):
-        return "VAGUE"
-
-    # get position of each event on the main timeline
-    if branch1 != "":
-        branch1_interval = branch_to_interval(branch1)
-        interval1 = merge_event_and_branch_intervals(interval1, branch1_interval)
-
-    if branch2 != "":
-        branch2_interval = branch_to_interval(branch2)
-        interval2 = merge_event_and_branch_intervals(interval2, branch2_interval)
+    interval_relation = get_interval_relation_id(event1.timeline_interval, event2.timeline_interval)
 
-    interval_relation = get_interval_relation(interval1, interval2)
+    if interval_relation == INTERVAL_REL_TO_ID["BEFORE"]:
+        return "BEFORE"
 
-    if interval_relation not in ["BEFORE", "AFTER"]:
-        return "VAGUE"
+    if interval_relation == INTERVAL_REL_TO_ID["AFTER"]:
+        return "AFTER"
 
-    return interval_relation
+    return "VAGUE"
 
 
 def merge_event_and_branch_intervals(event_interval, branch_interval):
@@ -238,33 +340,38 @@ def get_interval_relation(time1, time2):
         3-6	1-4: OVERLAP_AFTER
         1-3	1-3: SIMULTANEOUS
     """
+    return ID_TO_INTERVAL_REL[get_interval_relation_id(time1, time2)]
+
+
+def get_interval_relation_id(time1, time2):
+    """Same as get_interval_relation, but returns INTERVAL_REL_TO_ID value"""
     # [L.start == R.start] [L.end == R.end]
     if time1.start == time2.start and time1.end == time2.end:
-        return "SIMULTANEOUS"
+        return INTERVAL_REL_TO_ID["SIMULTANEOUS"]
 
     # [L.start L.end] {R.start R.end}
     if time1.end <= time2.start:
-        return "BEFORE"
+        return INTERVAL_REL_TO_ID["BEFORE"]
 
     # {R.start R.end} [L.start L.end]
     if time1.start >= time2.end:
-        return "AFTER"
+        return INTERVAL_REL_TO_ID["AFTER"]
 
     # [L.start {R.start R.end} L.end]
     if time1.start <= time2.start and time2.end <= time1.end:
-        return "INCLUDES"
+        return INTERVAL_REL_TO_ID["INCLUDES"]
 
     # {R.start [L.start L.end] R.end}
     if time2.start <= time1.start and time1.end <= time2.end:
-        return "IS_INCLUDED"
+        return INTERVAL_REL_TO_ID["IS_INCLUDED"]
 
     # [L.start {R.start L.end] R.end}
     if time1.start <= time2.start and time1.end <= time2.end:
-        return "OVERLAP_BEFORE"
+        return INTERVAL_REL_TO_ID["OVERLAP_BEFORE"]
 
     # {R.start L.start} [L.end R.end}
     if time2.start <= time1.start and time2.end <= time1.end:
-        return "OVERLAP_AFTER"
+        return INTERVAL_REL_TO_ID["OVERLAP_AFTER"]
 
     raise ValueError(f"Can't classify {time1} and {time2}")
 
@@ -318,8 +425,7 @@ def branch_to_interval(branch):
         <10 -> Interval[-inf, 10]
         <6 -> Interval[-inf, 6]
     """
-    for symbol in SPECIAL_SYMBOLS:
-        branch = branch.replace(symbol, "")
+    branch = branch.translate(_STRIP_SPECIAL_SYMBOLS)
 
     if ">" in branch:
         start = float(branch.replace(">", ""))
@@ -332,3 +438,453 @@ def branch_to_interval(branch):
         return Interval(start, end)
 
     raise ValueError(f"Can't convert {branch} to interval")
+
+
+# Bulk (whole-document) relation computation.
+# Everything below should produce exactly the same relations as
+# get_event_relation and get_event_relation_separate_branches, just for all pairs at once.
+
+def encode_events(events):
+    """Convert a list of events into arrays accepted by get_relation_matrix.
+
+    Args:
+        events: list of EventRecord or dicts with keys "time", "event_type" and (optionally) "branch"
+
+    Returns:
+        EventArrays: starts and ends (float64, same as to_interval), types (int8, TYPE_TO_ID),
+            branches (int32, index into branch_intervals; MAIN_BRANCH_ID is the main timeline),
+            branch_intervals (float64 array of shape (n_branches, 2), see branch_to_interval)
+            and is_point (bool, EventRecord.is_point; "2:2" has the same starts and ends as "2", but is not a point)
+    """
+    n_events = len(events)
+    starts = np.empty(n_events, dtype=np.float64)
+    ends = np.empty(n_events, dtype=np.float64)
+    types = np.empty(n_events, dtype=np.int8)
+    branches = np.empty(n_events, dtype=np.int32)
+    is_point = np.empty(n_events, dtype=bool)
+
+    branch_to_id = {"": MAIN_BRANCH_ID}
+    branch_intervals = [(float("-inf"), float("inf"))]  # never used for the main timeline
+
+    for i, event in enumerate(events):
+        event = as_event_record(event)
+        starts[i], ends[i] = event.interval
+        types[i] = event.type_id
+        is_point[i] = event.is_point
+
+        if event.branch not in branch_to_id:
+            branch_to_id[event.branch] = len(branch_to_id)
+            branch_intervals.append(tuple(branch_to_interval(event.branch)))
+        branches[i] = branch_to_id[event.branch]
+
+    branch_intervals = np.array(branch_intervals, dtype=np.float64).reshape(-1, 2)
+    return EventArrays(starts, ends, types, branches, branch_intervals, is_point)
+
+
+def get_interval_relation_matrix(starts1, ends1, starts2, ends2):
+    """Vectorized get_interval_relation. Inputs are broadcasted against each other.
+
+    Returns:
+        np.ndarray: int8 array of INTERVAL_REL_TO_ID values
+    """
+    conditions = [
+        (starts1 == starts2) & (ends1 == ends2),
+        ends1 <= starts2,
+        starts1 >= ends2,
+        (starts1 <= starts2) & (ends2 <= ends1),
+        (starts2 <= starts1) & (ends1 <= ends2),
+        (starts1 <= starts2) & (ends1 <= ends2),
+        (starts2 <= starts1) & (ends2 <= ends1),
+    ]
+    choices = [
+        INTERVAL_REL_TO_ID["SIMULTANEOUS"],
+        INTERVAL_REL_TO_ID["BEFORE"],
+        INTERVAL_REL_TO_ID["AFTER"],
+        INTERVAL_REL_TO_ID["INCLUDES"],
+        INTERVAL_REL_TO_ID["IS_INCLUDED"],
+        INTERVAL_REL_TO_ID["OVERLAP_BEFORE"],
+        INTERVAL_REL_TO_ID["OVERLAP_AFTER"],
+    ]
+    relations = np.select(conditions, choices, default=-1).astype(np.int8)
+    if np.any(relations == -1):
+        raise ValueError("Can't classify some of the intervals")
+    return relations
+
+
+def get_relation_matrix(starts, ends, types, branches=None, branch_intervals=None, is_point=None):
+    """Get relations between all pairs of events in a document.
+
+    Vectorized version of get_event_relation (same branch) and
+    get_event_relation_separate_branches (different branches).
+    Only the upper triangle is computed, the lower one is filled with INVERSE_REL
+    (except for the cells where it is not safe, see audit_inverse_relations).
+
+    Args:
+        starts: float array of shape (n_events,), see to_interval
+        ends: float array of shape (n_events,), see to_interval
+        types: int array of shape (n_events,) with TYPE_TO_ID values
+        branches: (optional) int array of shape (n_events,) with branch ids.
+            If None, all events are treated as if they were on the same branch.
+        branch_intervals: float array of shape (n_branches, 2), required if branches is provided
+        is_point: bool array of shape (n_events,), see encode_events, required if branches is provided
+
+    Returns:
+        np.ndarray: int8 array of shape (n_events, n_events) with REL_TO_ID values, -1 on the diagonal
+    """
+    starts = np.asarray(starts, dtype=np.float64)
+    ends = np.asarray(ends, dtype=np.float64)
+    types = np.asarray(types, dtype=np.int64)
+    n_events = len(starts)
+    permanent = _is_permanent(starts, ends, types)
+
+    class_relations = None
+    if branches is not None and len(np.unique(branches)) > 1:
+        branches = np.asarray(branches)
+        # all classes of all branches at once, same-branch cells are ignored
+        all_classes = _merge_branch_groups(get_branch_groups(starts, ends, types, branches, branch_intervals, is_point))
+        class_relations = _get_class_relations(all_classes, all_classes)
+        classes = all_classes.classes
+
+    relations = np.empty((n_events, n_events), dtype=np.int8)
+    for lo in range(0, n_events, _CHUNK_SIZE):
+        rows, cols = slice(lo, lo + _CHUNK_SIZE), slice(lo, None)
+
+        interval_relations = get_interval_relation_matrix(starts[rows, None], ends[rows, None], starts[None, cols], ends[None, cols])
+        block = RELATION_TABLE[types[rows, None], types[None, cols], interval_relations]
+
+        # special case {:} vs {:} is OVERLAP
+        block[permanent[rows, None] & permanent[None, cols]] = REL_TO_ID["OVERLAP"]
+
+        if class_relations is not None:
+            separate_branches = branches[rows, None] != branches[None, cols]
+            block[separate_branches] = class_relations[classes[rows, None], classes[None, cols]][separate_branches]
+
+        relations[rows, cols] = block
+        relations[cols, rows] = INVERSE_REL_ID[block.T]
+
+    if class_relations is not None:
+        # permanent {U} on different branches INCLUDE each other, so the inverse is wrong here
+        permanent_ids = np.flatnonzero(permanent)
+        separate_branches = branches[permanent_ids, None] != branches[None, permanent_ids]
+        permanent_relations = relations[np.ix_(permanent_ids, permanent_ids)]
+        direct_relations = class_relations[np.ix_(classes[permanent_ids], classes[permanent_ids])]
+        permanent_relations[separate_branches] = direct_relations[separate_branches]
+        relations[np.ix_(permanent_ids, permanent_ids)] = permanent_relations
+
+    np.fill_diagonal(relations, -1)
+    return relations
+
+
+def audit_inverse_relations():
+    """Check where relation of (B, A) is not the INVERSE_REL of relation of (A, B).
+
+    Evaluates get_event_relation and get_event_relation_separate_branches in both directions
+    for events covering every type combination and interval relation of CONVERION_TABLE,
+    on the main timeline and on branches.
+    Bulk functions (get_relation_matrix, iter_relations) rely on this to only compute half of the pairs,
+    so every cell reported here has to be computed directly there.
+
+    Returns:
+        list of (event1, event2, relation, inverse of the relation of (event2, event1)) for every asymmetric cell
+    """
+    times = ["0", "1", "2", "0:1", "0:2", "1:2", "0:3", "1:3"]
+    events = [
+        {"time": time, "event_type": type_, "branch": branch}
+        for type_ in sorted(ALLOWED_TYPES)
+        for time in times + ([":"] if type_ == "{U}" else [])
+        for branch in ["", ">1", "<2$"]
+    ]
+    records = [EventRecord.from_dict(event) for event in events]
+
+    asymmetric = []
+    covered = set()
+    # product and not permutations: SIMULTANEOUS events of the same type are only covered by self-pairs
+    for (event1, record1), (event2, record2) in itertools.product(zip(events, records), repeat=2):
+        if record1.branch == record2.branch:
+            relation = get_event_relation(record1, record2)
+            reverse_relation = get_event_relation(record2, record1)
+            covered.add((record1.type_id, record2.type_id, get_interval_relation_id(record1.interval, record2.interval)))
+        else:
+            relation = get_event_relation_separate_branches(record1, record2)
+            reverse_relation = get_event_relation_separate_branches(record2, record1)
+
+        if INVERSE_REL[reverse_relation] != relation:
+            asymmetric.append((event1, event2, relation, INVERSE_REL[reverse_relation]))
+
+    n_cells = len(CONVERION_TABLE) * len(INTERVAL_REL_TO_ID)
+    assert len(covered) == n_cells, f"Audit only covers {len(covered)} out of {n_cells} cells of CONVERION_TABLE"
+    return asymmetric
+
+
+def _is_permanent(starts, ends, types):
+    """{U} events with time "" or ":" """
+    return (types == TYPE_TO_ID["{U}"]) & (starts == float("-inf")) & (ends == float("inf"))
+
+
+def _get_timeline_intervals(starts, ends, types, branches, branch_intervals, is_point):
+    """Vectorized EventRecord.timeline_interval
+
+    Returns:
+        (np.ndarray, np.ndarray): starts and ends of the event positions on the main timeline
+    """
+    if is_point is None:
+        raise ValueError("is_point is required for events on branches, see encode_events")
+
+    # to_interval(..., treat_unbounded_as_infitine=True)
+    is_point = np.asarray(is_point, dtype=bool)
+    starts = np.where(is_point & (types == TYPE_TO_ID["{U]"]), float("-inf"), starts)
+    ends = np.where(is_point & (types == TYPE_TO_ID["[U}"]), float("inf"), ends)
+
+    # merge_event_and_branch_intervals for the events that are not on the main timeline
+    branch_intervals = np.asarray(branch_intervals, dtype=np.float64)
+    branch_starts = branch_intervals[branches, 0]
+    branch_ends = branch_intervals[branches, 1]
+    on_branch = branches != MAIN_BRANCH_ID
+
+    merged_starts = np.where(starts == float("-inf"), float("-inf"), branch_starts)
+    merged_ends = np.where(
+        starts == float("-inf"),
+        branch_ends,
+        np.where(ends == float("inf"), float("inf"), branch_ends),
+    )
+    starts = np.where(on_branch, merged_starts, starts)
+    ends = np.where(on_branch, merged_ends, ends)
+    return starts, ends
+
+
+# Events on separate branches are compared by their position on the main timeline (see EventRecord),
+# and almost all events on a branch share the same position: branch >5 gives either [5, inf] or [-inf, inf].
+# So we group events by branch and then by position ("class"), compare classes and copy the result to the events.
+_REGULAR, _UNBOUNDED, _PERMANENT = 0, 1, 2
+_CHUNK_SIZE = 256  # rows per block in get_relation_matrix
+
+
+def get_branch_groups(starts, ends, types, branches, branch_intervals, is_point=None):
+    """Group events by branch, and events of each branch by their position on the main timeline.
+
+    Args:
+        same as get_relation_matrix
+
+    Returns:
+        list of BranchGroup, one per branch present in the document:
+            members: event indices on this branch
+            classes: class index of each member
+            class_members: event indices of each class
+            class_starts, class_ends: position of each class on the main timeline
+            class_kinds: 0 for [B], [U} and {U], 1 for {U}, 2 for permanent {U} (time is "" or ":")
+    """
+    starts = np.asarray(starts, dtype=np.float64)
+    ends = np.asarray(ends, dtype=np.float64)
+    types = np.asarray(types, dtype=np.int64)
+    branches = np.asarray(branches)
+
+    kinds = np.full(len(starts), _REGULAR, dtype=np.int64)
+    kinds[types == TYPE_TO_ID["{U}"]] = _UNBOUNDED
+    kinds[_is_permanent(starts, ends, types)] = _PERMANENT
+    timeline_starts, timeline_ends = _get_timeline_intervals(starts, ends, types, branches, branch_intervals, is_point)
+
+    groups = []
+    for branch in np.unique(branches):
+        members = np.flatnonzero(branches == branch)
+        keys = np.stack([kinds[members], timeline_starts[members], timeline_ends[members]], axis=1)
+        class_keys, classes = np.unique(keys, axis=0, return_inverse=True)
+        classes = classes.reshape(-1)
+        class_members = [members[classes == c] for c in range(len(class_keys))]
+        groups.append(BranchGroup(
+            members=members,
+            classes=classes,
+            class_members=class_members,
+            class_starts=class_keys[:, 1],
+            class_ends=class_keys[:, 2],
+            class_kinds=class_keys[:, 0].astype(np.int64),
+        ))
+    return groups
+
+
+def _merge_branch_groups(groups):
+    """Merge BranchGroups into a single group (members and classes are indexed by event index)"""
+    n_events = sum(len(group.members) for group in groups)
+    classes = np.empty(n_events, dtype=np.int64)
+    offset = 0
+    for group in groups:
+        classes[group.members] = group.classes + offset
+        offset += len(group.class_members)
+
+    return BranchGroup(
+        members=np.arange(n_events),
+        classes=classes,
+        class_members=[m for group in groups for m in group.class_members],
+        class_starts=np.concatenate([group.class_starts for group in groups]),
+        class_ends=np.concatenate([group.class_ends for group in groups]),
+        class_kinds=np.concatenate([group.class_kinds for group in groups]),
+    )
+
+
+def _get_class_relations(group1, group2):
+    """get_event_relation_separate_branches between all classes of two different branches
+
+    Returns:
+        np.ndarray: int8 array of shape (n_classes1, n_classes2) with REL_TO_ID values
+    """
+    interval_relations = get_interval_relation_matrix(
+        group1.class_starts[:, None], group1.class_ends[:, None],
+        group2.class_starts[None, :], group2.class_ends[None, :],
+    )
+    relations = np.full(interval_relations.shape, REL_TO_ID["VAGUE"], dtype=np.int8)
+    relations[interval_relations == INTERVAL_REL_TO_ID["BEFORE"]] = REL_TO_ID["BEFORE"]
+    relations[interval_relations == INTERVAL_REL_TO_ID["AFTER"]] = REL_TO_ID["AFTER"]
+
+    # {U} rules, applied in reverse order of priority
+    relations[:, group2.class_kinds != _REGULAR] = REL_TO_ID["VAGUE"]
+    relations[group1.class_kinds != _REGULAR, :] = REL_TO_ID["VAGUE"]
+    relations[:, group2.class_kinds == _PERMANENT] = REL_TO_ID["IS_INCLUDED"]
+    relations[group1.class_kinds == _PERMANENT, :] = REL_TO_ID["INCLUDES"]
+
+    return relations
+
+
+# Sparse relation enumeration.
+# For large documents most of the pairs are VAGUE, so instead of building the dense matrix
+# we sort events by their endpoints and only look at the pairs that can have a non-VAGUE relation.
+
+_INTERSECTING_RELATIONS = [
+    INTERVAL_REL_TO_ID[r] for r in ["INCLUDES", "IS_INCLUDED", "SIMULTANEOUS", "OVERLAP_BEFORE", "OVERLAP_AFTER"]
+]
+
+
+def iter_relations(starts, ends, types, branches=None, branch_intervals=None, is_point=None):
+    """Enumerate all non-VAGUE relations in a document.
+
+    Yields exactly the non-VAGUE (and non-diagonal) cells of get_relation_matrix with the same arguments,
+    but never builds the (n_events, n_events) matrix. Events are sorted by interval endpoints on each branch,
+    and for every event we only look at the events that lie after it, before it or intersect with it,
+    depending on which of these can give a non-VAGUE relation for the given pair of event types.
+    The cost is O(N log N + number of candidate pairs), where candidate pairs are
+    non-VAGUE relations plus VAGUE relations between intersecting intervals or equal points.
+    Relations between different branches are resolved per block of events sharing
+    the same branch and main timeline position (see get_branch_groups).
+
+    Args:
+        same as get_relation_matrix
+
+    Yields:
+        (int, int, int): (i, j, relation id) in no particular order
+    """
+    starts = np.asarray(starts, dtype=np.float64)
+    ends = np.asarray(ends, dtype=np.float64)
+    types = np.asarray(types, dtype=np.int64)
+    n_events = len(starts)
+
+    permanent = _is_permanent(starts, ends, types)
+    if branches is None:
+        events_by_branch = {MAIN_BRANCH_ID: np.arange(n_events)}
+    else:
+        branches = np.asarray(branches)
+        events_by_branch = {b: np.flatnonzero(branches == b) for b in np.unique(branches)}
+
+    # same branch, (type2, type1) blocks are the inverse of (type1, type2) blocks
+    for branch_events in events_by_branch.values():
+        branch_types = types[branch_events]
+        for type1, type2 in itertools.combinations_with_replacement(np.unique(branch_types), 2):
+            rows = branch_events[branch_types == type1]
+            cols = branch_events[branch_types == type2]
+            for i, j, relation in _iter_block_relations(rows, cols, starts, ends, RELATION_TABLE[type1, type2]):
+                yield i, j, relation
+                if type1 != type2:
+                    yield j, i, int(INVERSE_REL_ID[relation])
+
+        # special case {:} vs {:} is OVERLAP
+        branch_permanent = branch_events[permanent[branch_events]]
+        for i in branch_permanent:
+            for j in branch_permanent:
+                if i != j:
+                    yield int(i), int(j), REL_TO_ID["OVERLAP"]
+
+    if branches is None:
+        return
+
+    # different branches
+    branch_groups = get_branch_groups(starts, ends, types, branches, branch_intervals, is_point)
+    for group1, group2 in itertools.permutations(branch_groups, 2):
+        class_relations = _get_class_relations(group1, group2)
+        for class1, class2 in zip(*np.nonzero(class_relations != REL_TO_ID["VAGUE"])):
+            relation = int(class_relations[class1, class2])
+            for i in group1.class_members[class1].tolist():
+                for j in group2.class_members[class2].tolist():
+                    yield i, j, relation
+
+
+def _iter_block_relations(rows, cols, starts, ends, conversion):
+    """Yields non-VAGUE relations between rows and cols
+
+    Args:
+        rows, cols: event indices
+        starts, ends: interval arrays for all events
+        conversion: array mapping interval relation id to relation id (e.g. RELATION_TABLE[type1, type2])
+    """
+    is_informative = conversion != REL_TO_ID["VAGUE"]
+    need_before = is_informative[INTERVAL_REL_TO_ID["BEFORE"]]
+    need_equal_points = is_informative[INTERVAL_REL_TO_ID["SIMULTANEOUS"]]
+    need_after = is_informative[INTERVAL_REL_TO_ID["AFTER"]]
+    need_intersecting = np.any(is_informative[_INTERSECTING_RELATIONS])
+    if len(rows) == 0 or len(cols) == 0 or not (need_before or need_equal_points or need_after or need_intersecting):
+        return
+
+    col_starts, col_ends = starts[cols], ends[cols]
+    by_start = np.argsort(col_starts, kind="stable")
+    by_end = np.argsort(col_ends, kind="stable")
+    sorted_starts = col_starts[by_start]
+    sorted_ends = col_ends[by_end]
+
+    # sweep over rows in the order of their starts, keeping track of the cols that contain row start
+    heap = []
+    active = set()
+    next_col = 0
+
+    for i in rows[np.argsort(starts[rows], kind="stable")]:
+        start, end = starts[i], ends[i]
+        # every col falls into exactly one of these groups:
+        #     col.start >= end (BEFORE or a point SIMULTANEOUS),
+        #     col.end <= start and col.start < end (AFTER),
+        #     col.start < end and col.end > start (intersecting)
+        candidates = []
+
+        if need_before:
+            candidates.append(by_start[np.searchsorted(sorted_starts, end, side="left"):])
+        elif need_equal_points and start == end:
+            # the only SIMULTANEOUS cols in this group are the points equal to the row
+            lo = np.searchsorted(sorted_starts, end, side="left")
+            hi = np.searchsorted(sorted_starts, end, side="right")
+            starting_at_end = by_start[lo:hi]
+            candidates.append(starting_at_end[col_ends[starting_at_end] == end])
+
+        if need_after:
+            after = by_end[:np.searchsorted(sorted_ends, start, side="right")]
+            candidates.append(after[col_starts[after] < end])
+
+        if need_intersecting:
+            # cols starting inside [start, end)
+            lo = np.searchsorted(sorted_starts, start, side="left")
+            hi = np.searchsorted(sorted_starts, end, side="left")
+            starting_inside = by_start[lo:max(lo, hi)]
+            candidates.append(starting_inside[col_ends[starting_inside] > start])
+
+            # cols containing start: col.start < start < col.end
+            while next_col < len(cols) and sorted_starts[next_col] < start:
+                k = by_start[next_col]
+                heapq.heappush(heap, (col_ends[k], k))
+                active.add(k)
+                next_col += 1
+            while heap and heap[0][0] <= start:
+                active.discard(heapq.heappop(heap)[1])
+            candidates.append(np.fromiter(active, dtype=np.int64, count=len(active)))
+
+        candidates = np.concatenate(candidates)
+        if len(candidates) == 0:
+            continue
+
+        interval_relations = get_interval_relation_matrix(start, end, col_starts[candidates], col_ends[candidates])
+        relations = conversion[interval_relations]
+        for k, relation in zip(cols[candidates].tolist(), relations.tolist()):
+            if k != i and relation != REL_TO_ID["VAGUE"]:
+                yield int(i), k, relation
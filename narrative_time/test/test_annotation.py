@@ -0,0 +1,73 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from narrative_time import conversion_cache, conversion_utils
+from narrative_time.annotation import NTAnnotation
+from narrative_time.compiled_corpus import compile_corpus
+from narrative_time.timeml_corpus import load_relation_bundle, save_relation_bundle
+
+
+TEST_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), "test_new_rules.jsonl")
+
+
+class TestNTAnnotation(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.annotations = conversion_utils.get_annotations(TEST_FILE)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def assertSameAnnotation(self, annotation, expected):
+        self.assertEqual(annotation.doc_id, expected.doc_id)
+        self.assertEqual(annotation.text, expected.text)
+        self.assertEqual(annotation.event_id_to_numeric_id, expected.event_id_to_numeric_id)
+        self.assertEqual(len(annotation), len(expected))
+        for event, expected_event in zip(annotation.events_and_timexes, expected.events_and_timexes):
+            for k, v in event.items():  # compiled corpora keep NarrativeTime fields only
+                self.assertEqual(v, expected_event[k], k)
+        np.testing.assert_array_equal(annotation.event_relation_matrix, expected.event_relation_matrix)
+
+    def test_from_compiled(self):
+        corpus = compile_corpus(TEST_FILE, self.tmp_dir)
+
+        for annotation in self.annotations:
+            expected = NTAnnotation.from_json(annotation)
+            self.assertSameAnnotation(NTAnnotation.from_compiled(corpus, annotation["id"]), expected)
+
+    def test_from_relation_bundle(self):
+        n_branched = 0
+        for annotation in self.annotations:
+            # same as nt2tml --output_format npz without use_global_eiid
+            events_and_timexes, relations = conversion_cache.convert_document(annotation)
+            f = io.BytesIO()
+            save_relation_bundle(f, annotation, events_and_timexes, relations)
+            f.seek(0)
+            from_bundle = NTAnnotation.from_relation_bundle(load_relation_bundle(f))
+            expected = NTAnnotation.from_json(annotation)
+
+            self.assertEqual(from_bundle.event_id_to_numeric_id, expected.event_id_to_numeric_id)
+            self.assertEqual(from_bundle.events_and_timexes, expected.events_and_timexes)
+            self.assertSameAnnotation(
+                from_bundle,
+                NTAnnotation(expected.doc_id, expected.text, expected.events_and_timexes, list(events_and_timexes), relations),
+            )
+
+            # relation bundles use branches, relations between events on the same branch are the same as in from_json
+            branches = np.array([event["branch"] for event in expected.events_and_timexes])
+            same_branch = branches[:, None] == branches[None, :]
+            np.testing.assert_array_equal(
+                from_bundle.event_relation_matrix[same_branch], expected.event_relation_matrix[same_branch]
+            )
+            n_branched += not same_branch.all()
+
+        self.assertGreater(n_branched, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
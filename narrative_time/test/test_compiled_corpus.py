@@ -0,0 +1,58 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from narrative_time import conversion_utils
+from narrative_time.event_relations import encode_events, get_relation_matrix
+from narrative_time.compiled_corpus import CompiledCorpus, compile_corpus, get_compiled_corpus
+
+
+TEST_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), "test_new_rules.jsonl")
+
+
+class TestCompiledCorpus(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.corpus = compile_corpus(TEST_FILE, self.tmp_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_same_as_conversion(self):
+        annotations = conversion_utils.get_annotations(TEST_FILE)
+        self.assertEqual(list(self.corpus), [a["id"] for a in annotations])
+
+        for annotation in annotations:
+            doc_id = annotation["id"]
+            events_and_timexes = conversion_utils.get_events_and_timexes(annotation, return_list=True)
+
+            self.assertEqual(self.corpus.text_of(doc_id), annotation["text"])
+            self.assertEqual(self.corpus.event_ids_of(doc_id), [e["id"] for e in events_and_timexes])
+            self.assertTrue(np.array_equal(
+                self.corpus.relation_matrix(doc_id),
+                get_relation_matrix(*encode_events(events_and_timexes)),
+            ))
+
+            for compiled, event in zip(self.corpus.events_and_timexes(doc_id), events_and_timexes):
+                for k, v in compiled.items():
+                    self.assertEqual(v, event[k], k)
+
+    def test_memory_mapped(self):
+        corpus = CompiledCorpus(self.tmp_dir)
+        starts = corpus.event_arrays(0).starts
+        self.assertIsInstance(starts, np.memmap)
+        self.assertFalse(starts.flags.writeable)
+
+    def test_get_compiled_corpus(self):
+        metadata_path = os.path.join(self.tmp_dir, "metadata.json")
+        mtime = os.stat(metadata_path).st_mtime_ns
+
+        corpus = get_compiled_corpus(TEST_FILE, self.tmp_dir)
+        self.assertEqual(os.stat(metadata_path).st_mtime_ns, mtime)  # not recompiled
+        self.assertEqual(len(corpus), len(self.corpus))
+
+        corpus = get_compiled_corpus(TEST_FILE, self.tmp_dir, use_global_eiid=True)
+        self.assertTrue(corpus.metadata["use_global_eiid"])
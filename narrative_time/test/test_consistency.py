@@ -0,0 +1,122 @@
+import unittest
+
+import numpy as np
+
+from narrative_time.event_relations import REL_TO_ID, INVERSE_REL, get_relation_matrix, encode_events
+from narrative_time.consistency import (
+    COMPOSITION_TABLE,
+    expand_relations,
+    find_inconsistent_triples,
+    propagate,
+    reduce_relations,
+    to_bitsets,
+    verify_reduction,
+)
+
+
+def make_matrix(n_events, relations):
+    """relations: dict (i, j) -> relation name, (j, i) gets the inverse, everything else is VAGUE"""
+    matrix = np.full((n_events, n_events), REL_TO_ID["VAGUE"], dtype=np.int8)
+    np.fill_diagonal(matrix, -1)
+    for (i, j), relation in relations.items():
+        matrix[i, j] = REL_TO_ID[relation]
+        matrix[j, i] = REL_TO_ID[INVERSE_REL[relation]]
+    return matrix
+
+
+class TestCompositionTable(unittest.TestCase):
+    def test_before_before(self):
+        before = REL_TO_ID["BEFORE"]
+        self.assertEqual(COMPOSITION_TABLE[before, before], 1 << before)
+
+    def test_simultaneous_is_identity(self):
+        simultaneous = REL_TO_ID["SIMULTANEOUS"]
+        for relation in ["BEFORE", "AFTER", "INCLUDES", "IS_INCLUDED", "OVERLAP"]:
+            relation_id = REL_TO_ID[relation]
+            self.assertEqual(COMPOSITION_TABLE[simultaneous, relation_id], 1 << relation_id, relation)
+
+
+class TestFindInconsistentTriples(unittest.TestCase):
+    def test_before_cycle(self):
+        matrix = make_matrix(3, {
+            (0, 1): "BEFORE", (1, 2): "BEFORE", (2, 0): "BEFORE",
+        })
+        triples = find_inconsistent_triples(matrix).tolist()
+        self.assertIn([0, 1, 2], triples)
+        self.assertIn([1, 2, 0], triples)
+        self.assertIn([2, 0, 1], triples)
+        self.assertEqual(len(find_inconsistent_triples(matrix, max_triples=2)), 2)
+
+    def test_consistent(self):
+        matrix = make_matrix(3, {(0, 1): "BEFORE", (1, 2): "INCLUDES", (0, 2): "BEFORE"})
+        self.assertEqual(len(find_inconsistent_triples(matrix)), 0)
+
+    def test_vague_is_not_checked(self):
+        matrix = make_matrix(3, {(0, 1): "BEFORE", (1, 2): "BEFORE"})
+        self.assertEqual(len(find_inconsistent_triples(matrix)), 0)
+
+    def test_converted_relations(self):
+        events = [
+            {"time": "1", "event_type": "[B]", "branch": ""},
+            {"time": "1:3", "event_type": "[B]", "branch": ""},
+            {"time": "2", "event_type": "{U}", "branch": ""},
+            {"time": "0.1", "event_type": "[U}", "branch": ""},
+            {"time": "3", "event_type": "{U]", "branch": ""},
+            {"time": "2", "event_type": "[B]", "branch": ">2"},
+        ]
+        matrix = get_relation_matrix(*encode_events(events))
+        self.assertEqual(len(find_inconsistent_triples(matrix)), 0)
+
+
+class TestPropagate(unittest.TestCase):
+    def test_infers_before(self):
+        matrix = make_matrix(3, {(0, 1): "BEFORE", (1, 2): "BEFORE"})
+        bitsets, is_consistent = propagate(matrix)
+
+        self.assertTrue(is_consistent)
+        self.assertEqual(bitsets[0, 2], 1 << REL_TO_ID["BEFORE"])
+
+    def test_inconsistent(self):
+        matrix = make_matrix(3, {(0, 1): "BEFORE", (1, 2): "BEFORE", (2, 0): "BEFORE"})
+        _, is_consistent = propagate(matrix)
+        self.assertFalse(is_consistent)
+
+    def test_to_bitsets(self):
+        matrix = make_matrix(3, {(0, 1): "INCLUDES"})
+        bitsets = to_bitsets(matrix)
+
+        self.assertEqual(bitsets[0, 1], 1 << REL_TO_ID["INCLUDES"])
+        self.assertEqual(bitsets[1, 0], 1 << REL_TO_ID["IS_INCLUDED"])
+        self.assertEqual(bitsets[0, 0], 1 << REL_TO_ID["SIMULTANEOUS"])
+        self.assertEqual(bin(bitsets[0, 2]).count("1"), len(REL_TO_ID) - 1)  # VAGUE, any relation
+
+
+class TestReduceRelations(unittest.TestCase):
+    def test_timeline(self):
+        # events in a random order on a timeline
+        order = [3, 0, 4, 1, 2]
+        matrix = make_matrix(5, {(i, j): "BEFORE" for i in range(5) for j in range(5) if order.index(i) < order.index(j)})
+        reduced = reduce_relations(matrix)
+
+        self.assertEqual(np.sum(reduced != -1), 4)
+        self.assertEqual(len(verify_reduction(reduced, matrix)), 0)
+        np.testing.assert_array_equal(expand_relations(reduced), matrix)
+
+    def test_vague_and_inconsistent(self):
+        matrix = make_matrix(4, {(0, 1): "BEFORE", (1, 2): "BEFORE", (2, 0): "BEFORE", (2, 3): "INCLUDES"})
+        np.testing.assert_array_equal(expand_relations(reduce_relations(matrix)), matrix)
+
+    def test_converted_relations(self):
+        events = [
+            {"time": "1", "event_type": "[B]", "branch": ""},
+            {"time": "1:3", "event_type": "[B]", "branch": ""},
+            {"time": "2", "event_type": "{U}", "branch": ""},
+            {"time": "", "event_type": "{U}", "branch": ">2"},
+            {"time": "", "event_type": "{U}", "branch": "<1$"},
+            {"time": "3", "event_type": "{U]", "branch": ""},
+            {"time": "2", "event_type": "[B]", "branch": ">2"},
+        ]
+        matrix = get_relation_matrix(*encode_events(events))
+        reduced = reduce_relations(matrix)
+        self.assertLess(np.sum(reduced != -1), np.sum(matrix != -1) // 2)
+        np.testing.assert_array_equal(expand_relations(reduced), matrix)
@@ -0,0 +1,64 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from narrative_time import conversion_cache, conversion_utils
+from narrative_time.conversion_cache import ConversionCache, convert_document, document_hash
+
+
+TEST_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), "test_new_rules.jsonl")
+
+
+class TestConversionCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.annotations = conversion_utils.get_annotations(TEST_FILE)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_same_as_conversion(self):
+        cache = ConversionCache(self.tmp_dir)
+        for use_branches in [True, False]:
+            for annotation in self.annotations[:5]:
+                expected_events, expected_matrix = convert_document(annotation, corpus_offset=3, use_branches=use_branches)
+                for _ in range(2):  # miss, then hit
+                    events, matrix = cache.convert(annotation, corpus_offset=3, use_branches=use_branches)
+                    self.assertEqual(list(events.items()), list(expected_events.items()))
+                    self.assertTrue(np.array_equal(matrix, expected_matrix))
+                    self.assertEqual(matrix.dtype, np.int8)
+
+        self.assertEqual(len(cache), 10)
+
+    def test_key(self):
+        annotation = self.annotations[0]
+        key = ConversionCache.make_key(annotation, corpus_offset=0)
+        self.assertNotEqual(key, ConversionCache.make_key(annotation, corpus_offset=1))
+        self.assertNotEqual(key, ConversionCache.make_key(annotation | {"text": annotation["text"] + " "}, corpus_offset=0))
+
+    def test_key_does_not_depend_on_orjson(self):
+        annotation = {"id": "x", "text": "café", "events": []}
+        keys = [document_hash(annotation), ConversionCache.make_key(annotation, corpus_offset=0)]
+        with mock.patch.object(conversion_cache, "orjson", None):
+            self.assertEqual([document_hash(annotation), ConversionCache.make_key(annotation, corpus_offset=0)], keys)
+        self.assertNotEqual(keys[0], keys[1])
+
+    def test_eviction(self):
+        cache = ConversionCache(self.tmp_dir)
+        for annotation in self.annotations[:3]:
+            cache.convert(annotation)
+        entry_size = max(os.path.getsize(os.path.join(self.tmp_dir, f)) for f in os.listdir(self.tmp_dir))
+
+        # the first entry is the least recently used one after the second and the third are read again
+        keys = [ConversionCache.make_key(a, corpus_offset=0, use_branches=True) for a in self.annotations[:3]]
+        for i, key in enumerate(keys):
+            os.utime(cache._path(key), ns=(i, i))
+
+        cache = ConversionCache(self.tmp_dir, max_size=2 * entry_size)
+        cache.evict()
+        self.assertIsNone(cache.get(keys[0]))
+        self.assertIsNotNone(cache.get(keys[2]))
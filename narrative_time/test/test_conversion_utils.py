@@ -0,0 +1,286 @@
+import os
+import gzip
+import json
+import lzma
+import shutil
+import pathlib
+import tempfile
+import unittest
+from unittest import mock
+
+from narrative_time.conversion_utils import (
+    SpanIndex,
+    CoreferenceClusters,
+    convert_span_to_events,
+    AnnotationIndex,
+    add_invisible_events_to_event_order,
+    get_annotation,
+    get_annotation_index,
+    get_annotations,
+    get_events_and_timexes,
+    iter_annotations,
+    parse_shard,
+    get_event_by_word_id,
+    make_coreference_index,
+    make_word_index,
+)
+
+
+class TestSpanIndex(unittest.TestCase):
+    def setUp(self):
+        # dict order is not the span order on purpose
+        self.spans = {"3": [30, 31], "0": [5, 5], "1": [10, 12], "t0": [7, 8], "2": [20, 20]}
+
+    def test_find_inside(self):
+        index = SpanIndex(self.spans)
+
+        self.assertEqual(index.find_inside(0, 100), ["3", "0", "1", "t0", "2"])
+        self.assertEqual(index.find_inside(5, 10), ["0", "t0"])
+        self.assertEqual(index.find_inside(10, 11), [])  # "1" starts inside, but ends outside
+        self.assertEqual(index.find_inside(20, 20), ["2"])
+        self.assertEqual(index.find_inside(40, 50), [])
+
+    def test_convert_span_to_events(self):
+        all_events = {k: {"span": v} for k, v in self.spans.items()}
+        index = SpanIndex.from_events(all_events)
+
+        events = convert_span_to_events((5, 12), all_events, span_index=index)
+        self.assertEqual(list(events.keys()), ["0", "1", "t0"])
+        with mock.patch.object(SpanIndex, "__init__", side_effect=AssertionError("one-off calls scan the events")):
+            self.assertEqual(events, convert_span_to_events((5, 12), all_events))
+            with self.assertRaises(RuntimeError):
+                convert_span_to_events((13, 19), all_events)
+
+        with self.assertRaises(RuntimeError):
+            convert_span_to_events((13, 19), all_events, span_index=index)
+
+
+class TestWordIndex(unittest.TestCase):
+    def test_get_event_by_word_id(self):
+        all_events = {"0": {"span": [5, 5]}, "1": {"span": [10, 12]}, "t0": {"span": [10, 11]}}
+        word_index = make_word_index(all_events)
+
+        for word_id in [5, 10]:
+            self.assertEqual(
+                get_event_by_word_id(word_id, all_events, word_index=word_index),
+                get_event_by_word_id(word_id, all_events),
+            )
+        with self.assertRaises(ValueError):
+            get_event_by_word_id(11, all_events, word_index=word_index)
+
+
+class TestCoreferenceClusters(unittest.TestCase):
+    def test_union(self):
+        clusters = CoreferenceClusters()
+        clusters.add_chain(["a", "b"])
+        clusters.add_chain(["c", "d", "e"])
+        clusters.add_chain(["f"])
+        self.assertNotEqual(clusters.cluster_id("a"), clusters.cluster_id("c"))
+
+        clusters.add_chain(["e", "b"])
+        self.assertEqual(clusters.cluster_id("a"), clusters.cluster_id("d"))
+        self.assertEqual(clusters.members("e"), ["a", "b", "c", "d", "e"])
+        self.assertEqual(clusters.clusters(), [["a", "b", "c", "d", "e"], ["f"]])
+        self.assertEqual(clusters.last_chain("b"), 3)
+        self.assertEqual(clusters.last_chain("a"), 0)
+
+    def test_make_coreference_index(self):
+        events = {"ei0": {"span": [1, 1]}, "ei1": {"span": [4, 4]}, "ei2": {"span": [7, 8]}, "t0": {"span": [9, 9]}}
+        clusters = make_coreference_index(events, {"4": [1], "7": [9]})
+
+        self.assertEqual(clusters.members("ei0"), ["ei1", "ei0"])
+        self.assertEqual(clusters.members("t0"), ["ei2", "t0"])
+        self.assertNotIn("x", clusters)
+
+    def test_invisible_events(self):
+        events = {f"ei{i}": {"span": [i, i], "is_timex": False} for i in range(4)}
+
+        def labels(time):
+            return {"is_visible_during_annotation": True, "event_type": "[B]", "time": time, "branch": "", "factuality": ""}
+
+        event_order = {"ei0": events["ei0"] | labels("1"), "ei3": events["ei3"] | labels("5")}
+
+        # ei2 takes the time of ei1, an invisible event added before it
+        event_order_with_invisible = add_invisible_events_to_event_order(
+            event_order=event_order,
+            invisible_event_ids=["ei1", "ei2"],
+            event_coreference={"2": [0, 1], "1": [3]},
+            events_and_timexes=events,
+        )
+        self.assertEqual(event_order_with_invisible["ei1"]["time"], "5")
+        self.assertEqual(event_order_with_invisible["ei2"]["time"], "5")
+        self.assertFalse(event_order_with_invisible["ei2"]["is_visible_during_annotation"])
+
+        # the last chain that mentions ei1 has no events in event_order yet
+        with self.assertRaisesRegex(RuntimeError, "Could not find coreferent event for ei1"):
+            add_invisible_events_to_event_order(
+                event_order=event_order,
+                invisible_event_ids=["ei1", "ei2"],
+                event_coreference={"0": [1], "1": [2]},
+                events_and_timexes=events,
+            )
+
+
+TEST_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), "test_new_rules.jsonl")
+
+
+class TestIterAnnotations(unittest.TestCase):
+    def test_iter_annotations(self):
+        annotations = iter_annotations(TEST_FILE)
+        first = next(annotations)
+        self.assertEqual([first] + list(annotations), get_annotations(TEST_FILE))
+
+        with open(TEST_FILE) as f:
+            document = json.loads(f.readline())
+        self.assertEqual(first["id"], document["id"])
+        for idx, event in first["event_order"].items():
+            self.assertNotIn("type", event)
+            self.assertEqual(event["event_type"], document["event_order"][idx]["type"])
+
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class TestCompressedAnnotations(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        with open(TEST_FILE, "rb") as f:
+            self.data = f.read()
+        self.annotations = get_annotations(TEST_FILE)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _check(self, path):
+        self.assertEqual(list(iter_annotations(path)), self.annotations)
+
+        ids = [self.annotations[2]["id"], self.annotations[0]["id"]]
+        self.assertEqual(get_annotations(path, ids=ids), [self.annotations[2], self.annotations[0]])
+        with self.assertRaises(ValueError):
+            get_annotation_index(path)
+
+    def test_gzip(self):
+        path = os.path.join(self.tmp_dir, "corpus.jsonl.gz")
+        with gzip.open(path, "wb") as f:
+            f.write(self.data)
+        self._check(path)
+
+    def test_xz(self):
+        path = os.path.join(self.tmp_dir, "corpus.jsonl.xz")
+        with lzma.open(path, "wb") as f:
+            f.write(self.data)
+        self._check(path)
+
+    @unittest.skipIf(zstandard is None, "zstandard is not installed")
+    def test_zstd(self):
+        path = os.path.join(self.tmp_dir, "corpus.jsonl.zst")
+        with open(path, "wb") as f:
+            f.write(zstandard.ZstdCompressor().compress(self.data))
+        self._check(path)
+
+
+class TestAnnotationIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "corpus.jsonl")
+        with open(TEST_FILE) as f_in, open(self.path, "w") as f_out:
+            f_out.writelines(line.rstrip("\n") + "\n" for line in f_in)
+        self.annotations = get_annotations(TEST_FILE, as_dict=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_get_annotation(self):
+        index = get_annotation_index(self.path)
+        self.assertTrue(os.path.exists(AnnotationIndex.index_path(self.path)))
+        self.assertEqual(list(index), list(self.annotations))
+
+        for doc_id, annotation in self.annotations.items():
+            self.assertEqual(get_annotation(self.path, doc_id, index=index), annotation)
+            self.assertEqual(index.n_events(doc_id), len(annotation["events"]))
+
+        ids = list(self.annotations)[::-1]
+        self.assertEqual(get_annotations(self.path, ids=ids), [self.annotations[doc_id] for doc_id in ids])
+        self.assertEqual(get_annotations(pathlib.Path(self.path), ids=ids), [self.annotations[doc_id] for doc_id in ids])
+        with self.assertRaises(KeyError):
+            get_annotation(self.path, "missing", index=index)
+
+    def test_update(self):
+        get_annotation_index(self.path)
+
+        # appended documents are indexed
+        with open(TEST_FILE) as f:
+            document = json.loads(f.readline())
+        document["id"] = "appended"
+        with open(self.path, "a") as f:
+            f.write(json.dumps(document) + "\n")
+
+        index = get_annotation_index(self.path)
+        self.assertEqual(len(index), len(self.annotations) + 1)
+        self.assertEqual(get_annotation(self.path, "appended", index=index)["events"], document["events"])
+
+        # documents in the middle are edited without moving the last one, the file still grows
+        with open(self.path) as f:
+            lines = f.readlines()
+        edited = json.loads(lines[1])
+        edited["events"] = dict(list(edited["events"].items())[:1])
+        padded = json.loads(lines[2])
+        compact = {"ensure_ascii": False, "separators": (",", ":")}  # same as the test file
+        n_bytes = len((lines[1] + lines[2]).encode("utf-8"))
+        lines[1] = json.dumps(edited, **compact) + "\n"
+        n_padding = n_bytes - len((lines[1] + json.dumps(padded, **compact) + "\n").encode("utf-8"))
+        padded["text"] += " " * n_padding
+        lines[2] = json.dumps(padded, **compact) + "\n"
+        self.assertEqual(len((lines[1] + lines[2]).encode("utf-8")), n_bytes)
+        lines.append(json.dumps(document | {"id": "appended_again"}) + "\n")
+        with open(self.path, "w") as f:
+            f.writelines(lines)
+
+        index = get_annotation_index(self.path)
+        self.assertEqual(len(index), len(self.annotations) + 2)
+        self.assertEqual(index.n_events(edited["id"]), 1)
+        self.assertEqual(get_annotation(self.path, edited["id"], index=index)["text"], edited["text"])
+        self.assertEqual(get_annotation(self.path, padded["id"], index=index)["text"], padded["text"])
+        for doc_id in list(self.annotations)[3:]:
+            self.assertEqual(get_annotation(self.path, doc_id, index=index), self.annotations[doc_id])
+        self.assertEqual(get_annotation(self.path, "appended_again", index=index)["events"], document["events"])
+
+        # rewritten file is indexed from scratch
+        with open(self.path, "w") as f:
+            f.write(json.dumps(document) + "\n")
+
+        index = get_annotation_index(self.path)
+        self.assertEqual(list(index), ["appended"])
+        self.assertEqual(AnnotationIndex.load(self.path).documents, index.documents)
+
+
+class TestShards(unittest.TestCase):
+    def test_shards_partition_the_corpus(self):
+        ids = [annotation["id"] for annotation in get_annotations(TEST_FILE)]
+        for shard_by in ["index", "hash"]:
+            shards = [[a["id"] for a in iter_annotations(TEST_FILE, shard=f"{i}/3", shard_by=shard_by)] for i in range(3)]
+            self.assertEqual(sorted(sum(shards, [])), sorted(ids))
+            self.assertTrue(all(len(shard) > 0 for shard in shards))
+
+        self.assertEqual(get_annotations(TEST_FILE, shard=(1, 2)), get_annotations(TEST_FILE)[1::2])
+
+    def test_parse_shard(self):
+        self.assertEqual(parse_shard("2/4"), (2, 4))
+        for shard in ["4/4", "-1/4", "1", "a/b"]:
+            with self.assertRaises(ValueError):
+                parse_shard(shard)
+
+
+class TestGetEventsAndTimexes(unittest.TestCase):
+    def test_annotation_is_not_modified(self):
+        for annotation in get_annotations(TEST_FILE):
+            original = json.dumps(annotation)
+            events_and_timexes = get_events_and_timexes(annotation)
+            self.assertEqual(json.dumps(annotation), original)
+
+            # the same parsed annotation can be converted again
+            self.assertEqual(get_events_and_timexes(annotation), events_and_timexes)
+            self.assertEqual(len(events_and_timexes), len(annotation["events"]) + len(annotation["timex"]))
@@ -1,6 +1,33 @@
 import unittest
+import itertools
+from unittest import mock
+
+import numpy as np
 
 from narrative_time.event_relations import to_interval, get_event_relation_separate_branches, Interval
+from narrative_time.event_relations import get_event_relation, get_relation_matrix, encode_events, REL_TO_ID
+from narrative_time.event_relations import CONVERION_TABLE, RELATION_TABLE, TYPE_TO_ID, INTERVAL_REL_TO_ID
+from narrative_time.event_relations import EventRecord, iter_relations, get_branch_groups
+from narrative_time.event_relations import audit_inverse_relations
+from narrative_time import event_relations
+
+
+# a bit of everything: all types, permanent {U}, intervals, main timeline and branches
+EVENTS = [
+    {"time": "1", "event_type": "[B]", "branch": ""},
+    {"time": "1:3", "event_type": "[B]", "branch": ""},
+    {"time": "2", "event_type": "[B]", "branch": ">2"},
+    {"time": "-1", "event_type": "[B]", "branch": "<1"},
+    {"time": ":", "event_type": "{U}", "branch": ""},
+    {"time": "", "event_type": "{U}", "branch": ">2"},
+    {"time": "2", "event_type": "{U}", "branch": ""},
+    {"time": "0:4", "event_type": "{U}", "branch": "<1"},
+    {"time": "0.1", "event_type": "[U}", "branch": ""},
+    {"time": "1:2", "event_type": "[U}", "branch": ">2$"},
+    {"time": "3", "event_type": "{U]", "branch": ""},
+    {"time": "0.1", "event_type": "{U]", "branch": ">2"},
+    {"time": "4", "event_type": "[U}", "branch": "2<"},
+]
 
 
 class TestToInterval(unittest.TestCase):
@@ -119,3 +146,210 @@ class TestGetEventRelatinSeparateBranches(unittest.TestCase):
         event2 = {"time": "10", "event_type": "{U]", "branch": ""}
 
         self.assertEqual(get_event_relation_separate_branches(event1, event2), "VAGUE")
+
+
+class TestEventRecord(unittest.TestCase):
+    def test_parsing(self):
+        record = EventRecord.from_dict({"time": "1:2", "event_type": "[U}", "branch": ">5$", "id": "ei1"})
+
+        self.assertEqual(record.id, "ei1")
+        self.assertEqual(record.type_id, TYPE_TO_ID["[U}"])
+        self.assertEqual(record.interval, Interval(1, 2))
+        self.assertEqual(record.timeline_interval, Interval(5, float("inf")))
+        self.assertFalse(record.is_unbounded)
+
+    def test_permanent(self):
+        record = EventRecord(":", "{U}")
+
+        self.assertTrue(record.is_permanent)
+        self.assertEqual(record.timeline_interval, Interval(float("-inf"), float("inf")))
+
+    def test_same_as_dict(self):
+        for (i, event1), (j, event2) in itertools.product(enumerate(EVENTS), repeat=2):
+            record1, record2 = EventRecord.from_dict(event1), EventRecord.from_dict(event2)
+            if event1["branch"] == event2["branch"]:
+                self.assertEqual(get_event_relation(record1, record2), get_event_relation(event1, event2))
+            else:
+                self.assertEqual(
+                    get_event_relation_separate_branches(record1, record2),
+                    get_event_relation_separate_branches(event1, event2),
+                )
+
+
+class TestInverseRelations(unittest.TestCase):
+    def test_audit(self):
+        """the only asymmetric case is permanent {U} vs permanent {U} on different branches"""
+        asymmetric = audit_inverse_relations()
+        self.assertGreater(len(asymmetric), 0)
+
+        for event1, event2, relation, inverse_relation in asymmetric:
+            self.assertEqual(event1["event_type"], "{U}")
+            self.assertEqual(event2["event_type"], "{U}")
+            self.assertIn(event1["time"], ["", ":"])
+            self.assertIn(event2["time"], ["", ":"])
+            self.assertNotEqual(event1["branch"], event2["branch"])
+            self.assertEqual(relation, "INCLUDES")
+
+
+class TestRelationTable(unittest.TestCase):
+    def test_same_as_conversion_table(self):
+        for (type1, type2), conversion in CONVERION_TABLE.items():
+            for interval_relation, interval_relation_id in INTERVAL_REL_TO_ID.items():
+                relation_id = RELATION_TABLE[TYPE_TO_ID[type1], TYPE_TO_ID[type2], interval_relation_id]
+                self.assertEqual(relation_id, REL_TO_ID[conversion[interval_relation]])
+
+
+class TestGetRelationMatrix(unittest.TestCase):
+    def test_same_as_pairwise(self):
+        relations = get_relation_matrix(*encode_events(EVENTS))
+
+        for (i, event1), (j, event2) in itertools.product(enumerate(EVENTS), repeat=2):
+            if i == j:
+                self.assertEqual(relations[i, j], -1)
+                continue
+
+            if event1["branch"] == event2["branch"]:
+                expected = get_event_relation(event1, event2)
+            else:
+                expected = get_event_relation_separate_branches(event1, event2)
+            self.assertEqual(relations[i, j], REL_TO_ID[expected], f"{event1} vs {event2}")
+
+    def test_many_events(self):
+        """more events than a single block of rows, both computed and mirrored cells are checked"""
+        events = EVENTS * 25
+        relations = get_relation_matrix(*encode_events(events))
+
+        for i in range(240, 280):
+            for j, event2 in enumerate(events):
+                event1 = events[i]
+                if i == j: continue
+                if event1["branch"] == event2["branch"]:
+                    expected = get_event_relation(event1, event2)
+                else:
+                    expected = get_event_relation_separate_branches(event1, event2)
+                self.assertEqual(relations[i, j], REL_TO_ID[expected], f"{event1} vs {event2}")
+
+    def test_ignore_branches(self):
+        event_arrays = encode_events(EVENTS)
+        relations = get_relation_matrix(event_arrays.starts, event_arrays.ends, event_arrays.types)
+
+        for (i, event1), (j, event2) in itertools.product(enumerate(EVENTS), repeat=2):
+            if i == j: continue
+            expected = get_event_relation(event1, event2)
+            self.assertEqual(relations[i, j], REL_TO_ID[expected], f"{event1} vs {event2}")
+
+    def test_degenerate_intervals_on_branches(self):
+        """"2:2" has the same endpoints as "2", but is not extended to infinity on the main timeline"""
+        events = [
+            {"time": "2:2", "event_type": "[U}", "branch": "<3"},
+            {"time": "2", "event_type": "[U}", "branch": "<3"},
+            {"time": "2:2", "event_type": "{U]", "branch": ">1"},
+            {"time": "2", "event_type": "{U]", "branch": ">1"},
+            {"time": "0", "event_type": "[B]", "branch": ""},
+            {"time": "4", "event_type": "[B]", "branch": ""},
+        ]
+        event_arrays = encode_events(events)
+        self.assertEqual(event_arrays.is_point.tolist(), [False, True, False, True, True, True])
+
+        relations = get_relation_matrix(*event_arrays)
+        for (i, event1), (j, event2) in itertools.product(enumerate(events), repeat=2):
+            if i == j: continue
+            if event1["branch"] == event2["branch"]:
+                expected = get_event_relation(event1, event2)
+            else:
+                expected = get_event_relation_separate_branches(event1, event2)
+            self.assertEqual(relations[i, j], REL_TO_ID[expected], f"{event1} vs {event2}")
+        self.assertEqual(relations[0, 5], REL_TO_ID["BEFORE"])
+        self.assertEqual(relations[1, 5], REL_TO_ID["VAGUE"])
+        self.assertEqual(relations[2, 4], REL_TO_ID["AFTER"])
+        self.assertEqual(relations[3, 4], REL_TO_ID["VAGUE"])
+
+    def test_permanent_unbounded_overlap(self):
+        events = [{"time": "", "event_type": "{U}"}, {"time": ":", "event_type": "{U}"}]
+        relations = get_relation_matrix(*encode_events(events))
+
+        self.assertEqual(relations[0, 1], REL_TO_ID["OVERLAP"])
+        self.assertEqual(relations[1, 0], REL_TO_ID["OVERLAP"])
+
+
+class TestGetBranchGroups(unittest.TestCase):
+    def test_branch_classes(self):
+        events = [
+            {"time": "1", "event_type": "[B]", "branch": ">5"},
+            {"time": "2", "event_type": "[B]", "branch": ">5"},
+            {"time": "3", "event_type": "[U}", "branch": ">5"},
+            {"time": "4", "event_type": "{U]", "branch": ">5"},
+            {"time": "1", "event_type": "[B]", "branch": ""},
+            {"time": "2", "event_type": "[B]", "branch": ""},
+        ]
+        groups = get_branch_groups(*encode_events(events))
+        self.assertEqual(len(groups), 2)
+
+        main, branch = groups
+        self.assertEqual(main.members.tolist(), [4, 5])
+        self.assertEqual(len(main.class_members), 2)
+
+        # [B] and [U} on >5 are both at [5, inf], {U] is at [-inf, inf]
+        self.assertEqual(branch.members.tolist(), [0, 1, 2, 3])
+        self.assertEqual(len(branch.class_members), 2)
+        self.assertEqual(branch.classes[0], branch.classes[1])
+        self.assertEqual(branch.classes[0], branch.classes[2])
+        self.assertNotEqual(branch.classes[0], branch.classes[3])
+
+
+class TestIterRelations(unittest.TestCase):
+    def assertSameAsMatrix(self, *event_arrays):
+        relations = get_relation_matrix(*event_arrays)
+        expected = {
+            (i, j): relations[i, j]
+            for i, j in itertools.product(range(len(relations)), repeat=2)
+            if i != j and relations[i, j] != REL_TO_ID["VAGUE"]
+        }
+
+        found = list(iter_relations(*event_arrays))
+        self.assertEqual(len(found), len(expected))
+        self.assertEqual({(i, j): relation for i, j, relation in found}, expected)
+
+    def test_same_as_matrix(self):
+        self.assertSameAsMatrix(*encode_events(EVENTS))
+
+    def test_ignore_branches(self):
+        event_arrays = encode_events(EVENTS)
+        self.assertSameAsMatrix(event_arrays.starts, event_arrays.ends, event_arrays.types)
+
+    def test_point_events(self):
+        events = [
+            {"time": "1", "event_type": "[B]"},
+            {"time": "1", "event_type": "[B]"},
+            {"time": "1:2", "event_type": "[B]"},
+            {"time": "0:1", "event_type": "{U]"},
+            {"time": "1", "event_type": "[U}"},
+        ]
+        self.assertSameAsMatrix(*encode_events(events))
+
+    def test_empty(self):
+        self.assertEqual(list(iter_relations(*encode_events([]))), [])
+
+    def test_candidates_mixed_types(self):
+        # [B] vs {U}: only points at the same time are not VAGUE, other cols after the row must not be compared
+        events = [{"time": str(t % 20), "event_type": event_type} for t in range(200) for event_type in ["[B]", "{U}"]]
+        event_arrays = encode_events(events)
+        self.assertSameAsMatrix(event_arrays.starts, event_arrays.ends, event_arrays.types)
+
+        n_candidates = 0
+        get_interval_relation_matrix = event_relations.get_interval_relation_matrix
+
+        def count_candidates(start, end, col_starts, col_ends):
+            nonlocal n_candidates
+            n_candidates += len(col_starts)
+            return get_interval_relation_matrix(start, end, col_starts, col_ends)
+
+        rows = np.flatnonzero(event_arrays.types == TYPE_TO_ID["[B]"])
+        cols = np.flatnonzero(event_arrays.types == TYPE_TO_ID["{U}"])
+        with mock.patch.object(event_relations, "get_interval_relation_matrix", count_candidates):
+            found = list(event_relations._iter_block_relations(
+                rows, cols, event_arrays.starts, event_arrays.ends, RELATION_TABLE[TYPE_TO_ID["[B]"], TYPE_TO_ID["{U}"]],
+            ))
+
+        self.assertEqual(len(found), len(rows) * 10)  # every [B] is included in 10 {U} at the same time
+        self.assertEqual(n_candidates, len(found))
@@ -1,11 +1,15 @@
 # Same as test_nt2tml.py, but with the new rules from
 # https://docs.google.com/spreadsheets/d/1wAhWUTkyii5NYedwGzplgGVMT1odVoF3WPfUAfRNniI
+import io
 import os
 import sys
 import json
 import shutil
+import tempfile
 import unittest
+from unittest import mock
 
+import numpy as np
 from bs4 import BeautifulSoup
 
 # 1. script requires you to be in the script directory, because it relies on relative paths to the data
@@ -14,7 +18,13 @@ dir_path = os.path.dirname(os.path.realpath(__file__))
 os.chdir(dir_path)
 sys.path.append(os.path.join(dir_path, "../../utils"))
 
-from nt2tml import parse_nt_json
+import nt2tml
+from nt2tml import parse_nt_json, merge_shards, convert_to_timeml, text2xml, write_text, write_timeml, XML_HEADER, XML_FOOTER
+from narrative_time.conversion_utils import get_annotations, prettify_soup
+from narrative_time.timeml_corpus import TLINK_PROFILES, GraphCache, TimeMLCorpus, get_tlink_profile, make_graph, read_graph
+from narrative_time.event_relations import INVERSE_REL, REL_TO_ID
+from narrative_time.consistency import expand_relations
+from narrative_time import conversion_cache
 
 
 def test_tlinks(all_relations, all_soups, bidirectional=True, timex=False):
@@ -86,6 +96,326 @@ class TestConversionScriptSucceeds(unittest.TestCase):
         shutil.rmtree("converted")
 
 
+class TestStreamingSerialization(unittest.TestCase):
+    def _check(self, annotation, add_narrative_time_info):
+        f = io.StringIO()
+        write_timeml(f, annotation, add_narrative_time_info=add_narrative_time_info, corpus_offset=7)
+        soup = convert_to_timeml(annotation, add_narrative_time_info=add_narrative_time_info, corpus_offset=7)
+        self.assertEqual(f.getvalue(), prettify_soup(soup))
+
+    def test_same_as_soup(self):
+        for annotation in get_annotations("test_new_rules.jsonl")[:5]:
+            self._check(annotation, add_narrative_time_info=False)
+            self._check(annotation, add_narrative_time_info=True)
+
+    def test_escaping(self):
+        text = 'a & <b> "c"\nd e f'
+        events_and_timexes = {
+            "t0": {"span": [0, 0], "is_timex": True, "comment": 'say "hi"', "value": None},
+            "ei0": {"span": [2, 3], "is_timex": False, "eid": "0", "comment": "it's \"quoted\" & <escaped>\n", "pos": "VERB"},
+        }
+        f = io.StringIO()
+        write_text(f, text, events_and_timexes)
+        self.assertEqual(XML_HEADER + f.getvalue() + XML_FOOTER, prettify_soup(text2xml(text, events_and_timexes)))
+
+
+class TestTlinkProfiles(unittest.TestCase):
+    def _tlinks(self, annotation, tlink_profile):
+        f = io.StringIO()
+        write_timeml(f, annotation, tlink_profile=tlink_profile)
+        soup = BeautifulSoup(f.getvalue(), "xml")
+        self.assertEqual(get_tlink_profile(soup), tlink_profile)
+
+        tlinks = {}
+        for tlink in soup.find_all("TLINK"):
+            left = tlink.get("eventInstanceID") or tlink.get("timeID")
+            right = tlink.get("relatedToEventInstance") or tlink.get("relatedToTime")
+            self.assertNotIn((left, right), tlinks)
+            tlinks[(left, right)] = tlink["relType"]
+        return tlinks
+
+    def test_compact_profiles(self):
+        annotation = get_annotations("test_new_rules.jsonl")[1]
+        full = self._tlinks(annotation, "full")
+
+        for tlink_profile in ["one_direction", "one_direction_no_vague"]:
+            tlinks = self._tlinks(annotation, tlink_profile)
+            self.assertLess(len(tlinks), len(full) / 2 + 1)
+
+            for (left, right), relation in full.items():
+                if (left, right) in tlinks:
+                    self.assertEqual(tlinks[(left, right)], relation)
+                elif (right, left) in tlinks:
+                    self.assertEqual(INVERSE_REL[tlinks[(right, left)]], relation)
+                else:
+                    self.assertEqual(tlink_profile, "one_direction_no_vague")
+                    self.assertEqual(relation, "VAGUE")
+
+    def test_reduced_profile(self):
+        annotation = get_annotations("test_new_rules.jsonl")[1]
+        events_and_timexes, relations = conversion_cache.convert_document(annotation)
+        event_vocab = {eeid: i for i, eeid in enumerate(events_and_timexes)}
+
+        tlinks = self._tlinks(annotation, "reduced")
+        self.assertLess(len(tlinks), len(event_vocab) * 2)
+
+        reduced = np.full(relations.shape, -1, dtype=np.int8)
+        for (left, right), relation in tlinks.items():
+            reduced[event_vocab[left], event_vocab[right]] = REL_TO_ID[relation]
+        np.testing.assert_array_equal(expand_relations(reduced), relations)
+
+    def test_read_graph(self):
+        annotation = get_annotations("test_new_rules.jsonl")[1]
+        events_and_timexes, relations = conversion_cache.convert_document(annotation)
+
+        for tlink_profile in TLINK_PROFILES:
+            f = io.StringIO()
+            write_timeml(f, annotation, tlink_profile=tlink_profile)
+            xml = f.getvalue().encode("utf-8")
+
+            graph, event_vocab, error = read_graph(io.BytesIO(xml))
+            self.assertIsNone(error)
+            soup_graph, soup_vocab, soup_error = make_graph(BeautifulSoup(xml, "xml"))
+            self.assertEqual(list(soup_vocab.items()), list(event_vocab.items()))
+            self.assertIsNone(soup_error)
+            np.testing.assert_array_equal(soup_graph, graph)
+            self.assertEqual(sorted(event_vocab.values()), list(range(len(events_and_timexes))))
+            order = [event_vocab[eeid] for eeid in events_and_timexes]
+            np.testing.assert_array_equal(graph[np.ix_(order, order)], relations)
+
+            conversion_vocab = {eeid: i for i, eeid in enumerate(events_and_timexes)}
+            graph, event_vocab, error = read_graph(io.BytesIO(xml), conversion_vocab)
+            self.assertIs(event_vocab, conversion_vocab)
+            np.testing.assert_array_equal(graph, relations)
+            np.testing.assert_array_equal(make_graph(BeautifulSoup(xml, "xml"), conversion_vocab)[0], relations)
+
+        # a pair without TLINKs in both directions
+        f = io.StringIO()
+        write_timeml(f, annotation, tlink_profile="one_direction")
+        left, right = list(events_and_timexes)[:2]
+        xml = "\n".join(
+            line for line in f.getvalue().split("\n")
+            if not (line.startswith("<TLINK ") and f'"{left}"' in line and f'"{right}"' in line)
+        )
+        _, _, error = read_graph(io.BytesIO(xml.encode("utf-8")))
+        self.assertEqual(error, "Some relations are missing")
+        _, _, error = make_graph(BeautifulSoup(xml, "xml"))
+        self.assertEqual(error, "Some relations are missing")
+
+
+class TestGraphCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_same_as_read_graph(self):
+        output_dir = os.path.join(self.tmp_dir, "converted")
+        annotations = get_annotations("test_new_rules.jsonl")[:3]
+        os.makedirs(output_dir)
+        for annotation in annotations:
+            with open(os.path.join(output_dir, f"{annotation['id']}.tml"), "w") as f:
+                write_timeml(f, annotation, tlink_profile="one_direction")
+
+        cache = GraphCache(os.path.join(self.tmp_dir, "cache"))
+        with TimeMLCorpus(output_dir) as corpus:
+            for doc_id in corpus:
+                graph, event_vocab, error = read_graph(os.path.join(output_dir, f"{doc_id}.tml"))
+                shuffled_vocab = {event_id: i for i, event_id in enumerate(sorted(event_vocab))}
+                shuffled_graph, _, _ = read_graph(os.path.join(output_dir, f"{doc_id}.tml"), shuffled_vocab)
+
+                for _ in range(2):  # miss, then hit
+                    cached_graph, cached_vocab, cached_error = corpus.graph(doc_id, cache=cache)
+                    self.assertEqual(list(cached_vocab.items()), list(event_vocab.items()))
+                    self.assertEqual(cached_error, error)
+                    np.testing.assert_array_equal(cached_graph, graph)
+
+                    cached_graph, cached_vocab, _ = corpus.graph(doc_id, shuffled_vocab, cache=cache)
+                    self.assertIs(cached_vocab, shuffled_vocab)
+                    np.testing.assert_array_equal(cached_graph, shuffled_graph)
+
+            # vocabulary of another document
+            other_vocab = dict(event_vocab, missing=len(event_vocab))
+            _, _, error = corpus.graph(doc_id, other_vocab, cache=cache)
+            self.assertEqual(error, "Some relations are missing")
+
+        self.assertEqual(len(cache), len(annotations))
+
+
+class TestParallelConversion(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _write_input(self):
+        with open("test_new_rules.jsonl") as f:
+            lines = f.read().strip().split("\n")[:5]
+
+        # a broken document in the middle changes eiid offsets of the documents after it
+        broken = json.loads(lines[1])
+        broken["event_order"][next(iter(broken["event_order"]))]["time"] = "not a time"
+        lines[1] = json.dumps(broken)
+
+        self.input_file = os.path.join(self.tmp_dir, "input.jsonl")
+        with open(self.input_file, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        return lines
+
+    def _read_outputs(self, output_dir):
+        outputs = {}
+        for file_name in sorted(os.listdir(output_dir)):
+            if file_name.endswith(".tml"):
+                with open(os.path.join(output_dir, file_name)) as f:
+                    outputs[file_name] = f.read()
+        return outputs
+
+    def _convert(self, output_name, **kwargs):
+        output_dir = os.path.join(self.tmp_dir, output_name)
+        error = None
+        try:
+            parse_nt_json(input_file=self.input_file, output_dir=output_dir, verbocity=0, **kwargs)
+        except ValueError as e:
+            error = str(e)
+        return self._read_outputs(output_dir), error
+
+    def test_same_as_serial(self):
+        lines = self._write_input()
+        serial_outputs, serial_error = self._convert("serial", workers=1)
+        parallel_outputs, parallel_error = self._convert("parallel", workers=3)
+
+        self.assertEqual(len(serial_outputs), len(lines) - 1)
+        self.assertEqual(parallel_outputs, serial_outputs)
+        self.assertIsNotNone(serial_error)
+        self.assertEqual(parallel_error, serial_error)
+
+    def test_bounded_read_ahead(self):
+        self._write_input()
+        n_read = 0
+
+        def planned():
+            nonlocal n_read
+            for doc_idx, annotation in enumerate(get_annotations(self.input_file)):
+                n_read += 1
+                yield doc_idx, annotation, 0
+
+        options = {"add_narrative_time_info": False, "tlink_profile": "full", "output_format": "tml"}
+        with mock.patch.object(nt2tml, "PENDING_JOBS_PER_WORKER", 1):
+            conversions = nt2tml._iter_conversions(
+                planned(), self.tmp_dir, use_global_eiid=False, options=options, cache=None, workers=2, fix_offsets=False,
+            )
+            for n_converted, (doc_idx, *_) in enumerate(conversions, start=1):
+                self.assertEqual(doc_idx, n_converted - 1)
+                self.assertLessEqual(n_read, n_converted + 2)
+        self.assertEqual(n_read, 5)
+
+    def test_shards(self):
+        self._write_input()
+        serial_outputs, serial_error = self._convert("serial")
+
+        for shard_by in ["index", "hash"]:
+            shard_dirs = []
+            for shard_idx in range(3):
+                self._convert(f"shard_{shard_by}_{shard_idx}", shard=f"{shard_idx}/3", shard_by=shard_by)
+                shard_dirs.append(os.path.join(self.tmp_dir, f"shard_{shard_by}_{shard_idx}"))
+
+            merged_dir = os.path.join(self.tmp_dir, f"merged_{shard_by}")
+            with self.assertRaises(ValueError) as merge_error:
+                merge_shards(self.input_file, shard_dirs, merged_dir, verbocity=0)
+
+            self.assertEqual(str(merge_error.exception), serial_error)
+            self.assertEqual(self._read_outputs(merged_dir), serial_outputs)
+
+        with self.assertRaises(RuntimeError):
+            merge_shards(self.input_file, shard_dirs[:2], os.path.join(self.tmp_dir, "incomplete"), verbocity=0)
+
+    def test_archive(self):
+        self._write_input()
+        serial_outputs, serial_error = self._convert("serial")
+        with self.assertRaises(ValueError) as archive_error:
+            parse_nt_json(self.input_file, os.path.join(self.tmp_dir, "converted.zip"), verbocity=0, workers=2)
+        self.assertEqual(str(archive_error.exception), serial_error)
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)), ["converted.zip", "input.jsonl", "serial"])
+
+        for path in ["serial", "converted.zip"]:
+            with TimeMLCorpus(os.path.join(self.tmp_dir, path)) as corpus:
+                self.assertEqual(len(corpus), len(serial_outputs))
+                for doc_id in corpus:
+                    self.assertEqual(corpus.read(doc_id), serial_outputs[f"{doc_id}.tml"])
+                self.assertEqual(len(corpus.soup(doc_id).find_all("MAKEINSTANCE")), serial_outputs[f"{doc_id}.tml"].count("<MAKEINSTANCE "))
+                with self.assertRaises(KeyError):
+                    corpus.read("missing")
+
+    def test_relation_bundles(self):
+        self._write_input()
+        serial_outputs, serial_error = self._convert("serial")
+        both_outputs, both_error = self._convert("both", workers=2, output_format="both")
+        _, npz_error = self._convert("npz", output_format="npz")
+        self.assertEqual(both_outputs, serial_outputs)
+        self.assertEqual(both_error, serial_error)
+        self.assertEqual(npz_error, serial_error)
+
+        with TimeMLCorpus(os.path.join(self.tmp_dir, "both")) as both, TimeMLCorpus(os.path.join(self.tmp_dir, "npz")) as npz:
+            self.assertEqual(npz.doc_ids, both.doc_ids)
+            for doc_id in both:
+                bundle = both.relation_bundle(doc_id)
+                self.assertEqual(bundle["doc_id"], doc_id)
+                self.assertEqual(list(bundle["events_and_timexes"]), bundle["event_ids"].tolist())
+
+                # relation matrix of the bundle is the one written as TLINKs
+                index = {event_id: i for i, event_id in enumerate(bundle["event_ids"].tolist())}
+                tlinks = both.soup(doc_id).find_all("TLINK")
+                self.assertEqual(len(tlinks), len(index) ** 2 - len(index))
+                for tlink in tlinks:
+                    source = tlink.get("eventInstanceID") or tlink.get("timeID")
+                    target = tlink.get("relatedToEventInstance") or tlink.get("relatedToTime")
+                    self.assertEqual(bundle["relation_matrix"][index[source], index[target]], REL_TO_ID[tlink["relType"]])
+
+                for key, value in npz.relation_bundle(doc_id).items():
+                    np.testing.assert_equal(value, bundle[key])
+                with self.assertRaises(KeyError):
+                    npz.read(doc_id)
+
+    def test_incremental(self):
+        lines = self._write_input()
+        del lines[1]  # broken document
+        self.input_file = os.path.join(self.tmp_dir, "input.jsonl")
+        with open(self.input_file, "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+        output_dir = os.path.join(self.tmp_dir, "incremental")
+        report = parse_nt_json(input_file=self.input_file, output_dir=output_dir, verbocity=0, incremental=True)
+        ids = [json.loads(line)["id"] for line in lines]
+        self.assertEqual(report["converted"], ids)
+
+        # same length text does not change eiid offsets, removing the last document does not change them either
+        changed = json.loads(lines[2])
+        changed["text"] = "XYZ" + changed["text"][3:]
+        lines[2] = json.dumps(changed)
+        with open(self.input_file, "w") as f:
+            f.write("\n".join(lines[:-1]) + "\n")
+
+        report = parse_nt_json(input_file=self.input_file, output_dir=output_dir, verbocity=0, incremental=True, workers=2)
+        self.assertEqual(report["converted"], [ids[2]])
+        self.assertEqual(report["skipped"], ids[:2])
+        self.assertEqual(report["deleted"], [ids[3]])
+
+        full_outputs, _ = self._convert("full")
+        self.assertEqual(self._read_outputs(output_dir), full_outputs)
+
+        # outputs of the previous settings are removed, documents removed from the input are not left behind
+        report = parse_nt_json(input_file=self.input_file, output_dir=output_dir, verbocity=0, incremental=True, output_format="npz")
+        self.assertEqual(report["converted"], ids[:3])
+        self.assertEqual(sorted(os.listdir(output_dir)), sorted([f"{doc_id}.npz" for doc_id in ids[:3]] + ["nt2tml_manifest.json"]))
+
+        with open(self.input_file, "w") as f:
+            f.write("\n".join(lines[:2]) + "\n")
+        parse_nt_json(input_file=self.input_file, output_dir=output_dir, verbocity=0, incremental=True, output_format="tml")
+        self.assertEqual(sorted(os.listdir(output_dir)), sorted([f"{doc_id}.tml" for doc_id in ids[:2]] + ["nt2tml_manifest.json"]))
+
+
 class TestTlinks(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
@@ -0,0 +1,416 @@
+"""Reading TimeML documents converted by nt2tml.
+
+nt2tml writes one .tml file per document into a folder, or all documents into one .zip archive
+(when the output path ends with .zip). TimeMLCorpus reads documents by id from both,
+archive members are decompressed one at a time without extracting the archive.
+
+With --output_format npz (or both) nt2tml also writes a relation bundle per document (.npz, see save_relation_bundle):
+events and the relation matrix as the converter computed them, loaded without parsing any xml
+(NTAnnotation.from_relation_bundle).
+
+read_graph builds the relation graph of a document (same as make_graph)
+while streaming through the file with lxml, without building the whole xml tree.
+GraphCache saves graphs on disk by the hash of the file, so unchanged files are not parsed again.
+
+Usage example:
+    >>> corpus_a1 = TimeMLCorpus("corpus/timeml_converted/a1.zip")
+    >>> corpus_a2 = TimeMLCorpus("corpus/timeml_converted/a2")
+    >>> graph1, vocab, error = corpus_a1.graph("ABC19980108.1830.0711")
+    >>> graph2, _, error = corpus_a2.graph("ABC19980108.1830.0711", vocab)
+"""
+
+import io
+import os
+import json
+import hashlib
+import zipfile
+
+import numpy as np
+from bs4 import BeautifulSoup
+from lxml import etree
+
+from narrative_time import consistency, conversion_cache
+from narrative_time.event_relations import INVERSE_REL_ID, REL_TO_ID, TYPE_TO_ID
+
+
+TML_SUFFIX = ".tml"
+NPZ_SUFFIX = ".npz"
+ARCHIVE_SUFFIX = ".zip"
+
+# which TLINKs nt2tml writes, recorded in the tlink_profile attribute of the TimeML tag (no attribute for "full")
+#   full: every ordered pair of events
+#   one_direction: one TLINK per pair, the other direction is its inverse (event_relations.INVERSE_REL).
+#       Both directions are written for the few pairs where this is not true.
+#   one_direction_no_vague: same as one_direction, pairs without a TLINK are VAGUE
+#   reduced: minimal set of TLINKs, relations of the other pairs follow from them
+#       (see consistency.reduce_relations and consistency.expand_relations)
+TLINK_PROFILE_ATTRIBUTE = "tlink_profile"
+TLINK_PROFILES = ["full", "one_direction", "one_direction_no_vague", "reduced"]
+
+# bump this when read_graph changes its outputs, old GraphCache entries will not be used
+GRAPH_CACHE_VERSION = 1
+
+
+def get_tlink_profile(soup):
+    """TLINK profile of a TimeML document (BeautifulSoup object)"""
+    return _check_tlink_profile(soup.TimeML.get(TLINK_PROFILE_ATTRIBUTE, "full"))
+
+
+def _check_tlink_profile(profile):
+    if profile not in TLINK_PROFILES:
+        raise ValueError(f"Unknown TLINK profile {profile}, expected one of {TLINK_PROFILES}")
+    return profile
+
+
+def complete_graph(graph, tlink_profile):
+    """Rebuilds the full relation graph from the TLINKs of a compact TLINK profile
+
+    Args:
+        graph: int8 array of shape (n_events, n_events), REL_TO_ID of every TLINK, -1 for pairs without a TLINK
+        tlink_profile: one of TLINK_PROFILES
+
+    Returns:
+        graph: completed graph, -1 on the diagonal
+        error: "Some relations are missing" if some pairs still have no relation, None otherwise
+    """
+    if tlink_profile == "reduced":
+        graph = consistency.expand_relations(graph)
+    elif tlink_profile != "full":
+        # pairs with one TLINK: the other direction is the inverse
+        missing = (graph == -1) & (graph.T != -1)
+        graph[missing] = INVERSE_REL_ID[graph.T[missing]]
+
+    if tlink_profile == "one_direction_no_vague":
+        missing = graph == -1
+        np.fill_diagonal(missing, False)
+        graph[missing] = REL_TO_ID["VAGUE"]
+
+    # this approach to error is better for debugging
+    error = None
+    if np.any((graph + np.identity(len(graph))) == -1):
+        error = "Some relations are missing"
+
+    return graph, error
+
+
+def _make_event_vocab(soup):
+    """Make a vocabulary of events/timexes.
+
+    Extracts all eeid (from MAKEINSTANCE) and tid (from TIMEX3) and creates a
+    vocabulary of events/timexes.
+
+    Returns:
+        event_vocab: a dictionary mapping event/timex ids to indices in the graph
+    """
+    # ids are numbered in the order of the document, so the vocabulary does not depend on the process
+    # (no set iteration) and is the same as in read_graph
+    event_vocab = {}
+    for elem in soup.find_all(["MAKEINSTANCE", "TIMEX3"]):
+        event_id = elem["eiid"] if elem.name == "MAKEINSTANCE" else elem["tid"]
+        event_vocab.setdefault(event_id, len(event_vocab))
+    return event_vocab
+
+
+def make_graph(soup, event_vocab=None):
+    """Make a graph from TML soup object.
+
+    Extracts all eeid (from MAKEINSTANCE) and tid (from TIMEX3) and creates a
+    vocabulary of events/timexes. Then, for each event, it extracts all
+    relations (from TLINK) and creates a graph.
+
+    Files written with a compact TLINK profile (see TLINK_PROFILES) only contain one direction
+    of most pairs, and may omit VAGUE pairs or pairs that follow from the others. The full graph is rebuilt from them.
+
+    read_graph (or TimeMLCorpus.graph) returns the same graph and vocabulary without a soup object,
+    which is much faster for whole corpora. GraphCache keeps them on disk between runs.
+
+    Args:
+        soup: a soup object of a TML file
+        event_vocab: (optional) a dictionary mapping event/timex ids to indices in the graph
+
+    Returns:
+        graph: a numpy array of shape (n_events, n_events)
+        event_vocab: a dictionary mapping event/timex ids to indices in the graph
+    """
+    if event_vocab is None:
+        event_vocab = _make_event_vocab(soup)
+
+    # create a graph
+    n_events = len(event_vocab)
+    tlinks = soup.find_all("TLINK")
+    tlink_profile = get_tlink_profile(soup)
+    if tlink_profile == "full":
+        assert len(tlinks) == n_events ** 2 - n_events
+    else:
+        assert len(tlinks) <= n_events ** 2 - n_events
+
+    graph = -1 * np.ones((n_events, n_events), dtype=np.int8)
+    for tlink in tlinks:
+        left = tlink.get("eventInstanceID")
+        if left is None:
+            left = tlink.get("timeID")
+
+        if left is None:
+            raise RuntimeError(tlink)
+
+        right = tlink.get("relatedToEventInstance")
+        if right is None:
+            right = tlink.get("relatedToTime")
+
+        if right is None:
+            raise RuntimeError(tlink)
+
+        assert graph[event_vocab[left], event_vocab[right]] == -1
+        graph[event_vocab[left], event_vocab[right]] = REL_TO_ID[tlink["relType"]]
+
+    graph, error = complete_graph(graph, tlink_profile)
+    return graph, event_vocab, error
+
+
+def read_graph(file, event_vocab=None):
+    """Same as make_graph, but reads the TimeML file with lxml iterparse instead of BeautifulSoup.
+
+    The graph is filled as TLINKs are parsed and parsed elements are freed, so the xml tree is never kept in memory.
+
+    Args:
+        file: path or binary file object of a .tml file
+        event_vocab: (optional) a dictionary mapping event/timex ids to indices in the graph,
+            by default ids of MAKEINSTANCE and TIMEX3 tags in the order of the document
+
+    Returns:
+        graph: a numpy array of shape (n_events, n_events)
+        event_vocab: a dictionary mapping event/timex ids to indices in the graph
+        error: see complete_graph
+    """
+    fixed_vocab = event_vocab is not None
+    if not fixed_vocab:
+        event_vocab = {}
+
+    graph = None
+    n_tlinks = 0
+    context = etree.iterparse(file, events=("end",), tag=("MAKEINSTANCE", "TIMEX3", "TLINK"))
+    for _, elem in context:
+        if elem.tag == "TLINK":
+            if graph is None or len(graph) < len(event_vocab):
+                # TLINKs follow MAKEINSTANCE tags in nt2tml output, the graph only grows for other TimeML files
+                graph = _resize_graph(graph, len(event_vocab))
+
+            left = elem.get("eventInstanceID")
+            if left is None:
+                left = elem.get("timeID")
+            right = elem.get("relatedToEventInstance")
+            if right is None:
+                right = elem.get("relatedToTime")
+            if left is None or right is None:
+                raise RuntimeError(etree.tostring(elem, encoding="unicode"))
+
+            assert graph[event_vocab[left], event_vocab[right]] == -1
+            graph[event_vocab[left], event_vocab[right]] = REL_TO_ID[elem.get("relType")]
+            n_tlinks += 1
+        elif not fixed_vocab:
+            event_id = elem.get("eiid") if elem.tag == "MAKEINSTANCE" else elem.get("tid")
+            event_vocab.setdefault(event_id, len(event_vocab))
+
+        if elem.tag != "TIMEX3":  # TIMEX3 tags are inside TEXT and are freed with it
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+
+    n_events = len(event_vocab)
+    graph = _resize_graph(graph, n_events)
+    tlink_profile = _check_tlink_profile(context.root.get(TLINK_PROFILE_ATTRIBUTE, "full"))
+    if tlink_profile == "full":
+        assert n_tlinks == n_events ** 2 - n_events
+    else:
+        assert n_tlinks <= n_events ** 2 - n_events
+
+    graph, error = complete_graph(graph, tlink_profile)
+    return graph, event_vocab, error
+
+
+def _resize_graph(graph, n_events):
+    resized = -1 * np.ones((n_events, n_events), dtype=np.int8)
+    if graph is not None:
+        resized[:len(graph), :len(graph)] = graph
+    return resized
+
+
+class GraphCache(conversion_cache.NpzCache):
+    """Directory with one .npz file per TimeML file: graph, event vocabulary and error of read_graph.
+
+    Entries are keyed by the hash of the file contents. Event vocabularies are in document order,
+    so cached graphs are the same in every process.
+
+    Args:
+        cache_dir: directory for the cache files, created if it does not exist
+        max_size: maximum total size of the cache files in bytes
+    """
+    @staticmethod
+    def make_key(data):
+        """sha256 of the file contents and GRAPH_CACHE_VERSION"""
+        key = hashlib.sha256()
+        key.update(f"graph cache version {GRAPH_CACHE_VERSION}\n".encode("utf-8"))
+        key.update(data)
+        return key.hexdigest()
+
+    def read_graph(self, file, event_vocab=None):
+        """Same as read_graph, using this cache"""
+        if isinstance(file, (str, os.PathLike)):
+            with open(file, "rb") as f:
+                data = f.read()
+        else:
+            data = file.read()
+
+        key = self.make_key(data)
+        entry = self.get_arrays(key)
+        if entry is None:
+            graph, file_vocab, error = read_graph(io.BytesIO(data))
+            self.put_arrays(key, graph=graph, event_ids=np.array(list(file_vocab), dtype=str), error=np.array(error or ""))
+        else:
+            graph = entry["graph"]
+            file_vocab = {event_id: i for i, event_id in enumerate(entry["event_ids"].tolist())}
+            error = str(entry["error"]) or None
+
+        if event_vocab is None:
+            return graph, file_vocab, error
+
+        n_events = len(file_vocab)
+        if event_vocab.keys() != file_vocab.keys() or set(event_vocab.values()) != set(range(n_events)):
+            # vocabulary of another document, TLINKs of some ids are missing or unknown
+            return read_graph(io.BytesIO(data), event_vocab)
+
+        order = np.empty(n_events, dtype=np.int64)
+        for event_id, i in event_vocab.items():
+            order[i] = file_vocab[event_id]
+        return graph[np.ix_(order, order)], event_vocab, error
+
+
+def is_archive(path):
+    return path.endswith(ARCHIVE_SUFFIX)
+
+
+def save_relation_bundle(file, annotation, events_and_timexes, relation_matrix):
+    """Saves a converted document as .npz
+
+    Arrays:
+        doc_id, text: str
+        event_ids: str array of shape (n_events,), order of the relation matrix (event vocabulary)
+        spans: int32 array of shape (n_events, 2), word-level spans
+        types: int8 array of shape (n_events,), event_relations.TYPE_TO_ID values
+        is_timex: bool array of shape (n_events,)
+        relation_matrix: int8 array of shape (n_events, n_events), REL_TO_ID values, -1 on the diagonal
+        events_and_timexes: utf-8 json of the event dictionaries (output of get_events_and_timexes)
+
+    Args:
+        file: path or binary file object
+        events_and_timexes, relation_matrix: output of conversion_cache.convert_document
+    """
+    events = list(events_and_timexes.values())
+    np.savez(
+        file,
+        doc_id=np.array(annotation["id"]),
+        text=np.array(annotation["text"]),
+        event_ids=np.array(list(events_and_timexes.keys()), dtype=str),
+        spans=np.array([event["span"] for event in events], dtype=np.int32).reshape(-1, 2),
+        types=np.array([TYPE_TO_ID[event["event_type"]] for event in events], dtype=np.int8),
+        is_timex=np.array([event["is_timex"] for event in events], dtype=bool),
+        relation_matrix=np.asarray(relation_matrix, dtype=np.int8),
+        events_and_timexes=np.frombuffer(json.dumps(events_and_timexes).encode("utf-8"), dtype=np.uint8),
+    )
+
+
+def load_relation_bundle(file):
+    """Loads a document saved with save_relation_bundle
+
+    Returns:
+        dict: same keys as in save_relation_bundle, doc_id and text are str,
+            events_and_timexes is a dict (same as get_events_and_timexes)
+    """
+    with np.load(file) as bundle:
+        loaded = {k: bundle[k] for k in bundle.files}
+
+    loaded["doc_id"] = str(loaded["doc_id"])
+    loaded["text"] = str(loaded["text"])
+    loaded["events_and_timexes"] = json.loads(loaded["events_and_timexes"].tobytes())
+    return loaded
+
+
+class TimeMLCorpus:
+    """Converted TimeML documents in a folder of .tml files or in a .zip archive
+
+    Args:
+        path: nt2tml output folder or .zip archive
+    """
+    def __init__(self, path):
+        self.path = path
+        self._archive = None
+
+        if is_archive(path):
+            self._archive = zipfile.ZipFile(path)
+            # the central directory of the archive is the member index
+            names = self._archive.namelist()
+        else:
+            if not os.path.isdir(path):
+                raise FileNotFoundError(f"Can't find {path}")
+            names = sorted(os.listdir(path))
+
+        # documents converted with --output_format npz only have a relation bundle
+        documents = [os.path.splitext(name) for name in names]
+        self.doc_ids = list(dict.fromkeys(doc_id for doc_id, suffix in documents if suffix in (TML_SUFFIX, NPZ_SUFFIX)))
+        self._doc_id_set = set(self.doc_ids)
+        self._names = set(names)
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._doc_id_set
+
+    def __iter__(self):
+        return iter(self.doc_ids)
+
+    def _open(self, doc_id, suffix):
+        name = doc_id + suffix
+        if name not in self._names:
+            raise KeyError(f"Document {doc_id} ({suffix}) is not in {self.path}")
+
+        if self._archive is not None:
+            return self._archive.open(name)
+        return open(os.path.join(self.path, name), "rb")
+
+    def read(self, doc_id):
+        """xml string of the document"""
+        with self._open(doc_id, TML_SUFFIX) as f:
+            return f.read().decode("utf-8")
+
+    def relation_bundle(self, doc_id):
+        """Relation bundle of the document (see load_relation_bundle), input for NTAnnotation.from_relation_bundle"""
+        with self._open(doc_id, NPZ_SUFFIX) as f:
+            if self._archive is not None:
+                f = io.BytesIO(f.read())  # np.load needs a seekable file
+            return load_relation_bundle(f)
+
+    def graph(self, doc_id, event_vocab=None, cache=None):
+        """Relation graph of the document, see read_graph
+
+        Args:
+            cache: (optional) GraphCache, graphs of unchanged documents are loaded from it
+        """
+        with self._open(doc_id, TML_SUFFIX) as f:
+            if cache is not None:
+                return cache.read_graph(f, event_vocab)
+            return read_graph(f, event_vocab)
+
+    def soup(self, doc_id):
+        """BeautifulSoup object of the document, input for make_graph"""
+        return BeautifulSoup(self.read(doc_id), "xml")
+
+    def close(self):
+        if self._archive is not None:
+            self._archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -10,4 +10,5 @@ setup(
     url="https://github.com/text-machine-lab/narrative_time",
     license="MIT",
     requires=requirements,
+    extras_require={"zstd": ["zstandard"]},  # reading .zst annotation files
 )
@@ -1,17 +1,21 @@
 import jsonlines
 
+from narrative_time import conversion_utils
+
 tml_file = "../corpus/timebank/nt_format/tbd_tml_metadata.jsonl"
 annotated_file = "../corpus/timebank/nt_format/tbd_a1.jsonl"
 
-with jsonlines.open(tml_file) as tml:
-    with jsonlines.open(annotated_file) as annotation:
-        for a in annotation:
-            for t in tml:
-                if t["id"] == a["id"]:
-                    try:
-                        a["timex_refs"] = t["timex_refs"]
-                        a["event_refs"] = t["event_refs"]
-                    except KeyError:
-                        pass
-            with jsonlines.open(annotated_file.replace(".jsonl", "_tml.jsonl"), mode="a") as f:
-                f.write(a)
\ No newline at end of file
+# metadata documents are read by id using the sidecar index (tbd_tml_metadata.jsonl.idx)
+tml_index = conversion_utils.get_annotation_index(tml_file)
+
+with jsonlines.open(annotated_file) as annotation:
+    for a in annotation:
+        if a["id"] in tml_index:
+            t = tml_index.read_document(a["id"])
+            try:
+                a["timex_refs"] = t["timex_refs"]
+                a["event_refs"] = t["event_refs"]
+            except KeyError:
+                pass
+        with jsonlines.open(annotated_file.replace(".jsonl", "_tml.jsonl"), mode="a") as f:
+            f.write(a)
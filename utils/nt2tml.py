@@ -7,15 +7,26 @@ Usage example:
 """
 
 import os
+import sys
+import json
+import shutil
+import zipfile
+import tempfile
 import traceback
 import argparse
+import multiprocessing
+from collections import deque
 
+import numpy as np
 from loguru import logger
 from tqdm import tqdm
 from bs4 import BeautifulSoup, NavigableString
 
 from narrative_time import event_relations
+from narrative_time import consistency
+from narrative_time import conversion_cache
 from narrative_time import conversion_utils as utils
+from narrative_time import timeml_corpus
 
 
 # optional fields for text2xml:
@@ -127,7 +138,7 @@ def get_factuality_tags(events_and_timexes, soup):
     return tags
 
 
-def get_tlinks(events_and_timexes, soup):
+def get_tlinks(events_and_timexes, soup, relations=None):
     """Converting tlink annotation to FactBank format
 
     Args:
@@ -142,30 +153,35 @@ def get_tlinks(events_and_timexes, soup):
                 ...
             }
 
+        relations (np.ndarray): (optional) relation matrix of events_and_timexes, computed if not provided
+
     Returns:
         list: list of  BS4 tags with TLINK
     """
+    if relations is None:
+        # parse time, type and branch of every event once
+        records = [event_relations.EventRecord.from_dict(event, id=eeid) for eeid, event in events_and_timexes.items()]
+        relations = event_relations.get_relation_matrix(*event_relations.encode_events(records))
+    branches = [event.get("branch", "") for event in events_and_timexes.values()]
+
     lid = 1
     tlinks = []
-    for eeid1, event1 in events_and_timexes.items():
-        for eeid2, event2 in events_and_timexes.items():
-            if eeid1 == eeid2: continue
+    for i, (eeid1, event1) in enumerate(events_and_timexes.items()):
+        for j, (eeid2, event2) in enumerate(events_and_timexes.items()):
+            if i == j: continue
 
             key1 = "timeID" if event1["is_timex"] else "eventInstanceID"
             key2 = "relatedToTime" if event2["is_timex"] else "relatedToEventInstance"
             kwargs = {key1: eeid1, key2: eeid2}
+            relation = event_relations.ID_TO_REL[relations[i, j]]
 
-            if event1["branch"] == event2["branch"]:
-                relation = event_relations.get_event_relation(event1, event2)
-
+            if branches[i] == branches[j]:
                 tlink = soup.new_tag("TLINK", relType=relation, lid=lid, **kwargs)
                 tlinks.append(tlink)
                 lid += 1
                 continue
-            
-            # different branches
-            relation = event_relations.get_event_relation_separate_branches(event1, event2)
 
+            # different branches
             tlink = soup.new_tag("TLINK", relType=relation, lid=lid, comment="different NT-branches", **kwargs)
             tlinks.append(tlink)
             lid += 1
@@ -173,11 +189,13 @@ def get_tlinks(events_and_timexes, soup):
     return tlinks
 
 
-def convert_to_timeml(annotation, add_narrative_time_info, corpus_offset=0):
+def convert_to_timeml(annotation, add_narrative_time_info, corpus_offset=0, cache=None):
+    """Converts the annotation into a BeautifulSoup TimeML object. parse_nt_json uses write_timeml, which writes the same output"""
     # convert NarrativeTime format to a json of the following format:
     # {'t0': {'span': [5, 6], 'is_timex': True, 'type': '[B]', 'time': '1', 'relto': '', 'factuality': ''},
     # 'ei0': {'span': [94, 94], 'is_timex': False, 'eid': '0', 'type': '[U}', 'time': '-0.1', 'relto': '', 'factuality': ''},
-    events_and_timexes = utils.get_events_and_timexes(annotation, corpus_offset=corpus_offset)
+    # events and relations are loaded from the conversion cache if it is enabled (see conversion_cache)
+    events_and_timexes, relations = conversion_cache.convert_document(annotation, corpus_offset=corpus_offset, cache=cache)
 
     # Step 2: make XML header with "TEXT" and "MAKEINSTANCE"
     soup = text2xml(
@@ -188,7 +206,7 @@ def convert_to_timeml(annotation, add_narrative_time_info, corpus_offset=0):
 
     # Step 3: add tags
     factuality_tags = get_factuality_tags(events_and_timexes, soup)
-    tlinks = get_tlinks(events_and_timexes, soup)
+    tlinks = get_tlinks(events_and_timexes, soup, relations=relations)
 
     # Step 4: add tags to the soup
     for tag in factuality_tags + tlinks:
@@ -197,60 +215,728 @@ def convert_to_timeml(annotation, add_narrative_time_info, corpus_offset=0):
     return soup
 
 
-def parse_nt_json(input_file, output_dir, use_global_eiid=True, add_narrative_time_info=False, verbocity=1):
+# streaming serialization, writes the same bytes as utils.prettify_soup(convert_to_timeml(...))
+# without building the BeautifulSoup tree: tags are formatted the same way as BeautifulSoup does it
+# (attributes sorted by name, "minimal" entity substitution) and prettify_soup newlines are added directly
+
+XML_HEADER = '<?xml version="1.0" encoding="utf-8"?>\n\n<TimeML>\n\n'
+XML_FOOTER = "\n\n</TimeML>\n\n"
+
+
+def xml_header(tlink_profile="full"):
+    if tlink_profile == "full":
+        return XML_HEADER
+    return f'<?xml version="1.0" encoding="utf-8"?>\n\n<TimeML {timeml_corpus.TLINK_PROFILE_ATTRIBUTE}="{tlink_profile}">\n\n'
+
+
+def _xml_escape(text):
+    # prettify_soup doubles every newline, including the ones inside text and attribute values
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace("\n", "\n\n")
+
+
+def _xml_quote(value):
+    value = _xml_escape("" if value is None else str(value))
+    if '"' not in value:
+        return f'"{value}"'
+    if "'" not in value:
+        return f"'{value}'"
+    return '"' + value.replace('"', "&quot;") + '"'
+
+
+def _xml_tag(name, attributes, text=None):
+    """<name attributes/> or <name attributes>text</name>"""
+    attributes = "".join(f" {k}={_xml_quote(v)}" for k, v in sorted(attributes.items()))
+    if text is None:
+        return f"<{name}{attributes}/>"
+    return f"<{name}{attributes}>{_xml_escape(text)}</{name}>"
+
+
+def write_text(f, text, events_and_timexes, add_narrative_time_info=False):
+    """Writes the text with TIMEX3 and EVENT tags and MAKEINSTANCE tags, same as text2xml without the header"""
+    tokenidx2event = {e["span"][0]: {**e, "eiid": k} for k, e in events_and_timexes.items()}
+
+    parts = []
+    instances = []
+
+    tokens = text.split(" ")
+    for instance in range(len(tokens)):
+        if instance not in tokenidx2event:
+            parts.append(_xml_escape(f"{tokens[instance]} "))
+            continue
+
+        event = tokenidx2event[instance]
+        l, r = event["span"]
+        span_text = " ".join(tokens[l:r + 1])
+
+        if event["is_timex"]:
+            to_pass = {k: event[k] for k in TIMEX3_FIELDS if k in event and k != "type"}
+            if add_narrative_time_info:
+                to_pass.update({nt_k: event[k] for k, nt_k in NT_FIELDS_DICT.items()})
+            assert event["eiid"].startswith("t")
+            parts.append(_xml_tag("TIMEX3", {"tid": event["eiid"], **to_pass}, span_text))
+            continue
+
+        to_pass = {k: event[k] for k in EVENT_FIELDS if k in event}
+        if add_narrative_time_info:
+            to_pass.update({nt_k: event[k] for k, nt_k in NT_FIELDS_DICT.items()})
+        parts.append(_xml_tag("EVENT", {"eid": event["eid"], **to_pass}, span_text))
+
+        to_pass_instance = {k: event[k] for k in MAKEINSTANCE_FIELDS if k in event}
+        assert not event["eiid"].startswith("t")
+        instances.append("\n" + _xml_tag("MAKEINSTANCE", {"eiid": event["eiid"], "eventID": event["eid"], **to_pass_instance}))
+
+    f.write("".join(parts))
+    f.write("".join(instances))
+
+
+def write_factuality_tags(f, events_and_timexes):
+    """Writes FACT_VALUE tags, same as get_factuality_tags"""
+    codes = {"": "CT+", "-": "CT-", "m": "PS+", "m-": "PS-"}
+    tags = []
+    for eiid, event in events_and_timexes.items():
+        if event["is_timex"]: continue
+        tags.append("\n" + _xml_tag("FACT_VALUE", {"fvid": len(tags) + 1, "eiid": eiid, "value": codes[event["factuality"]]}))
+    f.write("".join(tags))
+
+
+def write_tlinks(f, events_and_timexes, relations, tlink_profile="full"):
+    """Writes TLINK tags one row of the relation matrix at a time
+
+    Args:
+        tlink_profile: "full" writes every ordered pair, same as get_tlinks, see timeml_corpus.TLINK_PROFILES for the others
+    """
+    if tlink_profile not in timeml_corpus.TLINK_PROFILES:
+        raise ValueError(f"Unknown TLINK profile {tlink_profile}, expected one of {timeml_corpus.TLINK_PROFILES}")
+
+    n_events = len(events_and_timexes)
+    if tlink_profile == "reduced":
+        reduced = consistency.reduce_relations(relations)
+    elif tlink_profile != "full":
+        # pairs where the relation of (B, A) is not the inverse of (A, B) are written in both directions
+        asymmetric = relations != event_relations.INVERSE_REL_ID[relations.T]
+        vague = event_relations.REL_TO_ID["VAGUE"]
+
+    branches = [event.get("branch", "") for event in events_and_timexes.values()]
+    # attributes in the sorted order: comment, eventInstanceID, lid, relType, relatedTo*, timeID
+    sources = [
+        ("", f" timeID={_xml_quote(eeid)}") if event["is_timex"] else (f"eventInstanceID={_xml_quote(eeid)} ", "")
+        for eeid, event in events_and_timexes.items()
+    ]
+    targets = [
+        f"relatedToTime={_xml_quote(eeid)}" if event["is_timex"] else f"relatedToEventInstance={_xml_quote(eeid)}"
+        for eeid, event in events_and_timexes.items()
+    ]
+    comment = 'comment="different NT-branches" '
+
+    lid = 1
+    for i, (source, source_end) in enumerate(sources):
+        columns = np.ones(n_events, dtype=bool)
+        columns[i] = False
+        if tlink_profile == "reduced":
+            columns = reduced[i] != -1
+        elif tlink_profile != "full":
+            columns[:i] = asymmetric[i, :i]
+        if tlink_profile == "one_direction_no_vague":
+            columns &= (relations[i] != vague) | asymmetric[i]
+
+        row = []
+        row_relations = relations[i].tolist()
+        for j in np.flatnonzero(columns).tolist():
+            relation = event_relations.ID_TO_REL[row_relations[j]]
+            attributes = f'{source}lid="{lid}" relType="{relation}" {targets[j]}{source_end}'
+            if branches[i] != branches[j]:
+                attributes = comment + attributes
+            row.append(f"\n<TLINK {attributes}/>")
+            lid += 1
+        f.write("".join(row))
+
+
+def write_timeml(f, annotation, add_narrative_time_info=False, corpus_offset=0, cache=None, tlink_profile="full"):
+    """Converts the annotation and writes TimeML to the text file object f as it is produced.
+
+    Output is the same as utils.prettify_soup(convert_to_timeml(...)), but memory grows with the number of events,
+    not with the number of TLINKs. Other TLINK profiles (see timeml_corpus.TLINK_PROFILES) write fewer TLINKs.
+    """
+    events_and_timexes, relations = conversion_cache.convert_document(annotation, corpus_offset=corpus_offset, cache=cache)
+    write_converted_timeml(f, annotation["text"], events_and_timexes, relations, add_narrative_time_info, tlink_profile)
+
+
+def write_converted_timeml(f, text, events_and_timexes, relations, add_narrative_time_info=False, tlink_profile="full"):
+    """Same as write_timeml, for a document that is already converted (conversion_cache.convert_document)"""
+    f.write(xml_header(tlink_profile))
+    write_text(f, text, events_and_timexes, add_narrative_time_info=add_narrative_time_info)
+    write_factuality_tags(f, events_and_timexes)
+    write_tlinks(f, events_and_timexes, relations, tlink_profile=tlink_profile)
+    f.write(XML_FOOTER)
+
+
+# tml - TimeML files, npz - relation bundles (see timeml_corpus.save_relation_bundle), both - both of them
+OUTPUT_FORMATS = ["tml", "npz", "both"]
+
+
+def output_files(output_dir, doc_id, output_format="tml"):
+    """Paths of the files written for the document"""
+    suffixes = {
+        "tml": [timeml_corpus.TML_SUFFIX],
+        "npz": [timeml_corpus.NPZ_SUFFIX],
+        "both": [timeml_corpus.TML_SUFFIX, timeml_corpus.NPZ_SUFFIX],
+    }[output_format]
+    return [os.path.join(output_dir, doc_id + suffix) for suffix in suffixes]
+
+
+def _conversion_job(job):
+    """Converts one document into output_dir, runs in a worker process when parse_nt_json is called with workers > 1
+
+    Files are written only if the conversion succeeded.
+
+    Args:
+        job: (annotation, corpus_offset, output_dir, cache, options), options are
+            add_narrative_time_info, tlink_profile and output_format
+
+    Returns:
+        (bool, str, str): whether output files were written, error message and formatted traceback (None if there was no error)
+    """
+    annotation, corpus_offset, output_dir, cache, options = job
+    if annotation is None:
+        return False, None, None  # skipped
+
+    outputs = output_files(output_dir, annotation["id"], options["output_format"])
+    tmp_files = [f"{output_file}.{os.getpid()}.tmp" for output_file in outputs]
+    try:
+        # conversion happens here
+        events_and_timexes, relations = conversion_cache.convert_document(annotation, corpus_offset=corpus_offset, cache=cache)
+        for output_file, tmp_file in zip(outputs, tmp_files):
+            if output_file.endswith(timeml_corpus.NPZ_SUFFIX):
+                with open(tmp_file, "wb") as f:
+                    timeml_corpus.save_relation_bundle(f, annotation, events_and_timexes, relations)
+                continue
+
+            with open(tmp_file, "w") as f:
+                write_converted_timeml(
+                    f,
+                    annotation["text"],
+                    events_and_timexes,
+                    relations,
+                    add_narrative_time_info=options["add_narrative_time_info"],
+                    tlink_profile=options["tlink_profile"],
+                )
+
+        for output_file, tmp_file in zip(outputs, tmp_files):
+            os.replace(tmp_file, output_file)
+        return True, None, None
+    except Exception as e:
+        for tmp_file in tmp_files:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+        return False, str(e), traceback.format_exc()
+
+
+# documents in flight per worker process in parallel conversion
+PENDING_JOBS_PER_WORKER = 4
+
+
+def _plan_offsets(annotations, use_global_eiid, will_fail=None):
+    """Yields (document index, annotation, corpus_offset) assuming that every document is converted successfully
+
+    Args:
+        will_fail: (optional) function annotation -> bool, documents that are expected to fail do not move the offset
+    """
+    corpus_offset = 0
+    for doc_idx, annotation in enumerate(annotations):
+        yield doc_idx, annotation, corpus_offset
+        if use_global_eiid and not (will_fail is not None and will_fail(annotation)):
+            corpus_offset += len(annotation["events"])
+
+
+def _iter_conversions(planned, output_dir, use_global_eiid, options, cache, workers, fix_offsets=True, skip=None):
+    """Converts documents in input order.
+
+    In a serial run, corpus_offset only grows after successfully converted documents.
+    Planned offsets (see _plan_offsets) assume that every document is converted. With fix_offsets,
+    documents after a failed one are converted again in this process with the correct offset,
+    so the output is identical to the serial conversion. Without fix_offsets (shards) planned offsets are used as is.
+
+    Args:
+        planned: iterable of (document index, annotation, planned corpus_offset)
+        output_dir: documents are written to output_dir (see output_files)
+        options: add_narrative_time_info, tlink_profile and output_format (see _conversion_job)
+        skip: (optional) function (annotation, corpus_offset) -> bool, documents for which it returns True
+            are not converted (nothing is written, error message and traceback are None), they count as converted
+
+    Yields:
+        (int, dict, int, bool, str, str): document index, annotation, corpus_offset used for conversion,
+            whether the output file was written, error message, formatted traceback
+    """
+    corpus_offset = 0
+
+    def job(annotation, offset, can_skip=True):
+        if can_skip and skip is not None and skip(annotation, offset):
+            annotation = None
+        return annotation, offset, output_dir, cache, options
+
+    def fixed(annotation, planned_offset, result):
+        nonlocal corpus_offset
+        offset = planned_offset
+        if fix_offsets and planned_offset != corpus_offset:
+            offset = corpus_offset
+            # output written with the planned offset has to be replaced even if the document is up to date
+            written = result[0]
+            result = _conversion_job(job(annotation, offset, can_skip=not written))
+            if written and result[1] is not None:
+                for output_file in output_files(output_dir, annotation["id"], options["output_format"]):
+                    os.remove(output_file)
+
+        written, error, error_traceback = result
+        if error is None and use_global_eiid:
+            corpus_offset += len(annotation["events"])
+        return offset, written, error, error_traceback
+
+    if workers <= 1:
+        for doc_idx, annotation, planned_offset in planned:
+            offset = corpus_offset if fix_offsets else planned_offset
+            result = _conversion_job(job(annotation, offset))
+            yield doc_idx, annotation, *fixed(annotation, offset, result)
+        return
+
+    # documents submitted to the pool, in input order. Only a few documents per worker are read ahead,
+    # so that the input is not loaded into memory at once (pool.imap reads all jobs immediately).
+    pending = deque()
+    max_pending = workers * PENDING_JOBS_PER_WORKER
+    planned = iter(planned)
+
+    with multiprocessing.Pool(workers) as pool:
+        def submit():
+            while len(pending) < max_pending:
+                next_planned = next(planned, None)
+                if next_planned is None:
+                    return
+                doc_idx, annotation, planned_offset = next_planned
+                async_result = pool.apply_async(_conversion_job, (job(annotation, planned_offset),))
+                pending.append((doc_idx, annotation, planned_offset, async_result))
+
+        submit()
+        while pending:
+            doc_idx, annotation, planned_offset, async_result = pending.popleft()
+            result = async_result.get()
+            submit()
+            yield doc_idx, annotation, *fixed(annotation, planned_offset, result)
+
+
+class ArchiveOutput:
+    """Moves converted files from a temporary folder into a zip archive one by one.
+
+    The archive is written to path.tmp and renamed to path when it is closed,
+    so an interrupted conversion does not leave a partial archive.
+    """
+    def __init__(self, path):
+        self.path = path
+        output_dir = os.path.dirname(os.path.abspath(path))
+        os.makedirs(output_dir, exist_ok=True)
+        self.tmp_dir = tempfile.mkdtemp(dir=output_dir, prefix=".nt2tml_")
+        self._zip = zipfile.ZipFile(path + ".tmp", "w", compression=zipfile.ZIP_DEFLATED)
+
+    def add(self, output_file):
+        self._zip.write(output_file, arcname=os.path.basename(output_file))
+        os.remove(output_file)
+
+    def close(self, save=True):
+        self._zip.close()
+        if save:
+            os.replace(self.path + ".tmp", self.path)
+        else:
+            os.remove(self.path + ".tmp")
+        shutil.rmtree(self.tmp_dir)
+
+
+MANIFEST_FILE = "nt2tml_manifest.json"
+
+
+class IncrementalManifest:
+    """Documents converted into an output folder: document id -> input hash, corpus_offset and output files.
+
+    Saved as MANIFEST_FILE in the output folder. A document is skipped if its hash and corpus_offset did not change
+    and its output files exist. Documents that failed are saved with their hash, so unchanged failed documents
+    are expected to fail again when offsets are planned for parallel conversion.
+    """
+    def __init__(self, output_dir, settings):
+        self.output_dir = output_dir
+        self.settings = settings
+        self.documents = {}
+        self.failed = {}
+
+        path = os.path.join(output_dir, MANIFEST_FILE)
+        if os.path.exists(path):
+            with open(path) as f:
+                manifest = json.load(f)
+            if manifest["settings"] == settings:
+                self.documents = manifest["documents"]
+                self.failed = manifest["failed"]
+            else:
+                # outputs of the previous settings (e.g. another output_format) would be left behind otherwise
+                logger.info("Conversion settings changed, removing previous outputs and converting all documents again")
+                for document in manifest["documents"].values():
+                    self._remove_output(document)
+
+        self._hashes = {}  # id -> hash of the current input
+        self.skipped = []
+        self.seen = set()
+
+    def hash(self, annotation):
+        doc_id = annotation["id"]
+        if doc_id not in self._hashes:
+            self._hashes[doc_id] = conversion_cache.document_hash(annotation)
+        return self._hashes[doc_id]
+
+    def will_fail(self, annotation):
+        return self.failed.get(annotation["id"]) == self.hash(annotation)
+
+    def is_up_to_date(self, annotation, corpus_offset):
+        document = self.documents.get(annotation["id"])
+        return (
+            document is not None
+            and document["hash"] == self.hash(annotation)
+            and document["corpus_offset"] == corpus_offset
+            and all(os.path.exists(os.path.join(self.output_dir, output)) for output in document["outputs"])
+        )
+
+    def update(self, annotation, corpus_offset, outputs, error):
+        doc_id = annotation["id"]
+        self.seen.add(doc_id)
+        if error is not None:
+            self.failed[doc_id] = self.hash(annotation)
+            self._remove_output(self.documents.pop(doc_id, None))  # output of the previous version is outdated
+            return
+
+        self.failed.pop(doc_id, None)
+        self.documents[doc_id] = {
+            "hash": self.hash(annotation),
+            "corpus_offset": corpus_offset,
+            "outputs": [os.path.basename(output_file) for output_file in outputs],
+        }
+
+    def _remove_output(self, document):
+        if document is None:
+            return
+        outputs = document["outputs"] if "outputs" in document else [document["output"]]  # manifests before output_format
+        for output in outputs:
+            path = os.path.join(self.output_dir, output)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def remove_deleted(self):
+        """Deletes outputs of documents that are not in the input anymore, returns their ids"""
+        deleted = [doc_id for doc_id in self.documents if doc_id not in self.seen]
+        for doc_id in deleted:
+            self._remove_output(self.documents.pop(doc_id))
+        self.failed = {doc_id: h for doc_id, h in self.failed.items() if doc_id in self.seen}
+        return deleted
+
+    def save(self):
+        path = os.path.join(self.output_dir, MANIFEST_FILE)
+        manifest = {"settings": self.settings, "documents": self.documents, "failed": self.failed}
+        with open(path + ".tmp", "w") as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(path + ".tmp", path)
+
+
+def shard_manifest_path(output_dir, shard):
+    shard_idx, n_shards = shard
+    return os.path.join(output_dir, f"nt2tml_shard_{shard_idx}_of_{n_shards}.json")
+
+
+def parse_nt_json(
+        input_file,
+        output_dir,
+        use_global_eiid=True,
+        add_narrative_time_info=False,
+        verbocity=1,
+        cache=None,
+        workers=1,
+        tlink_profile="full",
+        output_format="tml",
+        shard=None,
+        shard_by="index",
+        incremental=False,
+    ):
+    """Converts NarrativeTime jsonl file into TimeML files (one per document) in output_dir.
+
+    If output_dir ends with .zip, all documents are written into one zip archive instead (see timeml_corpus.TimeMLCorpus).
+    tlink_profile selects which TLINKs are written, see timeml_corpus.TLINK_PROFILES.
+    output_format selects the files written for every document, see OUTPUT_FORMATS.
+
+    With shard ("i/n", see conversion_utils.in_shard) only the documents of the shard are converted.
+    Eiid offsets are computed from all documents of the file, assuming that all of them are converted successfully,
+    and a manifest of the shard is saved to output_dir. Use merge_shards to combine the shards.
+
+    With incremental, only documents that changed (or got a different eiid offset) since the previous
+    incremental run into output_dir are converted, and outputs of documents removed from input_file are deleted.
+    See IncrementalManifest.
+
+    Returns:
+        dict: ids of "converted", "skipped" (incremental), "deleted" (incremental) and "failed" documents
+    """
     if not os.path.exists(input_file):
         raise FileNotFoundError(f"Can't find {input_file}")
+    if incremental and shard is not None:
+        raise ValueError("incremental conversion of shards is not supported")
+    if tlink_profile not in timeml_corpus.TLINK_PROFILES:
+        raise ValueError(f"Unknown TLINK profile {tlink_profile}, expected one of {timeml_corpus.TLINK_PROFILES}")
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format {output_format}, expected one of {OUTPUT_FORMATS}")
+    options = {
+        "add_narrative_time_info": add_narrative_time_info,
+        "tlink_profile": tlink_profile,
+        "output_format": output_format,
+    }
+
+    archive = None
+    if timeml_corpus.is_archive(output_dir):
+        if incremental or shard is not None:
+            raise ValueError("incremental and sharded conversion need an output folder, not an archive")
+        archive = ArchiveOutput(output_dir)
+        output_dir = archive.tmp_dir
     os.makedirs(output_dir, exist_ok=True)
 
-    annotations = utils.get_annotations(input_file)
+    manifest = None
+    if incremental:
+        settings = {
+            "conversion_version": conversion_cache.CONVERSION_VERSION,
+            "use_global_eiid": use_global_eiid,
+            **options,
+        }
+        manifest = IncrementalManifest(output_dir, settings)
+
+    planned = _plan_offsets(utils.iter_annotations(input_file), use_global_eiid, will_fail=manifest and manifest.will_fail)
+    if shard is not None:
+        shard = utils.parse_shard(shard)
+        planned = (job for job in planned if utils.in_shard(job[0], job[1]["id"], shard, shard_by))
+
+    conversions = _iter_conversions(
+        planned,
+        output_dir=output_dir,
+        use_global_eiid=use_global_eiid,
+        options=options,
+        cache=cache,
+        workers=workers,
+        fix_offsets=shard is None,
+        skip=manifest and manifest.is_up_to_date,
+    )
 
     n_errors = 0
-    n_files = len(annotations)
+    n_files = 0
+    error_summary = ""
+    manifest_documents = []
+    report = {"converted": [], "skipped": [], "deleted": [], "failed": []}
+
+    try:
+        for doc_idx, annotation, corpus_offset, written, error, error_traceback in tqdm(conversions, desc="Converting to TimeML", disable=verbocity==0):
+            n_files += 1
+            manifest_documents.append({
+                "index": doc_idx,
+                "id": annotation["id"],
+                "corpus_offset": corpus_offset,
+                "n_events": len(annotation["events"]),
+                "error": error,
+            })
+            outputs = output_files(output_dir, annotation["id"], output_format)
+            if manifest is not None:
+                if not written and error is None:
+                    report["skipped"].append(annotation["id"])
+                    manifest.seen.add(annotation["id"])
+                    continue
+                manifest.update(annotation, corpus_offset, outputs, error)
+
+            if error is not None:
+                report["failed"].append(annotation["id"])
+                n_errors += 1
+                error_summary += f"{annotation['id']}: {error}\n"
+                if verbocity > 0:
+                    logger.error(f"Error converting {annotation['id']}")
+                    print(error_traceback, file=sys.stderr, end="")
+                continue
+
+            report["converted"].append(annotation["id"])
+            if archive is not None:
+                for output_file in outputs:
+                    archive.add(output_file)
+    except BaseException:
+        if archive is not None:
+            archive.close(save=False)
+        raise
+
+    if archive is not None:
+        archive.close()
+
+    if shard is not None:
+        shard_manifest = {
+            "input_file": os.path.basename(input_file),
+            "shard": list(shard),
+            "shard_by": shard_by,
+            "use_global_eiid": use_global_eiid,
+            **options,
+            "documents": manifest_documents,
+        }
+        with open(shard_manifest_path(output_dir, shard), "w") as f:
+            json.dump(shard_manifest, f, indent=1)
+
+    if manifest is not None:
+        report["deleted"] = manifest.remove_deleted()
+        manifest.save()
+        if verbocity > 0:
+            logger.info(f"Incremental conversion: {len(report['converted'])} converted, "
+                        f"{len(report['skipped'])} skipped (unchanged), {len(report['deleted'])} deleted (removed from the input)")
+        if verbocity > 1:
+            for k in ["skipped", "deleted"]:
+                if report[k]:
+                    logger.info(f"{k.capitalize()}: {', '.join(report[k])}")
+
+    if verbocity > 0:
+        logger.info(f"Converted {n_files - n_errors} out of {n_files} files")
+
+    if n_errors > 0:
+        # required for the tests to work correctly and fail when the script it not working
+        raise ValueError(f"Conversion finished with {n_errors} errors out of {n_files} files.\n\n" + error_summary)
+
+    return report
+
+
+def merge_shards(input_file, shard_dirs, output_dir, verbocity=1, cache=None):
+    """Combines outputs of parse_nt_json shards into the output of a single (non-sharded) run.
+
+    Checks that the shards were converted with the same settings and that every document of input_file
+    was converted by exactly one shard. Shards do not know about failed documents in other shards,
+    so documents after a failed one get different eiid offsets than in a single run. They are converted again.
+
+    Returns:
+        int: number of documents that were converted again
+    """
+    manifests = []
+    for shard_dir in shard_dirs:
+        for file_name in sorted(os.listdir(shard_dir)):
+            if file_name.startswith("nt2tml_shard_") and file_name.endswith(".json"):
+                with open(os.path.join(shard_dir, file_name)) as f:
+                    manifests.append((shard_dir, json.load(f)))
+
+    if len(manifests) == 0:
+        raise RuntimeError(f"No shard manifests found in {shard_dirs}")
+
+    settings = {
+        (
+            m["shard"][1], m["shard_by"], m["use_global_eiid"], m["add_narrative_time_info"],
+            m.get("tlink_profile", "full"), m.get("output_format", "tml"),
+        )
+        for _, m in manifests
+    }
+    if len(settings) > 1:
+        raise RuntimeError(
+            "Shards were converted with different settings (n_shards, shard_by, use_global_eiid, "
+            f"add_narrative_time_info, tlink_profile, output_format): {settings}"
+        )
+    n_shards, _, use_global_eiid, add_narrative_time_info, tlink_profile, output_format = settings.pop()
+    options = {
+        "add_narrative_time_info": add_narrative_time_info,
+        "tlink_profile": tlink_profile,
+        "output_format": output_format,
+    }
+
+    shard_ids = sorted(m["shard"][0] for _, m in manifests)
+    if shard_ids != list(range(n_shards)):
+        raise RuntimeError(f"Expected shards 0..{n_shards - 1} exactly once, got {shard_ids}")
+
+    converted = {}
+    for shard_dir, manifest in manifests:
+        for document in manifest["documents"]:
+            if document["index"] in converted:
+                raise RuntimeError(f"Document {document['id']} was converted by several shards")
+            converted[document["index"]] = (shard_dir, document)
+
+    os.makedirs(output_dir, exist_ok=True)
+    n_errors = 0
+    n_files = 0
+    n_reconverted = 0
     error_summary = ""
     corpus_offset = 0
 
-    for annotation in tqdm(annotations, desc="Converting to TimeML", disable=verbocity==0):
-        try:
-            # conversion happens here
-            timeml_soup = convert_to_timeml(annotation, add_narrative_time_info=add_narrative_time_info, corpus_offset=corpus_offset)
-            soup_str = utils.prettify_soup(timeml_soup)
-            if use_global_eiid:
-                corpus_offset += len(annotation["events"])
-        except Exception as e:
+    for doc_idx, annotation in enumerate(utils.iter_annotations(input_file)):
+        n_files += 1
+        if doc_idx not in converted:
+            raise RuntimeError(f"Document {annotation['id']} (line {doc_idx}) was not converted by any shard")
+
+        shard_dir, document = converted.pop(doc_idx)
+        if document["id"] != annotation["id"]:
+            raise RuntimeError(f"Shards were converted from a different file: {document['id']} != {annotation['id']}")
+
+        if document["error"] is not None:
             n_errors += 1
-            error_summary += f"{annotation['id']}: {e}\n"
-            if verbocity > 0:
-                logger.error(f"Error converting {annotation['id']}")
-                traceback.print_exc()
+            error_summary += f"{annotation['id']}: {document['error']}\n"
             continue
 
-        # save to file
-        output_file = os.path.join(output_dir, f"{annotation['id']}.tml")
-        with open(output_file, "w") as f:
-            f.write(soup_str)
+        if document["corpus_offset"] != corpus_offset:
+            _, error, error_traceback = _conversion_job((annotation, corpus_offset, output_dir, cache, options))
+            if error is not None:
+                raise RuntimeError(f"Document {annotation['id']} was converted by a shard, but failed during merge:\n{error_traceback}")
+            n_reconverted += 1
+        elif os.path.abspath(shard_dir) != os.path.abspath(output_dir):
+            for output_file in output_files(output_dir, annotation["id"], output_format):
+                shutil.copyfile(os.path.join(shard_dir, os.path.basename(output_file)), output_file)
+
+        if use_global_eiid:
+            corpus_offset += len(annotation["events"])
+
+    if converted:
+        raise RuntimeError(f"Shards contain documents that are not in {input_file}: {[d['id'] for _, d in converted.values()]}")
 
     if verbocity > 0:
-        logger.info(f"Converted {n_files - n_errors} out of {n_files} files")
+        logger.info(f"Merged {n_shards} shards: {n_files - n_errors} out of {n_files} files, {n_reconverted} converted again")
 
     if n_errors > 0:
-        # required for the tests to work correctly and fail when the script it not working
         raise ValueError(f"Conversion finished with {n_errors} errors out of {n_files} files.\n\n" + error_summary)
 
+    return n_reconverted
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("--input_file", required=True, help="jsonl data file in NarrativeTime format")
-    parser.add_argument("--output_dir", required=True, help="folder for saving xml files in TimeML format")
-    parser.add_argument("--verbocity", default=1, help="0 - silent, 1 - print final results, 2 - print all")
+    parser.add_argument("--input_file", required=True, help="jsonl data file in NarrativeTime format, can be compressed (.gz, .xz, .zst)")
+    parser.add_argument("--output_dir", required=True, help="folder for saving xml files in TimeML format, or a .zip file to write all documents into one archive")
+    parser.add_argument("--verbocity", default=1, type=int, help="0 - silent, 1 - print final results, 2 - print all")
     parser.add_argument("--add_narrative_time_info", default=False, action="store_true", help="add NarrativeTime tags to the output xml file. Useful for debugging and readability.")
     parser.add_argument("--do_not_use_global_eiid", default=False, action="store_true", help="Always generate eiids starting from 0. Useful for testing.")
+    parser.add_argument("--tlink_profile", default="full", choices=timeml_corpus.TLINK_PROFILES, help="full - TLINKs for every ordered pair of events, one_direction - one TLINK per pair, one_direction_no_vague - also omit VAGUE TLINKs, reduced - minimal set of TLINKs that implies the others")
+    parser.add_argument("--output_format", default="tml", choices=OUTPUT_FORMATS, help="tml - TimeML files, npz - relation bundles (events and the relation matrix, loaded without xml parsing), both - both of them")
+    parser.add_argument("--workers", default=1, type=int, help="number of processes for conversion, output is the same as with one process")
+    parser.add_argument("--cache_dir", default=None, help="cache converted documents in this folder, unchanged documents are not converted again")
+    parser.add_argument("--cache_size", default=conversion_cache.DEFAULT_CACHE_SIZE, type=int, help="maximum size of the cache in bytes")
+    parser.add_argument("--shard", default=None, help="i/n, only convert shard i (0 <= i < n) of the documents. Combine the shards with --merge_shards.")
+    parser.add_argument("--shard_by", default="index", choices=utils.SHARD_BY, help="assign documents to shards round-robin by their position in the file or by the hash of the document id")
+    parser.add_argument("--incremental", default=False, action="store_true", help="only convert documents that changed since the previous --incremental run into --output_dir, delete outputs of removed documents")
+    parser.add_argument("--merge_shards", default=None, nargs="+", help="folders with converted shards of --input_file, merged into --output_dir instead of converting")
     args = parser.parse_args()
 
     logger.info(f"Starting script with args {vars(args)}")
+    cache = conversion_cache.ConversionCache(args.cache_dir, max_size=args.cache_size) if args.cache_dir else None
+
+    if args.merge_shards is not None:
+        merge_shards(
+            input_file=args.input_file,
+            shard_dirs=args.merge_shards,
+            output_dir=args.output_dir,
+            verbocity=args.verbocity,
+            cache=cache,
+        )
+        sys.exit(0)
+
     parse_nt_json(
         input_file=args.input_file,
         output_dir=args.output_dir,
         verbocity=args.verbocity,
         use_global_eiid=not args.do_not_use_global_eiid,
         add_narrative_time_info=args.add_narrative_time_info,
+        cache=cache,
+        workers=args.workers,
+        tlink_profile=args.tlink_profile,
+        output_format=args.output_format,
+        shard=args.shard,
+        shard_by=args.shard_by,
+        incremental=args.incremental,
     )